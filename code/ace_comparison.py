@@ -0,0 +1,166 @@
+############################################################
+#
+# Numerical comparison of ACE files. Both versions are
+# parsed into arrays and compared with relative and
+# absolute tolerances (defaults as in compare_ace_files.sh).
+# Maximal deviations are reported per reaction.
+#
+# Usage:
+#     python ace_comparison.py <path1> <path2> [--jobs N]
+#     python ace_comparison.py --commits <commit1> <commit2> <path>
+#
+#     <path1>, <path2>: ACE files or directories with ACE files
+#     <commit1>, <commit2>: commits with the versions of the ACE
+#                           file at <path> in the git-annex repo,
+#                           directories are not supported
+#
+############################################################
+
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from ace_file import open_ace_table
+from numeric_comparison import compare_arrays, get_annex_path_at_commit
+
+
+DEFAULT_RTOL = 1e-5
+DEFAULT_ATOL = 1e-10
+
+
+def compare_ace_files(file1, file2, rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL):
+    """Compare two ACE files and return a report dictionary.
+
+    The date in the header is ignored. The complete XSS array as well as
+    the cross sections of each reaction are compared, the latter to
+    report the maximal deviations per MT number.
+    """
+    report = {
+        'file1': file1,
+        'file2': file2,
+        'equal': True,
+        'header': [],
+        'xss': None,
+        'reactions': {},
+    }
+    with open_ace_table(file1) as ace1, open_ace_table(file2) as ace2:
+        for field in ('zaid', 'awr', 'temperature', 'mat', 'izaw'):
+            if getattr(ace1, field) != getattr(ace2, field):
+                report['header'].append(field)
+        for field in ('nxs', 'jxs'):
+            if list(getattr(ace1, field)) != list(getattr(ace2, field)):
+                report['header'].append(field)
+        report['xss'] = compare_arrays(ace1.xss, ace2.xss, rtol, atol)
+        reactions1 = ace1.reactions
+        reactions2 = ace2.reactions
+        for mt in sorted(set(reactions1) | set(reactions2)):
+            if mt not in reactions1 or mt not in reactions2:
+                report['reactions'][mt] = {'equal': False, 'missing': True}
+                continue
+            rea1 = reactions1[mt]
+            rea2 = reactions2[mt]
+            res = compare_arrays(rea1['xs'], rea2['xs'], rtol, atol)
+            res['missing'] = False
+            if not res['shape_mismatch']:
+                energy_res = compare_arrays(rea1['energy'], rea2['energy'], rtol, atol)
+                res['energy_equal'] = energy_res['equal']
+                res['equal'] = res['equal'] and energy_res['equal']
+            report['reactions'][mt] = res
+    report['equal'] = (
+        len(report['header']) == 0 and report['xss']['equal'] and
+        all(r['equal'] for r in report['reactions'].values())
+    )
+    return report
+
+
+def _compare_ace_files_safe(file1, file2, rtol, atol):
+    try:
+        return compare_ace_files(file1, file2, rtol, atol)
+    except (OSError, ValueError, IndexError) as exc:
+        return {'file1': file1, 'file2': file2, 'equal': False, 'error': str(exc)}
+
+
+def is_ace_filename(fname):
+    return not fname.endswith('.xsd') and not fname.startswith('.')
+
+
+def compare_ace_dirs(dir1, dir2, rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL, njobs=None):
+    """Compare all ACE files present in two directories.
+
+    Return a list with the report of each file pair
+    and a list of files only present in one of the directories.
+    """
+    files1 = set(f for f in os.listdir(dir1) if is_ace_filename(f))
+    files2 = set(f for f in os.listdir(dir2) if is_ace_filename(f))
+    common = sorted(files1 & files2)
+    unmatched = sorted(files1 ^ files2)
+    with ProcessPoolExecutor(max_workers=njobs) as executor:
+        futures = [
+            executor.submit(_compare_ace_files_safe, os.path.join(dir1, f),
+                            os.path.join(dir2, f), rtol, atol)
+            for f in common
+        ]
+        reports = [fut.result() for fut in futures]
+    return reports, unmatched
+
+
+def print_ace_report(report, verbose=False):
+    if report['equal'] and not verbose:
+        return
+    fname = os.path.basename(report['file2'])
+    if 'error' in report:
+        print(f'error for {fname}: {report["error"]}')
+        return
+    status = 'no difference' if report['equal'] else 'difference'
+    print(f'{status} for {fname}')
+    if report['header']:
+        print('    header fields: ' + ', '.join(report['header']))
+    for mt, res in report['reactions'].items():
+        if res['equal'] and not verbose:
+            continue
+        if res['missing']:
+            print(f'    MT{mt}: only present in one file')
+        elif res['shape_mismatch']:
+            print(f'    MT{mt}: different number of energies')
+        else:
+            print(f'    MT{mt}: max abs diff {res["max_abs_diff"]:.4e}, '
+                  f'max rel diff {res["max_rel_diff"]:.4e}, '
+                  f'{res["num_differences"]} values differ')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='+', help='files or directories to compare')
+    parser.add_argument('--commits', nargs=2, default=None,
+                        help='compare the versions of a file (not a directory) at two commits')
+    parser.add_argument('--rtol', type=float, default=DEFAULT_RTOL)
+    parser.add_argument('--atol', type=float, default=DEFAULT_ATOL)
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    if args.commits is not None:
+        if len(args.paths) != 1:
+            parser.error('exactly one path expected together with --commits')
+        if os.path.isdir(args.paths[0]):
+            parser.error('--commits only supports files, not directories')
+        path1 = get_annex_path_at_commit(args.commits[0], args.paths[0])
+        path2 = get_annex_path_at_commit(args.commits[1], args.paths[0])
+    else:
+        if len(args.paths) != 2:
+            parser.error('exactly two paths expected')
+        path1, path2 = args.paths
+
+    if os.path.isdir(path1):
+        reports, unmatched = compare_ace_dirs(path1, path2, args.rtol, args.atol, args.jobs)
+        for fname in unmatched:
+            print(f'only present in one directory: {fname}')
+    else:
+        reports = [compare_ace_files(path1, path2, args.rtol, args.atol)]
+        unmatched = []
+    for report in reports:
+        print_ace_report(report, args.verbose)
+    if unmatched or not all(r['equal'] for r in reports):
+        sys.exit(1)
@@ -0,0 +1,227 @@
+############################################################
+#
+# Reader for type-1 (ASCII) ACE files as produced by the
+# ACER module of NJOY2016. The header, NXS and JXS arrays
+# are parsed when the file is opened, the XSS array is
+# memory-mapped and converted block-wise on demand.
+#
+# Usage:
+#     python ace_file.py <ace-file>
+#
+#     <ace-file>: An ACE file as used for MCNP calculations
+#
+############################################################
+
+import os
+import sys
+import mmap
+import numpy as np
+
+
+# number of XSS lines converted at once
+XSS_BLOCK_LINES = 4096
+XSS_VALUES_PER_LINE = 4
+XSS_FIELD_WIDTH = 20
+
+
+class AceTable:
+    """Lazy reader of a type-1 ACE table.
+
+    JXS pointers are 1-based as in the ACE format specification,
+    `get_xss(start, length)` accepts such pointers directly.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._blocks = {}
+        self._reactions = None
+        self._parse_header()
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _parse_header(self):
+        mm = self._mmap
+        lines = []
+        pos = 0
+        for i in range(12):
+            end = mm.find(b'\n', pos)
+            if end == -1:
+                raise ValueError(f'{self.filename} is too short for an ACE file')
+            lines.append(mm[pos:end].decode('ascii'))
+            pos = end + 1
+        if lines[0][:10].strip().count('.') != 1:
+            raise ValueError('only legacy type-1 ACE headers are supported')
+        self.zaid = lines[0][0:10].strip()
+        self.awr = float(lines[0][10:22])
+        self.temperature = float(lines[0][22:34])
+        self.date = lines[0][34:45].strip()
+        self.comment = lines[1][:70].rstrip()
+        self.mat = lines[1][70:80].strip()
+        izaw = []
+        for line in lines[2:6]:
+            for j in range(4):
+                field = line[18*j:18*(j+1)]
+                izaw.append((int(field[:7]), float(field[7:18])))
+        self.izaw = izaw
+        self.nxs = np.array(' '.join(lines[6:8]).split(), dtype=np.int64)
+        self.jxs = np.array(' '.join(lines[8:12]).split(), dtype=np.int64)
+        if len(self.nxs) != 16 or len(self.jxs) != 32:
+            raise ValueError('unable to parse NXS and JXS arrays')
+        self._xss_offset = pos
+        end = mm.find(b'\n', pos)
+        self._line_width = end - pos + 1
+        if end == -1 or self._line_width < XSS_VALUES_PER_LINE*XSS_FIELD_WIDTH + 1:
+            raise ValueError('unexpected layout of the XSS array')
+
+    @property
+    def xss_length(self):
+        return int(self.nxs[0])
+
+    def _get_xss_block(self, blockidx):
+        block = self._blocks.get(blockidx)
+        if block is not None:
+            return block
+        block_size = XSS_BLOCK_LINES * XSS_VALUES_PER_LINE
+        nvals = min(block_size, self.xss_length - blockidx*block_size)
+        nfull, rest = divmod(nvals, XSS_VALUES_PER_LINE)
+        linewidth = self._line_width
+        fieldswidth = XSS_VALUES_PER_LINE * XSS_FIELD_WIDTH
+        start = self._xss_offset + blockidx * XSS_BLOCK_LINES * linewidth
+        dtype = f'S{XSS_FIELD_WIDTH}'
+        values = []
+        if nfull > 0:
+            raw = np.frombuffer(self._mmap, dtype=np.uint8,
+                                count=nfull*linewidth, offset=start)
+            raw = raw.reshape(nfull, linewidth)
+            if np.any(raw[:, -1] != ord('\n')):
+                raise ValueError('unexpected layout of the XSS array')
+            fields = np.ascontiguousarray(raw[:, :fieldswidth])
+            values.append(fields.view(dtype).reshape(-1).astype(np.float64))
+        if rest > 0:
+            pos = start + nfull*linewidth
+            line = self._mmap[pos:pos + rest*XSS_FIELD_WIDTH]
+            values.append(np.frombuffer(line, dtype=dtype).astype(np.float64))
+        block = np.concatenate(values) if len(values) > 1 else values[0]
+        self._blocks[blockidx] = block
+        return block
+
+    def get_xss(self, start, length):
+        """Return `length` XSS values beginning at 1-based index `start`."""
+        if length <= 0:
+            return np.empty(0, dtype=np.float64)
+        first = start - 1
+        last = first + length
+        if first < 0 or last > self.xss_length:
+            raise IndexError('XSS index out of range')
+        block_size = XSS_BLOCK_LINES * XSS_VALUES_PER_LINE
+        first_block = first // block_size
+        last_block = (last - 1) // block_size
+        blocks = [self._get_xss_block(i) for i in range(first_block, last_block+1)]
+        values = np.concatenate(blocks) if len(blocks) > 1 else blocks[0]
+        offset = first_block * block_size
+        return values[first-offset:last-offset]
+
+    @property
+    def xss(self):
+        """Return the complete XSS array."""
+        return self.get_xss(1, self.xss_length)
+
+    @property
+    def energy_grid(self):
+        nes = int(self.nxs[2])
+        return self.get_xss(int(self.jxs[0]), nes)
+
+    def _get_esz_array(self, idx):
+        nes = int(self.nxs[2])
+        return self.get_xss(int(self.jxs[0]) + idx*nes, nes)
+
+    @property
+    def reaction_mts(self):
+        ntr = int(self.nxs[3])
+        return [int(x) for x in self.get_xss(int(self.jxs[2]), ntr)]
+
+    def _read_reactions(self):
+        reactions = {}
+        energy = self.energy_grid
+        reactions[1] = {'mt': 1, 'energy': energy, 'xs': self._get_esz_array(1)}
+        reactions[2] = {'mt': 2, 'energy': energy, 'xs': self._get_esz_array(3)}
+        ntr = int(self.nxs[3])
+        if ntr == 0:
+            return reactions
+        mts = self.reaction_mts
+        qvals = self.get_xss(int(self.jxs[3]), ntr)
+        locators = self.get_xss(int(self.jxs[5]), ntr).astype(np.int64)
+        sig = int(self.jxs[6])
+        for mt, qval, loca in zip(mts, qvals, locators):
+            ie, ne = self.get_xss(sig + loca - 1, 2).astype(np.int64)
+            xs = self.get_xss(sig + loca + 1, ne)
+            reactions[mt] = {
+                'mt': mt,
+                'q': float(qval),
+                'energy': energy[ie-1:ie-1+ne],
+                'xs': xs,
+            }
+        return reactions
+
+    @property
+    def reactions(self):
+        """Return a dictionary with the cross sections of all reactions.
+
+        The dictionary is indexed by MT number and contains the total (1)
+        and elastic (2) cross sections of the ESZ block as well.
+        """
+        if self._reactions is None:
+            self._reactions = self._read_reactions()
+        return self._reactions
+
+    def get_reaction(self, mt):
+        return self.reactions[mt]
+
+    @property
+    def urr_ptable(self):
+        """Return the unresolved resonance probability tables or None."""
+        lunr = int(self.jxs[22])
+        if lunr == 0:
+            return None
+        n, m, interp, ilf, ioa, iff = self.get_xss(lunr, 6).astype(np.int64)
+        energy = self.get_xss(lunr + 6, n)
+        table = self.get_xss(lunr + 6 + n, n*6*m).reshape(n, 6, m)
+        return {
+            'interpolation': int(interp),
+            'inelastic_flag': int(ilf),
+            'absorption_flag': int(ioa),
+            'factors_flag': int(iff),
+            'energy': energy,
+            'cumulative_probability': table[:, 0, :],
+            'total': table[:, 1, :],
+            'elastic': table[:, 2, :],
+            'fission': table[:, 3, :],
+            'capture': table[:, 4, :],
+            'heating': table[:, 5, :],
+        }
+
+
+def open_ace_table(filename):
+    """Open a type-1 ACE file and return an AceTable object."""
+    return AceTable(filename)
+
+
+if __name__ == '__main__':
+
+    acepath = sys.argv[1]
+    with open_ace_table(acepath) as ace:
+        print(f'{os.path.basename(acepath)}: {ace.zaid} awr={ace.awr} '
+              f'temp={ace.temperature} date={ace.date}')
+        print(f'energy points: {len(ace.energy_grid)}')
+        print('reactions: ' + ' '.join(str(mt) for mt in ace.reactions))
+        print(f'probability tables: {ace.urr_ptable is not None}')
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+############################################################
+#
+# Stand-in for the NJOY executable used by the benchmarks.
+# It reads an NJOY input deck from stdin like NJOY, waits
+# for a configurable time and writes the tapes of the
+# modules in the deck with realistic formats and sizes:
+# ACE files for acer, PostScript plots for the plot tapes
+# of acer and heatr, ENDF-like text for the other tapes
+# and an output listing with the header, dates and module
+# timings in the layout of NJOY2016.
+#
+# Environment variables:
+#     FAKE_NJOY_DELAY        seconds to wait (default: 0.1)
+#     FAKE_NJOY_SIZE_FACTOR  size of each output tape as a
+#                            multiple of the largest input
+#                            tape (default: 1.0)
+#     FAKE_NJOY_MODULE_TIME  seconds reported per module in
+#                            the listing (default: 1.0)
+#     FAKE_NJOY_FAIL         if set, exit with an NJOY error
+#
+# Usage:
+#     fake_njoy.py < input.nji
+#
+############################################################
+
+import os
+import re
+import sys
+import time
+
+
+ACE_DATE = '01/01/23'
+LISTING_DATE = '01/01/23'
+LISTING_TIME = '12:00:00'
+# positions of the plot tapes on the first card of a module
+PLOT_TAPE_POSITIONS = {'acer': 2, 'heatr': 3}
+ACE_TAPE_POSITIONS = {'acer': (3, 4)}
+FAKE_MAT = 2631
+
+
+def parse_deck(deck):
+    """Return the modules of a deck as (name, tape numbers) tuples."""
+    modules = []
+    lines = deck.splitlines()
+    for i, line in enumerate(lines):
+        name = line.strip()
+        if not re.match('^[a-z]+$', name) or i+1 >= len(lines):
+            continue
+        if name == 'stop':
+            break
+        tapes = []
+        for field in lines[i+1].split('/')[0].split():
+            try:
+                tapes.append(int(field))
+            except ValueError:
+                break
+        modules.append((name, tapes))
+    return modules
+
+
+def get_target_size(tapes):
+    sizes = [os.path.getsize(f'tape{abs(t)}') for t in tapes
+             if t != 0 and os.path.exists(f'tape{abs(t)}')]
+    factor = float(os.environ.get('FAKE_NJOY_SIZE_FACTOR', '1.0'))
+    return int(max(sizes, default=65536) * factor)
+
+
+def write_ace_tape(fname, size):
+    with open(fname, 'w') as f:
+        f.write('%10s%12.6f%12.4E %10s\n' % ('26056.80c', 55.454, 2.5301e-8, ACE_DATE))
+        f.write('%-70s%10s\n' % ('26-Fe-56 benchmark', 'mat2631'))
+        for i in range(4):
+            f.write('%7d%11.0f' % (0, 0.) * 4 + '\n')
+        nxs = [size // 20, 26056, 1000, 10, 0, 0, 0, 0] + [0] * 8
+        jxs = [1] + [0] * 21 + [100] + [0] * 9
+        for i in range(2):
+            f.write(''.join('%9d' % v for v in nxs[8*i:8*i+8]) + '\n')
+        for i in range(4):
+            f.write(''.join('%9d' % v for v in jxs[8*i:8*i+8]) + '\n')
+        line = ''.join('%20.11E' % (1e-5 * (k+1)) for k in range(4)) + '\n'
+        f.write(line * max(1, size // len(line)))
+
+
+def write_plot_tape(fname, size):
+    with open(fname, 'w') as f:
+        f.write('%!PS-Adobe-2.0\n0.5 setlinewidth\n')
+        written = 0
+        page = 0
+        while written < size:
+            chunk = []
+            for k in range(200):
+                y = 100 + (k * 37 + page * 11) % 600
+                chunk.append(f'{50 + k * 2} {y} moveto {52 + k * 2} {y + 5} lineto stroke\n')
+            chunk.append('showpage\n')
+            data = ''.join(chunk)
+            f.write(data)
+            written += len(data)
+            page += 1
+
+
+def write_endf_tape(fname, size, mat):
+    line = ' 1.000000+0 2.000000-1          0          0          0          0%4d 3  1    1\n' % mat
+    with open(fname, 'w') as f:
+        f.write(line * max(1, size // len(line)))
+
+
+def write_listing(fname, modules):
+    module_time = float(os.environ.get('FAKE_NJOY_MODULE_TIME', '1.0'))
+    with open(fname, 'w') as f:
+        f.write(' ' + '*' * 77 + '\n')
+        for text in ('njoy 2016', 'benchmark stand-in', '', ''):
+            f.write(f' *{text:^75}*\n')
+        f.write(' ' + '*' * 77 + '\n')
+        f.write(' ' * 61 + f'date: {LISTING_DATE}\n')
+        f.write(' ' * 61 + f'time: {LISTING_TIME}\n')
+        f.write('\n')
+        clock = 0.0
+        for name, tapes in modules:
+            f.write(f' {name}...benchmark module'.ljust(70) + '%8.1fs\n' % clock)
+            f.write(' ' * 30 + f'date  {LISTING_DATE}\n')
+            f.write(' input tapes ' + ' '.join(str(t) for t in tapes) + '\n')
+            clock += module_time
+        f.write(' ' * 69 + '%8.1fs\n' % clock)
+        f.write(' ' + '*' * 77 + '\n')
+
+
+def main():
+    deck = sys.stdin.read()
+    time.sleep(float(os.environ.get('FAKE_NJOY_DELAY', '0.1')))
+    if os.environ.get('FAKE_NJOY_FAIL'):
+        print(' ***error in fake_njoy***')
+        sys.exit(1)
+    modules = parse_deck(deck)
+    written = set()
+    for name, tapes in modules:
+        size = get_target_size(tapes)
+        for pos, tape in enumerate(tapes):
+            tapenum = abs(tape)
+            fname = f'tape{tapenum}'
+            if tapenum < 20 or tapenum in written or os.path.lexists(fname):
+                continue
+            written.add(tapenum)
+            if pos == PLOT_TAPE_POSITIONS.get(name):
+                write_plot_tape(fname, size // 4)
+            elif pos in ACE_TAPE_POSITIONS.get(name, ()):
+                write_ace_tape(fname, size)
+            else:
+                write_endf_tape(fname, size, FAKE_MAT)
+    write_listing('output', modules)
+
+
+if __name__ == '__main__':
+    main()
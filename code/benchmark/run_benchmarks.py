@@ -0,0 +1,489 @@
+############################################################
+#
+# Benchmarks of the FENDL processing driver. Synthetic
+# ENDF files, NJOY input decks, NJOY output listings, ACE
+# files and PDF plots are created in a work directory and
+# NJOY is replaced by fake_njoy.py so that the driver can
+# be benchmarked without an NJOY installation.
+#
+# The benchmarks of process_fendl_endf and process_fendl_sublib
+# need ps2pdf (and exiftool/qpdf for the toolchain PDF
+# engine), they are skipped if these tools are missing.
+# The results are written as JSON to track the throughput
+# over time.
+#
+# Usage:
+#     Run from the root directory of the
+#     FENDL-processed directory:
+#
+#     python code/benchmark/run_benchmarks.py [options]
+#
+#     --materials N     number of synthetic materials (default: 4)
+#     --endf-size MB    size of each ENDF file (default: 2)
+#     --njoy-delay S    run time of the fake NJOY (default: 0.1)
+#     --size-factor F   size of the NJOY tapes relative to
+#                       the ENDF file (default: 1.0)
+#     --repeat N        repetitions of each benchmark (default: 3)
+#     --pdf-engine E    toolchain or inprocess (default: inprocess)
+#     --only NAME       run only the named benchmarks
+#     --output F        JSON file for the results (default:
+#                       .cache/benchmarks/benchmark-<date>.json)
+#
+############################################################
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from fake_njoy import write_listing, write_ace_tape
+from file_hashing import filehash, stream_filehash
+from njoy_file_manipulation import normalize_njoy_outfile, set_acefile_date
+from pdf_manipulation import remove_volatile_pdf_metadata, PDF_ENGINE_ENV
+from process_fendl_base import (
+    update_njoy_inputfile,
+    process_fendl_endf,
+    get_endf_info
+)
+from process_fendl_neutron import (
+    run_fendl_njoy,
+    determine_fendl_paths,
+    process_fendl_neutron_lib
+)
+
+
+FAKE_NJOY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_njoy.py')
+NJOY_VERSION = '2016.benchNDS'
+FENDL_VERSION = 'FENDL-bench'
+CREATION_DATE = datetime(2023, 1, 1, 12, 0, 0)
+BENCH_ISOTOPES = [
+    (26, 'Fe', 56), (26, 'Fe', 54), (1, 'H', 1), (79, 'Au', 197),
+    (8, 'O', 16), (74, 'W', 184), (29, 'Cu', 63), (24, 'Cr', 52),
+]
+
+NEUTRON_DECK = """moder
+1 -21/
+'comment'/
+20 {mat}/
+0/
+reconr
+-21 -22/
+'PENDF'/
+{mat} 3 0/
+0.001 0. 0.01/
+'comment'/
+'comment'/
+0/
+broadr
+-21 -22 -23/
+{mat} 1 0 0 0./
+0.001/
+293.6/
+0/
+heatr
+-21 -23 -24 32/
+{mat} 2 0 0 0 2/
+302 402/
+acer
+-21 -24 0 27 28/
+1 0 1 .80/
+'comment'/
+{mat} 293.6/
+1 1/
+/
+acer
+0 27 35 29 30/
+7 1 1 -1/
+'check'/
+moder
+40 -41/
+reconr
+-41 -42/
+'PENDF'/
+{z}00 1 0/
+0.001 0./
+'comment'/
+'comment'/
+0/
+groupr
+-21 -24 0 31/
+{mat} 3 0 4 3 1 1 1/
+'comment'/
+293.6/
+1e10/
+3/
+0/
+gaminr
+-41 -42 0 43/
+{z}00 3 3 3 1/
+'comment'/
+-1 0/
+0/
+matxsr
+31 0 44/
+1 'comment'/
+1 2 1 1/
+'comment'/
+'Photo-atomic data'/
+'comment'/
+n g/
+stop
+"""
+
+
+def write_endf_file(fname, mat, size):
+    """Write an ENDF-6 like file of about `size` bytes."""
+    with open(fname, 'w') as f:
+        nlines = max(1, size // 81)
+        for i in range(nlines):
+            f.write(' 1.000000+0 2.000000-1          0          0          0'
+                    '          0%4d 3  1%5d\n' % (mat, i % 100000))
+
+
+def write_pdf_file(fname, size):
+    """Write a PDF file with volatile metadata as produced by ps2pdf."""
+    content = b''.join(
+        b'%d %d m %d %d l S\n' % (k % 500, k % 700, k % 500 + 3, k % 700 + 5)
+        for k in range(max(1, size // 20))
+    )
+    xmp = (b'<?xpacket begin="" id="W5M0MpCehiHzreSzNTczkc9d"?>\n'
+           b'<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF>'
+           b'<rdf:Description rdf:about="uuid:0a1b2c3d" '
+           b'xmlns:xmp="http://ns.adobe.com/xap/1.0/" '
+           b'xmlns:xmpMM="http://ns.adobe.com/xap/1.0/mm/">'
+           b'<xmp:CreateDate>2024-05-06T07:08:09+02:00</xmp:CreateDate>'
+           b'<xmp:ModifyDate>2024-05-06T07:08:09+02:00</xmp:ModifyDate>'
+           b'<xmpMM:DocumentID>uuid:0a1b2c3d</xmpMM:DocumentID>'
+           b'</rdf:Description></rdf:RDF></x:xmpmeta>\n'
+           b'<?xpacket end="w"?>')
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R /Metadata 6 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R >>',
+        b'<< /Length %d >>\nstream\n' % len(content) + content + b'\nendstream',
+        b'<< /Producer (GPL Ghostscript) /CreationDate (D:20240506070809+02)'
+        b' /ModDate (D:20240506070809+02) >>',
+        b'<< /Type /Metadata /Subtype /XML /Length %d >>\nstream\n' % len(xmp)
+        + xmp + b'\nendstream',
+    ]
+    chunks = [b'%PDF-1.4\n']
+    offsets = []
+    pos = len(chunks[0])
+    for i, obj in enumerate(objects):
+        data = b'%d 0 obj\n' % (i+1) + obj + b'\nendobj\n'
+        offsets.append(pos)
+        chunks.append(data)
+        pos += len(data)
+    xref = [b'xref\n0 %d\n' % (len(objects)+1), b'0000000000 65535 f \n']
+    xref += [b'%010d 00000 n \n' % off for off in offsets]
+    chunks += xref
+    chunks.append(b'trailer\n<< /Size %d /Root 1 0 R /Info 5 0 R '
+                  b'/ID [<%s><%s>] >>\n' % (len(objects)+1, b'a'*32, b'b'*32))
+    chunks.append(b'startxref\n%d\n%%%%EOF\n' % pos)
+    with open(fname, 'wb') as f:
+        f.write(b''.join(chunks))
+
+
+def write_njoy_wrapper(fname):
+    """Write an executable that runs the fake NJOY."""
+    with open(fname, 'w') as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_NJOY}" "$@"\n')
+    os.chmod(fname, 0o755)
+
+
+def make_fixtures(workdir, num_materials, endf_size):
+    """Create a FENDL directory layout with synthetic input files.
+
+    Return a dictionary with the paths of the fixtures.
+    """
+    os.makedirs(os.path.join(workdir, 'opt'))
+    njoyexe = os.path.join(workdir, 'opt', 'njoy')
+    write_njoy_wrapper(njoyexe)
+    njoylib = os.path.join(workdir, 'opt', 'libnjoy.so')
+    with open(njoylib, 'wb') as f:
+        f.write(b'\0' * 65536)
+    with open(os.path.join(workdir, 'config.py'), 'w') as f:
+        f.write(f"FENDL_VERSION = '{FENDL_VERSION}'\n")
+    endf_dir = os.path.join(workdir, 'fendl-endf/general-purpose/neutron')
+    atom_dir = os.path.join(workdir, 'fendl-endf/general-purpose/atom')
+    for d in (endf_dir, atom_dir):
+        os.makedirs(d)
+    for d in ('neutron/njoy', 'neutron/ace', 'neutron/group',
+              'neutron/plot', 'atom/group'):
+        os.makedirs(os.path.join(workdir, 'general-purpose', d))
+    isotopes = [BENCH_ISOTOPES[i % len(BENCH_ISOTOPES)] for i in range(num_materials)]
+    endf_files = []
+    for i, (z, sym, a) in enumerate(isotopes):
+        # repeated elements get other mass numbers to keep names unique
+        a += i // len(BENCH_ISOTOPES)
+        mat = 100 * z + 25 + i
+        info = {'incpart': 'n', 'matnr': mat, 'charge': z, 'symb': sym,
+                'mass': a, 'meta': ''}
+        fname = 'n_%04d_%d-%s-%d.endf' % (mat, z, sym, a)
+        endf_file = os.path.join(endf_dir, fname)
+        write_endf_file(endf_file, mat, endf_size)
+        endf_files.append(endf_file)
+        paths = determine_fendl_paths(info, workdir, njoyexe, njoylib)
+        if not os.path.exists(paths['inputs']['ph_endf']):
+            write_endf_file(paths['inputs']['ph_endf'], 100 * z, endf_size // 10)
+        with open(paths['inputs']['njoyinp'], 'w') as f:
+            f.write(NEUTRON_DECK.format(mat=mat, z=z))
+    fixtures = {
+        'njoyexe': njoyexe,
+        'njoylib': njoylib,
+        'endf_files': endf_files,
+        'listing': os.path.join(workdir, 'listing.out'),
+        'ace': os.path.join(workdir, '26Fe056'),
+        'pdf': os.path.join(workdir, 'plot.pdf'),
+    }
+    listing_modules = [('moder', [1, -21]), ('reconr', [-21, -22]),
+                       ('broadr', [-21, -22, -23]), ('heatr', [-21, -23, -24, 32])]
+    # about 600 bytes per repetition of the modules
+    write_listing(fixtures['listing'], listing_modules * max(1, endf_size // 600))
+    write_ace_tape(fixtures['ace'], endf_size)
+    write_pdf_file(fixtures['pdf'], endf_size // 4)
+    # inputs are usually older than the hash cache entries, files modified
+    # within the last seconds are not cached
+    mtime = time.time() - 3600
+    for dirpath, _, filenames in os.walk(workdir):
+        for fname in filenames:
+            os.utime(os.path.join(dirpath, fname), (mtime, mtime))
+    return fixtures
+
+
+def time_repeated(func, repeat, setup=None):
+    """Return the durations of `repeat` calls of `func`."""
+    durations = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def make_result(name, durations, items=None, nbytes=None, **params):
+    best = min(durations)
+    result = {
+        'name': name,
+        'repeat': len(durations),
+        'min_seconds': best,
+        'mean_seconds': sum(durations) / len(durations),
+        'params': params,
+    }
+    if items is not None:
+        result['items'] = items
+        result['items_per_second'] = items / best if best > 0 else None
+    if nbytes is not None:
+        result['bytes'] = nbytes
+        result['mb_per_second'] = nbytes / 1024**2 / best if best > 0 else None
+    return result
+
+
+def bench_filehash(fixtures, repeat):
+    files = fixtures['endf_files']
+    nbytes = sum(os.path.getsize(f) for f in files)
+    results = []
+    durations = time_repeated(lambda: [stream_filehash(f) for f in files], repeat)
+    results.append(make_result('filehash_stream', durations, len(files), nbytes))
+    for f in files:
+        filehash(f)
+    durations = time_repeated(lambda: [filehash(f) for f in files], repeat)
+    results.append(make_result('filehash_cached', durations, len(files), nbytes))
+    return results
+
+
+def bench_update_njoy_inputfile(fixtures, repeat):
+    decks = [determine_fendl_paths(get_endf_info(f), '.', None, None)['inputs']['njoyinp']
+             for f in fixtures['endf_files']]
+
+    def update_all():
+        for deck in decks:
+            update_njoy_inputfile(deck, NJOY_VERSION, FENDL_VERSION, CREATION_DATE)
+
+    update_all()
+    durations = time_repeated(update_all, repeat)
+    return [make_result('update_njoy_inputfile', durations, len(decks))]
+
+
+def bench_date_patching(fixtures, repeat, workdir):
+    results = []
+    listing = os.path.join(workdir, 'listing_copy.out')
+    nbytes = os.path.getsize(fixtures['listing'])
+    durations = time_repeated(
+        lambda: normalize_njoy_outfile(listing, CREATION_DATE),
+        repeat, setup=lambda: shutil.copyfile(fixtures['listing'], listing)
+    )
+    results.append(make_result('normalize_njoy_outfile', durations, 1, nbytes))
+    ace = os.path.join(workdir, 'ace_copy')
+    shutil.copyfile(fixtures['ace'], ace)
+    durations = time_repeated(lambda: set_acefile_date(ace, CREATION_DATE), repeat)
+    results.append(make_result('set_acefile_date', durations, 1,
+                               os.path.getsize(ace)))
+    return results
+
+
+def bench_pdf_normalization(fixtures, repeat):
+    with open(fixtures['pdf'], 'rb') as f:
+        data = f.read()
+    results = []
+    for engine in ('inprocess', 'toolchain'):
+        if engine == 'toolchain' and not all(shutil.which(t) for t in ('exiftool', 'qpdf')):
+            results.append({'name': f'pdf_normalization_{engine}',
+                            'skipped': 'exiftool or qpdf not found'})
+            continue
+        durations = time_repeated(
+            lambda: remove_volatile_pdf_metadata(data, CREATION_DATE, engine), repeat
+        )
+        results.append(make_result(f'pdf_normalization_{engine}', durations,
+                                   1, len(data), engine=engine))
+    return results
+
+
+def _remove_outputs(fendl_paths):
+    for f in list(fendl_paths['outputs'].values()) + [fendl_paths['trackfile']]:
+        if os.path.lexists(f):
+            os.unlink(f)
+
+
+def bench_process_fendl_endf(fixtures, repeat):
+    if shutil.which('ps2pdf') is None:
+        return [{'name': 'process_fendl_endf', 'skipped': 'ps2pdf not found'}]
+    endf_file = fixtures['endf_files'][0]
+    fendl_paths = determine_fendl_paths(
+        get_endf_info(endf_file), '.', fixtures['njoyexe'], fixtures['njoylib']
+    )
+    durations = time_repeated(
+        lambda: process_fendl_endf(run_fendl_njoy, fendl_paths, NJOY_VERSION,
+                                   FENDL_VERSION, CREATION_DATE),
+        repeat, setup=lambda: _remove_outputs(fendl_paths)
+    )
+    return [make_result('process_fendl_endf', durations, 1,
+                        os.path.getsize(endf_file))]
+
+
+def bench_process_fendl_sublib(fixtures, repeat):
+    if shutil.which('ps2pdf') is None:
+        return [{'name': 'process_fendl_sublib', 'skipped': 'ps2pdf not found'}]
+    endf_files = fixtures['endf_files']
+    all_paths = [determine_fendl_paths(get_endf_info(f), '.', fixtures['njoyexe'],
+                                       fixtures['njoylib']) for f in endf_files]
+    nbytes = sum(os.path.getsize(f) for f in endf_files)
+
+    def process_lib():
+        process_fendl_neutron_lib('.', fixtures['njoyexe'], fixtures['njoylib'],
+                                  NJOY_VERSION, FENDL_VERSION, CREATION_DATE)
+
+    def remove_all_outputs():
+        for paths in all_paths:
+            _remove_outputs(paths)
+
+    results = []
+    durations = time_repeated(process_lib, repeat, setup=remove_all_outputs)
+    results.append(make_result('process_fendl_sublib_cold', durations,
+                               len(endf_files), nbytes))
+    durations = time_repeated(process_lib, repeat)
+    results.append(make_result('process_fendl_sublib_uptodate', durations,
+                               len(endf_files), nbytes))
+    return results
+
+
+BENCHMARKS = (
+    'filehash',
+    'update_njoy_inputfile',
+    'date_patching',
+    'pdf_normalization',
+    'process_fendl_endf',
+    'process_fendl_sublib',
+)
+
+
+def get_git_commit():
+    try:
+        ret = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                             text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return ret.stdout.strip() if ret.returncode == 0 else None
+
+
+def run_benchmarks(args):
+    params = {
+        'materials': args.materials,
+        'endf_size': int(args.endf_size * 1024**2),
+        'njoy_delay': args.njoy_delay,
+        'size_factor': args.size_factor,
+        'repeat': args.repeat,
+        'pdf_engine': args.pdf_engine,
+    }
+    selected = args.only if args.only else BENCHMARKS
+    results = []
+    olddir = os.getcwd()
+    oldenv = dict(os.environ)
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            fixtures = make_fixtures(workdir, args.materials, params['endf_size'])
+            os.chdir(workdir)
+            # caches and databases are created in the work directory,
+            # the output cache would turn cold runs into cache hits
+            os.environ['FENDL_OUTPUT_CACHE'] = ''
+            os.environ[PDF_ENGINE_ENV] = args.pdf_engine
+            os.environ['FAKE_NJOY_DELAY'] = str(args.njoy_delay)
+            os.environ['FAKE_NJOY_SIZE_FACTOR'] = str(args.size_factor)
+            for name in selected:
+                print(f'--- running benchmark {name} ---')
+                bench = globals()['bench_' + name]
+                if name == 'date_patching':
+                    cur_results = bench(fixtures, args.repeat, workdir)
+                else:
+                    cur_results = bench(fixtures, args.repeat)
+                for res in cur_results:
+                    if 'skipped' in res:
+                        print(f'{res["name"]}: skipped ({res["skipped"]})')
+                    else:
+                        print(f'{res["name"]}: {res["min_seconds"]:.4f}s')
+                results.extend(cur_results)
+        finally:
+            os.chdir(olddir)
+            os.environ.clear()
+            os.environ.update(oldenv)
+    return {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'commit': get_git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': params,
+        'results': results,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--materials', type=int, default=4)
+    parser.add_argument('--endf-size', type=float, default=2.0,
+                        help='size of each synthetic ENDF file in MB')
+    parser.add_argument('--njoy-delay', type=float, default=0.1)
+    parser.add_argument('--size-factor', type=float, default=1.0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--pdf-engine', choices=('toolchain', 'inprocess'),
+                        default='inprocess')
+    parser.add_argument('--only', choices=BENCHMARKS, action='append')
+    parser.add_argument('--output', type=str, default=None)
+    args = parser.parse_args()
+    report = run_benchmarks(args)
+    output = args.output
+    if output is None:
+        datestr = datetime.now().strftime('%Y%m%d-%H%M%S')
+        output = os.path.join('.cache', 'benchmarks', f'benchmark-{datestr}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f'results written to {output}')
@@ -0,0 +1,207 @@
+############################################################
+#
+# Model of the NJOY runtime of a material. The features
+# are the size of the ENDF input files and the number of
+# MF/MT sections in them, read from the directory in
+# MF1/MT451. A linear model is fitted by least squares to
+# the NJOY wall times recorded in the trackdb index. If
+# too few materials have been recorded, the runtime is
+# estimated from the input size alone.
+#
+# The predictions determine the order of the tasks, the
+# longest ones first, and the ETA of the progress output.
+#
+# Usage:
+#     python cost_model.py <sublib> [<num>]
+#
+#     print the fitted coefficients and the <num> (default: 20)
+#     materials of <sublib> (neutron, proton, deuteron)
+#     with the longest predicted runtime. Run from the root
+#     directory of the FENDL-processed directory.
+#
+############################################################
+
+import os
+import sys
+import statistics
+
+from trackdb_index import get_njoy_usage_records, get_trackfile_ids
+
+
+FEATURE_NAMES = ('intercept', 'size_mb', 'num_sections', 'num_mf6_sections')
+# a fit needs this many recorded materials per coefficient
+MIN_SAMPLES_PER_FEATURE = 2
+RIDGE_PENALTY = 1e-6
+DEFAULT_SECONDS_PER_MB = 30.0
+MIN_PREDICTED_RUNTIME = 1.0
+
+
+def _parse_int(field):
+    field = field.strip()
+    return int(field) if field else 0
+
+
+def scan_endf_sections(fpath):
+    """Return the (MF, MT) sections of an ENDF file.
+
+    The sections are read from the directory in MF1/MT451. If the
+    file has no directory, the control fields of all lines are scanned.
+    """
+    sections = []
+    with open(fpath, 'rb') as f:
+        line = f.readline()
+        while line and line[70:75] != b' 1451':
+            line = f.readline()
+        head = [line] + [f.readline() for _ in range(3)]
+        if line and all(l[70:75] == b' 1451' for l in head):
+            try:
+                nwd = _parse_int(head[3][44:55])
+                nxc = _parse_int(head[3][55:66])
+                for _ in range(nwd):
+                    f.readline()
+                for _ in range(nxc):
+                    line = f.readline()
+                    sections.append((_parse_int(line[22:33]), _parse_int(line[33:44])))
+                return sections
+            except ValueError:
+                sections = []
+        f.seek(0)
+        seen = set()
+        for line in f:
+            mfmt = line[70:75]
+            if mfmt not in seen:
+                seen.add(mfmt)
+                try:
+                    mf, mt = int(mfmt[:2]), int(mfmt[2:])
+                except ValueError:
+                    continue
+                if mf > 0 and mt > 0:
+                    sections.append((mf, mt))
+    return sections
+
+
+def get_runtime_features(fendl_paths):
+    """Return the features of the ENDF input files of a material."""
+    size = 0
+    sections = []
+    for k, f in fendl_paths['inputs'].items():
+        if k.endswith('_endf') and os.path.isfile(f):
+            size += os.path.getsize(f)
+            sections += scan_endf_sections(f)
+    num_mf6 = sum(1 for mf, _ in sections if mf == 6)
+    return [1.0, size / 1024**2, float(len(sections)), float(num_mf6)]
+
+
+def solve_linear_system(a, b):
+    """Solve a x = b by Gaussian elimination with partial pivoting."""
+    n = len(b)
+    m = [list(row) + [rhs] for row, rhs in zip(a, b)]
+    for col in range(n):
+        piv = max(range(col, n), key=lambda r: abs(m[r][col]))
+        if m[piv][col] == 0:
+            raise ValueError('singular system')
+        m[col], m[piv] = m[piv], m[col]
+        for r in range(col + 1, n):
+            fac = m[r][col] / m[col][col]
+            for c in range(col, n + 1):
+                m[r][c] -= fac * m[col][c]
+    x = [0.0] * n
+    for r in reversed(range(n)):
+        x[r] = (m[r][n] - sum(m[r][c] * x[c] for c in range(r + 1, n))) / m[r][r]
+    return x
+
+
+def fit_least_squares(features, targets, ridge=RIDGE_PENALTY):
+    """Return the coefficients minimizing the squared residuals.
+
+    A small ridge penalty on all but the first coefficient keeps
+    the normal equations solvable for collinear features.
+    """
+    nfeat = len(features[0])
+    a = [[sum(x[i] * x[j] for x in features) for j in range(nfeat)]
+         for i in range(nfeat)]
+    scale = max(a[i][i] for i in range(nfeat))
+    for i in range(1, nfeat):
+        a[i][i] += ridge * scale
+    b = [sum(x[i] * y for x, y in zip(features, targets)) for i in range(nfeat)]
+    return solve_linear_system(a, b)
+
+
+def fit_runtime_model(fendl_paths_list, usage_records=None):
+    """Return a runtime model trained on the recorded NJOY runs.
+
+    The model is a dictionary with the `coefficients` of the linear
+    model or the `seconds_per_mb` of the fallback.
+    """
+    if usage_records is None:
+        usage_records = get_njoy_usage_records()
+    features = []
+    targets = []
+    for fendl_paths in fendl_paths_list:
+        usage = usage_records.get(get_trackfile_ids(fendl_paths['trackfile']))
+        if usage is not None:
+            features.append(get_runtime_features(fendl_paths))
+            targets.append(usage['wall_time'])
+    model = {'num_samples': len(targets), 'coefficients': None,
+             'seconds_per_mb': DEFAULT_SECONDS_PER_MB}
+    if len(targets) >= MIN_SAMPLES_PER_FEATURE * len(FEATURE_NAMES):
+        try:
+            model['coefficients'] = fit_least_squares(features, targets)
+        except ValueError:
+            pass
+    rates = [y / x[1] for x, y in zip(features, targets) if x[1] > 0]
+    if rates:
+        model['seconds_per_mb'] = statistics.median(rates)
+    return model
+
+
+def predict_runtime(model, features):
+    if model['coefficients'] is not None:
+        pred = sum(c * x for c, x in zip(model['coefficients'], features))
+    else:
+        pred = model['seconds_per_mb'] * features[1]
+    return max(pred, MIN_PREDICTED_RUNTIME)
+
+
+def predict_runtimes(fendl_paths_list, model=None):
+    """Return the predicted NJOY runtime in seconds of each material."""
+    if model is None:
+        model = fit_runtime_model(fendl_paths_list)
+    return [predict_runtime(model, get_runtime_features(p))
+            for p in fendl_paths_list]
+
+
+def order_tasks_longest_first(tasks):
+    """Store the predicted runtime in the tasks and sort them by it."""
+    predictions = predict_runtimes([t['fendl_paths'] for t in tasks])
+    for task, pred in zip(tasks, predictions):
+        task['predicted_runtime'] = pred
+    return sorted(tasks, key=lambda t: t['predicted_runtime'], reverse=True)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('usage: python cost_model.py <sublib> [<num>]')
+        sys.exit(2)
+    import process_fendl_neutron
+    import process_fendl_proton
+    import process_fendl_deuteron
+    get_tasks = {
+        'neutron': process_fendl_neutron.get_fendl_neutron_tasks,
+        'proton': process_fendl_proton.get_fendl_proton_tasks,
+        'deuteron': process_fendl_deuteron.get_fendl_deuteron_tasks,
+    }[sys.argv[1]]
+    num = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    tasks = get_tasks('.', '/opt/NJOY2016/bin/njoy', '/opt/NJOY2016/bin/libnjoy.so')
+    fendl_paths_list = [t['fendl_paths'] for t in tasks]
+    model = fit_runtime_model(fendl_paths_list)
+    print(f'--- runtime model from {model["num_samples"]} recorded materials ---')
+    if model['coefficients'] is not None:
+        for name, coeff in zip(FEATURE_NAMES, model['coefficients']):
+            print(f'{name:>18}: {coeff:12.4g}')
+    else:
+        print(f'{"seconds_per_mb":>18}: {model["seconds_per_mb"]:12.4g}')
+    predictions = predict_runtimes(fendl_paths_list, model)
+    ranked = sorted(zip(predictions, tasks), key=lambda x: x[0], reverse=True)
+    for pred, task in ranked[:num]:
+        print(f'{pred:10.1f}s  {os.path.basename(task["endf_file"])}')
@@ -0,0 +1,152 @@
+############################################################
+#
+# Staged processing pipeline for the ENDF files of the
+# FENDL library. NJOY runs, the conversion and normalization
+# of plots and the fix-up and hashing of output files are
+# executed by separate pools of worker threads connected by
+# bounded queues so that NJOY runs and the I/O heavy
+# post-processing of previous materials overlap. NJOY
+# workers can be limited to a memory budget for the
+# predicted peak memory of the concurrent NJOY runs.
+#
+############################################################
+
+import time
+import queue
+import threading
+import traceback
+
+from process_fendl_base import (
+    lock_file,
+    unlock_file,
+    prepare_fendl_endf,
+    run_fendl_njoy_supervised,
+    postprocess_fendl_plots,
+    finalize_fendl_outputs,
+    print_fendl_summary
+)
+from memory_admission import MemoryScheduler
+from cost_model import order_tasks_longest_first
+from progress_report import ProgressReporter
+
+
+def _make_result(task):
+    return {
+        'sublib': task['sublib'],
+        'endf_file': task['endf_file'],
+        'status': None,
+        'error': None,
+        'duration': 0.0,
+        'start_time': time.time(),
+    }
+
+
+def run_fendl_pipeline(
+    tasks, njoyvers, fendlvers, cdate,
+    njoy_workers=1, plot_workers=1, fixup_workers=1, queue_size=2,
+    memory_budget=None
+):
+    """Process tasks in a pipeline of NJOY, plot and fix-up stages.
+
+    The queues between the stages hold at most `queue_size` materials
+    so that NJOY workers pause if the post-processing falls behind.
+    If `memory_budget` (bytes) is given, NJOY workers wait until the
+    predicted memory of the next material fits the budget.
+    """
+    tasks = order_tasks_longest_first(tasks)
+    scheduler = MemoryScheduler(tasks, memory_budget)
+    progress = ProgressReporter(tasks, njoy_workers)
+    plot_queue = queue.Queue(maxsize=queue_size)
+    fixup_queue = queue.Queue(maxsize=queue_size)
+    results = []
+    results_lock = threading.Lock()
+
+    def finish(task, result, status, error=None):
+        result['status'] = status
+        result['error'] = error
+        result['duration'] = time.time() - result.pop('start_time')
+        if status != 'locked':
+            unlock_file(task['endf_file'])
+        with results_lock:
+            results.append(result)
+            progress.finish(result, task)
+
+    def njoy_worker():
+        while True:
+            task = scheduler.acquire()
+            if task is None:
+                return
+            result = _make_result(task)
+            progress.start(task)
+            try:
+                lock_file(task['endf_file'])
+            except FileExistsError:
+                scheduler.release(task)
+                finish(task, result, 'locked')
+                continue
+            try:
+                fendl_paths = task['fendl_paths']
+                state = prepare_fendl_endf(fendl_paths, njoyvers, fendlvers, cdate)
+                if state is None:
+                    finish(task, result, 'uptodate')
+                    continue
+                if state['output_hashes'] is not None:
+                    finish(task, result, 'processed')
+                    continue
+                run_fendl_njoy_supervised(
+                    task['run_njoy'], fendl_paths, task.get('predicted_runtime')
+                )
+            except Exception:
+                finish(task, result, 'failed', traceback.format_exc())
+                continue
+            finally:
+                scheduler.release(task)
+            plot_queue.put((task, state, result))
+
+    def plot_worker():
+        while True:
+            item = plot_queue.get()
+            if item is None:
+                return
+            task, state, result = item
+            try:
+                postprocess_fendl_plots(task['fendl_paths'], cdate)
+            except Exception:
+                finish(task, result, 'failed', traceback.format_exc())
+                continue
+            fixup_queue.put(item)
+
+    def fixup_worker():
+        while True:
+            item = fixup_queue.get()
+            if item is None:
+                return
+            task, state, result = item
+            try:
+                finalize_fendl_outputs(task['fendl_paths'], state, cdate)
+            except Exception:
+                finish(task, result, 'failed', traceback.format_exc())
+                continue
+            finish(task, result, 'processed')
+
+    # the NJOY workers stop by themselves once all tasks are handed out
+    stages = (
+        (njoy_worker, None, njoy_workers),
+        (plot_worker, plot_queue, plot_workers),
+        (fixup_worker, fixup_queue, fixup_workers),
+    )
+    threads = []
+    for worker, _, nworkers in stages:
+        cur_threads = [threading.Thread(target=worker) for _ in range(nworkers)]
+        for t in cur_threads:
+            t.start()
+        threads.append(cur_threads)
+    # shut down the stages one after another
+    for (worker, stage_queue, nworkers), cur_threads in zip(stages, threads):
+        if stage_queue is not None:
+            for _ in range(nworkers):
+                stage_queue.put(None)
+        for t in cur_threads:
+            t.join()
+    print_fendl_summary(results)
+    return results
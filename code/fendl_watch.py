@@ -0,0 +1,271 @@
+############################################################
+#
+# Watch mode of the driver. The directories of the input
+# files (ENDF files, NJOY input decks, config.py, NJOY)
+# are watched with inotify or, where it is not available,
+# by polling, and the materials using changed inputs are
+# reprocessed. The stat information and hashes of the
+# inputs are kept in memory so that only changed files
+# are hashed, e.g. a changed photo-atomic file triggers
+# the reprocessing of all neutron isotopes of its element.
+# Bursts of changes are collected until no further change
+# has been seen for a debounce interval.
+#
+############################################################
+
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+from file_hashing import filehash
+from process_fendl_base import get_reprocess_reasons, get_fendl_material_name
+
+
+DEFAULT_DEBOUNCE = 2.0
+DEFAULT_POLL_INTERVAL = 2.0
+# process a burst of changes after this time even if it goes on
+MAX_DEBOUNCE_DELAY = 60.0
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_CLOEXEC = os.O_CLOEXEC
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE)
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    """Report changed files in directories using inotify."""
+
+    def __init__(self, dirs):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._fd = libc.inotify_init1(IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._dirs = {}
+        for d in dirs:
+            wd = libc.inotify_add_watch(self._fd, os.fsencode(d), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                os.close(self._fd)
+                raise OSError(err, f'cannot watch {d}: {os.strerror(err)}')
+            self._dirs[wd] = d
+
+    def read_changes(self, timeout=None):
+        """Return the paths changed within `timeout` seconds.
+
+        None is returned if events were lost so that the state
+        of all files has to be checked.
+        """
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+        buf = os.read(self._fd, 65536)
+        changed = set()
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _, namelen = INOTIFY_EVENT.unpack_from(buf, offset)
+            offset += INOTIFY_EVENT.size
+            name = buf[offset:offset+namelen].rstrip(b'\0')
+            offset += namelen
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if wd in self._dirs and name:
+                changed.add(os.path.join(self._dirs[wd], os.fsdecode(name)))
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """Report changed files in directories by comparing stat results."""
+
+    def __init__(self, dirs, interval=DEFAULT_POLL_INTERVAL):
+        self._dirs = list(dirs)
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for d in self._dirs:
+            try:
+                entries = list(os.scandir(d))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                snapshot[entry.path] = (st.st_size, st.st_mtime_ns, st.st_ino)
+        return snapshot
+
+    def read_changes(self, timeout=None):
+        """Return the paths changed within `timeout` seconds."""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            wait = self.interval
+            if deadline is not None:
+                wait = min(wait, max(deadline - time.time(), 0.0))
+            time.sleep(wait)
+            snapshot = self._scan()
+            changed = {p for p in set(snapshot).union(self._snapshot)
+                       if snapshot.get(p) != self._snapshot.get(p)}
+            self._snapshot = snapshot
+            if changed or (deadline is not None and time.time() >= deadline):
+                return changed
+
+    def close(self):
+        pass
+
+
+def create_watcher(dirs, poll_interval=None):
+    """Return an inotify watcher or a polling one if inotify fails.
+
+    A polling watcher is always used if `poll_interval` is given.
+    """
+    if poll_interval is None:
+        try:
+            return InotifyWatcher(dirs)
+        except OSError as exc:
+            print(f'inotify not available ({exc}), falling back to polling')
+            poll_interval = DEFAULT_POLL_INTERVAL
+    return PollingWatcher(dirs, poll_interval)
+
+
+def wait_for_changes(watcher, debounce=DEFAULT_DEBOUNCE):
+    """Block until files change and return them after a quiet period.
+
+    None is returned if the state of all files has to be checked.
+    """
+    changed = watcher.read_changes()
+    deadline = time.time() + MAX_DEBOUNCE_DELAY
+    while changed is not None and time.time() < deadline:
+        more = watcher.read_changes(debounce)
+        if more is None:
+            return None
+        if not more:
+            break
+        changed.update(more)
+    return changed
+
+
+def get_input_map(tasks):
+    """Return the tasks using each input file keyed by absolute path."""
+    input_map = {}
+    for task in tasks:
+        for f in task['fendl_paths']['inputs'].values():
+            input_map.setdefault(os.path.abspath(f), []).append(task)
+    return input_map
+
+
+def update_hash_state(state, paths):
+    """Update the in-memory hashes of files and return the changed ones.
+
+    Files are only hashed if their size, modification time or inode
+    changed, the hash of a missing file is None.
+    """
+    changed = set()
+    for path in paths:
+        try:
+            st = os.stat(path)
+            stat_key = (st.st_size, st.st_mtime_ns, st.st_ino)
+        except FileNotFoundError:
+            stat_key = None
+        known = path in state
+        old_stat_key, old_hash = state.get(path, (None, None))
+        if known and stat_key == old_stat_key:
+            continue
+        curhash = filehash(path) if stat_key is not None else None
+        state[path] = (stat_key, curhash)
+        if known and curhash != old_hash:
+            changed.add(path)
+    return changed
+
+
+def get_stale_tasks(tasks, state):
+    """Return the tasks whose outputs are missing or outdated.
+
+    The input hashes are taken from the in-memory state, tasks with
+    missing input files are skipped.
+    """
+    stale = []
+    for task in tasks:
+        inputs = task['fendl_paths']['inputs']
+        input_hashes = {k: state[os.path.abspath(f)][1] for k, f in inputs.items()}
+        missing = [k for k, h in input_hashes.items() if h is None]
+        if missing:
+            print(f'skipping {get_fendl_material_name(task["fendl_paths"])}: '
+                  f'missing inputs {", ".join(missing)}')
+            continue
+        try:
+            reasons = get_reprocess_reasons(
+                task['fendl_paths'], input_hashes, stop_early=True
+            )
+        except OSError:
+            reasons = ['unreadable']
+        if reasons:
+            stale.append(task)
+    return stale
+
+
+def watch_fendl_inputs(get_tasks, process_tasks, debounce=DEFAULT_DEBOUNCE,
+                       poll_interval=None):
+    """Reprocess materials whenever their input files change.
+
+    `get_tasks` returns the current tasks and is called again if ENDF
+    files are added or removed, `process_tasks` processes a list of
+    tasks. Runs until interrupted.
+    """
+    tasks = get_tasks()
+    input_map = get_input_map(tasks)
+    state = {}
+    update_hash_state(state, input_map)
+    dirs = sorted(set(os.path.dirname(p) for p in input_map
+                      if os.path.isdir(os.path.dirname(p))))
+    watcher = create_watcher(dirs, poll_interval)
+    print(f'--- watching {len(dirs)} directories with {type(watcher).__name__} ---')
+    try:
+        stale = get_stale_tasks(tasks, state)
+        while True:
+            if stale:
+                print(f'--- reprocessing {len(stale)} materials ---')
+                process_tasks(stale)
+                print('--- waiting for changes ---', flush=True)
+            changed = wait_for_changes(watcher, debounce)
+            if changed is None:
+                changed = set(input_map)
+            new_files = {p for p in changed
+                         if p not in input_map and p.endswith('.endf')}
+            if new_files:
+                tasks = get_tasks()
+                input_map = get_input_map(tasks)
+                update_hash_state(state, input_map)
+            changed = update_hash_state(
+                state, [p for p in changed if p in input_map]
+            )
+            affected = {}
+            for path in changed:
+                for task in input_map[path]:
+                    affected[task['fendl_paths']['trackfile']] = task
+            if new_files:
+                affected.update((t['fendl_paths']['trackfile'], t) for t in tasks
+                                if os.path.abspath(t['endf_file']) in new_files)
+            stale = get_stale_tasks(affected.values(), state)
+    except KeyboardInterrupt:
+        print('--- watch mode stopped ---')
+    finally:
+        watcher.close()
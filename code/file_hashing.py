@@ -0,0 +1,248 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+HASH_CACHE_ENV = 'FENDL_HASH_CACHE'
+DEFAULT_HASH_CACHE = os.path.join('.cache', 'filehash.sqlite')
+# if set to a non-empty value, the caches are only read, e.g. for --plan
+READ_ONLY_ENV = 'FENDL_READ_ONLY'
+
+# files modified less than this many seconds before their hash is
+# stored are not cached because a later change of the same size
+# within the resolution of the modification time goes unnoticed
+RACY_MTIME_WINDOW = 2.0
+# the last use of cache entries is only updated at this resolution
+LAST_USED_RESOLUTION = 24 * 3600
+
+_hash_cache = threading.local()
+
+
+ANNEX_KEY_REGEX = re.compile(
+    r'^(SHA256E?)-s([0-9]+)--([0-9a-f]{64})(\.[^/]*)?$'
+)
+
+
+def get_annex_key(fname):
+    """Return the git-annex key of a symlinked file or None.
+
+    The key is extracted from the name of the symlink target,
+    e.g. `SHA256E-s<size>--<sha256>.<ext>`.
+    """
+    if not os.path.islink(fname):
+        return None
+    target = os.path.basename(os.readlink(fname))
+    m = ANNEX_KEY_REGEX.match(target)
+    if not m:
+        return None
+    key = {
+        'backend': m.group(1),
+        'size': int(m.group(2)),
+        'sha256': m.group(3),
+    }
+    return key
+
+
+def get_annex_filehash(fname):
+    """Return the sha256 hash stored in the git-annex key or None.
+
+    None is returned if the file is not a git-annex symlink,
+    if the content is not present or if the size of the
+    content does not match the size recorded in the key.
+    """
+    key = get_annex_key(fname)
+    if key is None:
+        return None
+    try:
+        size = os.stat(fname).st_size
+    except FileNotFoundError:
+        return None
+    if size != key['size']:
+        return None
+    return key['sha256']
+
+
+def stream_filehash(fname):
+    """Calculate sha256 hash of file by reading its content."""
+    sha256 = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        while True:
+            data = f.read(65536)
+            if not data:
+                break
+            sha256.update(data)
+    return sha256.hexdigest()
+
+
+def get_hash_cache_path():
+    """Return the path of the hash cache or None if disabled.
+
+    The path can be changed by the environment variable
+    FENDL_HASH_CACHE, an empty value disables the cache.
+    """
+    path = os.environ.get(HASH_CACHE_ENV, DEFAULT_HASH_CACHE)
+    return path if path else None
+
+
+def is_read_only():
+    """Return whether the caches must not be created or modified."""
+    return bool(os.environ.get(READ_ONLY_ENV))
+
+
+def open_read_only_db(path):
+    """Return a read-only connection to an SQLite file or None if missing."""
+    if not os.path.isfile(path):
+        return None
+    uri = 'file:' + os.path.abspath(path) + '?mode=ro'
+    return sqlite3.connect(uri, uri=True, timeout=60, isolation_level=None)
+
+
+def _get_hash_cache_connection():
+    path = get_hash_cache_path()
+    if path is None:
+        return None
+    # connections must not be shared between processes and threads
+    pid = os.getpid()
+    if getattr(_hash_cache, 'key', None) == (pid, path):
+        return _hash_cache.conn
+    try:
+        if is_read_only():
+            conn = open_read_only_db(path)
+            _hash_cache.key = (pid, path)
+            _hash_cache.conn = conn
+            return conn
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = sqlite3.connect(path, timeout=60)
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS filehashes ('
+            'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, '
+            'inode INTEGER, sha256 TEXT, last_used REAL)'
+        )
+        conn.commit()
+    except sqlite3.Error:
+        conn = None
+    _hash_cache.key = (pid, path)
+    _hash_cache.conn = conn
+    return conn
+
+
+def _get_stat_key(fname):
+    st = os.stat(fname)
+    return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+def lookup_cached_filehash(fname, stat_key=None):
+    """Return the cached sha256 hash of a file or None."""
+    conn = _get_hash_cache_connection()
+    if conn is None:
+        return None
+    if stat_key is None:
+        stat_key = _get_stat_key(fname)
+    path = os.path.abspath(fname)
+    try:
+        row = conn.execute(
+            'SELECT size, mtime_ns, inode, sha256, last_used FROM filehashes '
+            'WHERE path = ?', (path,)
+        ).fetchone()
+        if row is None or tuple(row[:3]) != stat_key:
+            return None
+        now = time.time()
+        if now - row[4] > LAST_USED_RESOLUTION and not is_read_only():
+            conn.execute(
+                'UPDATE filehashes SET last_used = ? WHERE path = ?', (now, path)
+            )
+            conn.commit()
+    except sqlite3.Error:
+        return None
+    return row[3]
+
+
+def store_filehash(fname, sha256, stat_key=None):
+    """Store the sha256 hash of a file in the hash cache.
+
+    Nothing is stored if the file has been modified too recently
+    for its modification time to reveal a further change.
+    """
+    conn = _get_hash_cache_connection()
+    if conn is None or is_read_only():
+        return
+    if stat_key is None:
+        stat_key = _get_stat_key(fname)
+    now = time.time()
+    if now - stat_key[1] / 1e9 < RACY_MTIME_WINDOW:
+        return
+    path = os.path.abspath(fname)
+    try:
+        conn.execute(
+            'INSERT OR REPLACE INTO filehashes '
+            '(path, size, mtime_ns, inode, sha256, last_used) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (path, *stat_key, sha256, now)
+        )
+        conn.commit()
+    except sqlite3.Error:
+        pass
+
+
+def evict_stale_hash_cache_entries(max_age=None):
+    """Remove entries of files that changed or vanished.
+
+    If `max_age` (in seconds) is provided, also entries
+    not used for longer than that are removed.
+    Return the number of removed entries.
+    """
+    conn = _get_hash_cache_connection()
+    if conn is None or is_read_only():
+        return 0
+    try:
+        rows = conn.execute(
+            'SELECT path, size, mtime_ns, inode, last_used FROM filehashes'
+        ).fetchall()
+    except sqlite3.Error:
+        return 0
+    now = time.time()
+    stale = []
+    for path, size, mtime_ns, inode, last_used in rows:
+        if max_age is not None and now - last_used > max_age:
+            stale.append(path)
+            continue
+        try:
+            stat_key = _get_stat_key(path)
+        except OSError:
+            stale.append(path)
+            continue
+        if stat_key != (size, mtime_ns, inode):
+            stale.append(path)
+    try:
+        conn.executemany(
+            'DELETE FROM filehashes WHERE path = ?', [(p,) for p in stale]
+        )
+        conn.commit()
+    except sqlite3.Error:
+        return 0
+    return len(stale)
+
+
+def filehash(fname):
+    """Calculate sha256 hash of file.
+
+    For git-annex symlinks, the hash is taken from the annex key
+    and the content is only read for plain or unlocked files.
+    Hashes of the latter are kept in a persistent cache keyed by
+    path, size, modification time and inode.
+    """
+    annex_hash = get_annex_filehash(fname)
+    if annex_hash is not None:
+        return annex_hash
+    stat_key = _get_stat_key(fname)
+    cached_hash = lookup_cached_filehash(fname, stat_key)
+    if cached_hash is not None:
+        return cached_hash
+    sha256 = stream_filehash(fname)
+    # do not cache if the file changed while reading it
+    if _get_stat_key(fname) == stat_key:
+        store_filehash(fname, sha256, stat_key)
+    return sha256
@@ -0,0 +1,35 @@
+import numpy as np
+
+
+def parse_fortran_floats(buf, width):
+    """Convert concatenated fixed-width Fortran number fields to floats.
+
+    The fields may lack the exponent character, e.g. `1.234567+5`, as
+    written by NJOY in ENDF and MATXS files, and blank fields are
+    interpreted as zero. The conversion is vectorised over all fields.
+    """
+    if len(buf) % width != 0:
+        raise ValueError(f'buffer length is not a multiple of {width}')
+    fields = np.frombuffer(buf, dtype=np.uint8).reshape(-1, width)
+    nfields = fields.shape[0]
+    if nfields == 0:
+        return np.empty(0, dtype=np.float64)
+    fields = np.where(fields == ord('D'), ord('E'), fields).astype(np.uint8)
+    is_digit = ((fields >= ord('0')) & (fields <= ord('9'))) | (fields == ord('.'))
+    is_sign = (fields == ord('+')) | (fields == ord('-'))
+    # an exponent sign directly follows a digit or the decimal point
+    is_exp = np.zeros_like(is_sign)
+    is_exp[:, 1:] = is_sign[:, 1:] & is_digit[:, :-1]
+    has_exp = is_exp.any(axis=1)
+    pos = np.where(has_exp, is_exp.argmax(axis=1), width)
+    cols = np.arange(width + 1)
+    src = cols[np.newaxis, :] - (cols[np.newaxis, :] > pos[:, np.newaxis])
+    src = np.minimum(src, width - 1)
+    out = fields[np.arange(nfields)[:, np.newaxis], src]
+    insert_mask = cols[np.newaxis, :] == pos[:, np.newaxis]
+    out[insert_mask & has_exp[:, np.newaxis]] = ord('E')
+    out[~has_exp, width] = ord(' ')
+    blank = (fields == ord(' ')).all(axis=1)
+    out[blank, 0] = ord('0')
+    out = np.ascontiguousarray(out)
+    return out.view(f'S{width+1}').reshape(-1).astype(np.float64)
@@ -0,0 +1,170 @@
+############################################################
+#
+# Numerical comparison of GENDF files (.g and .gam) per
+# reaction and group with relative and absolute
+# tolerances (defaults as in compare_groupr_gfiles.sh).
+#
+# Usage:
+#     python gendf_comparison.py <file1> <file2>
+#     python gendf_comparison.py --commits <commit1> <commit2> <file>
+#
+#     <file1>, <file2>: GENDF files to compare
+#     <commit1>, <commit2>: commits with the versions of <file>
+#                           in the git-annex repository
+#
+############################################################
+
+import sys
+import argparse
+import numpy as np
+
+from gendf_file import read_gendf
+from numeric_comparison import compare_arrays, get_annex_path_at_commit
+
+
+DEFAULT_RTOL = 1e-4
+DEFAULT_ATOL = 1e-10
+
+
+def _flatten_groups(section):
+    sizes = np.array([d.size for d in section['data']], dtype=np.int64)
+    if len(sizes) == 0:
+        return np.empty(0), sizes
+    values = np.concatenate([d.reshape(-1) for d in section['data']])
+    return values, sizes
+
+
+def compare_gendf_sections(sec1, sec2, rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL):
+    """Compare two sections of GENDF files group by group.
+
+    Return a dictionary with the overall result of `compare_arrays`
+    and the indices of the groups with differences together with
+    their maximal absolute and relative deviations.
+    """
+    layout_equal = (
+        np.array_equal(sec1['groups'], sec2['groups']) and
+        np.array_equal(sec1['ng2'], sec2['ng2']) and
+        np.array_equal(sec1['ig2lo'], sec2['ig2lo']) and
+        sec1['nl'] == sec2['nl'] and sec1['nz'] == sec2['nz']
+    )
+    values1, sizes1 = _flatten_groups(sec1)
+    values2, sizes2 = _flatten_groups(sec2)
+    if not layout_equal or not np.array_equal(sizes1, sizes2):
+        return {'equal': False, 'layout_mismatch': True, 'groups': []}
+    res = compare_arrays(values1, values2, rtol, atol)
+    res['layout_mismatch'] = False
+    res['groups'] = []
+    if res['equal'] or values1.size == 0:
+        return res
+    absdiff = np.abs(values1 - values2)
+    scale = np.maximum(np.abs(values1), np.abs(values2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        reldiff = np.where(scale > 0, absdiff / scale, 0.)
+    differs = (absdiff > atol) & (reldiff > rtol)
+    offsets = np.concatenate([[0], np.cumsum(sizes1)[:-1]])
+    nonempty = sizes1 > 0
+    offsets = offsets[nonempty]
+    groups = sec1['groups'][nonempty]
+    group_differs = np.add.reduceat(differs, offsets) > 0
+    group_absdiff = np.maximum.reduceat(absdiff, offsets)
+    group_reldiff = np.maximum.reduceat(reldiff, offsets)
+    for i in np.flatnonzero(group_differs):
+        res['groups'].append({
+            'group': int(groups[i]),
+            'max_abs_diff': float(group_absdiff[i]),
+            'max_rel_diff': float(group_reldiff[i]),
+        })
+    return res
+
+
+def compare_gendf_files(file1, file2, rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL):
+    """Compare two GENDF files and return a report dictionary.
+
+    Materials are matched by MAT number and temperature, sections
+    by MF and MT number. The report contains a result for each section.
+    """
+    materials1 = read_gendf(file1)
+    materials2 = read_gendf(file2)
+    report = {'file1': file1, 'file2': file2, 'equal': True, 'materials': []}
+    keys1 = [(m['mat'], m['temperature']) for m in materials1]
+    keys2 = [(m['mat'], m['temperature']) for m in materials2]
+    if keys1 != keys2:
+        report['equal'] = False
+        report['materials_mismatch'] = True
+        return report
+    for mat1, mat2 in zip(materials1, materials2):
+        matreport = {
+            'mat': mat1['mat'],
+            'temperature': mat1['temperature'],
+            'info': {},
+            'sections': {},
+        }
+        for field in ('sigz', 'egn', 'egg'):
+            matreport['info'][field] = compare_arrays(mat1[field], mat2[field], rtol, atol)
+        secs1 = mat1['sections']
+        secs2 = mat2['sections']
+        for key in sorted(set(secs1) | set(secs2)):
+            if key not in secs1 or key not in secs2:
+                matreport['sections'][key] = {'equal': False, 'missing': True}
+                continue
+            res = compare_gendf_sections(secs1[key], secs2[key], rtol, atol)
+            res['missing'] = False
+            matreport['sections'][key] = res
+        matreport['equal'] = (
+            all(r['equal'] for r in matreport['info'].values()) and
+            all(r['equal'] for r in matreport['sections'].values())
+        )
+        report['materials'].append(matreport)
+    report['equal'] = all(m['equal'] for m in report['materials'])
+    return report
+
+
+def print_gendf_report(report):
+    if report['equal']:
+        return
+    print(f'Difference in {report["file2"]}')
+    if report.get('materials_mismatch', False):
+        print('    different materials or temperatures')
+        return
+    for matreport in report['materials']:
+        for field, res in matreport['info'].items():
+            if not res['equal']:
+                print(f'    MAT{matreport["mat"]} MF1/MT451: {field} differs')
+        for (mf, mt), res in matreport['sections'].items():
+            if res['equal']:
+                continue
+            prefix = f'    MAT{matreport["mat"]} MF{mf}/MT{mt}'
+            if res['missing']:
+                print(f'{prefix}: only present in one file')
+            elif res['layout_mismatch']:
+                print(f'{prefix}: different group layout')
+            else:
+                print(f'{prefix}: max abs diff {res["max_abs_diff"]:.4e}, '
+                      f'max rel diff {res["max_rel_diff"]:.4e} in groups '
+                      + ' '.join(str(g['group']) for g in res['groups']))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='+', help='files to compare')
+    parser.add_argument('--commits', nargs=2, default=None,
+                        help='compare the versions of a file at two commits')
+    parser.add_argument('--rtol', type=float, default=DEFAULT_RTOL)
+    parser.add_argument('--atol', type=float, default=DEFAULT_ATOL)
+    args = parser.parse_args()
+
+    if args.commits is not None:
+        if len(args.paths) != 1:
+            parser.error('exactly one path expected together with --commits')
+        path1 = get_annex_path_at_commit(args.commits[0], args.paths[0])
+        path2 = get_annex_path_at_commit(args.commits[1], args.paths[0])
+    else:
+        if len(args.paths) != 2:
+            parser.error('exactly two paths expected')
+        path1, path2 = args.paths
+
+    report = compare_gendf_files(path1, path2, args.rtol, args.atol)
+    print_gendf_report(report)
+    if not report['equal']:
+        sys.exit(1)
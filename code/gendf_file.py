@@ -0,0 +1,173 @@
+############################################################
+#
+# Streaming reader for GENDF files as produced by the
+# GROUPR and GAMINR modules of NJOY2016. The records of
+# each section are converted at once into NumPy arrays
+# indexed by MAT/MF/MT and group.
+#
+# Usage:
+#     python gendf_file.py <gendf-file>
+#
+#     <gendf-file>: A GENDF file, e.g. a .g or .gam file
+#
+############################################################
+
+import os
+import sys
+import numpy as np
+
+from fortran_format import parse_fortran_floats
+
+
+ENDF_FIELD_WIDTH = 11
+ENDF_DATA_WIDTH = 66
+
+
+def iter_endf_sections(filename):
+    """Yield (mat, mf, mt, lines) for each section of an ENDF file.
+
+    The file is read line by line, only the lines of the current
+    section are kept in memory. The tape identification and the
+    SEND/FEND/MEND/TEND records are skipped.
+    """
+    with open(filename, 'rb') as f:
+        f.readline()
+        curkey = None
+        lines = []
+        for line in f:
+            try:
+                mat = int(line[66:70])
+                mf = int(line[70:72])
+                mt = int(line[72:75])
+            except ValueError:
+                raise ValueError(f'invalid control fields in line: {line!r}')
+            if mt == 0:
+                if curkey is not None:
+                    yield curkey + (lines,)
+                curkey = None
+                lines = []
+                continue
+            curkey = (mat, mf, mt)
+            lines.append(line[:ENDF_DATA_WIDTH].rstrip(b'\r\n').ljust(ENDF_DATA_WIDTH))
+        if curkey is not None:
+            yield curkey + (lines,)
+
+
+def _parse_section_values(lines):
+    values = parse_fortran_floats(b''.join(lines), ENDF_FIELD_WIDTH)
+    return values.reshape(-1, 6)
+
+
+def _parse_gendf_info(values):
+    head = values[0]
+    nz = int(head[3])
+    ntw = int(head[5])
+    cont = values[1]
+    ngn = int(cont[2])
+    ngg = int(cont[3])
+    data = values[2:].reshape(-1)
+    pos = ntw
+    sigz = data[pos:pos+nz]
+    pos += nz
+    egn = data[pos:pos+ngn+1]
+    pos += ngn + 1
+    egg = data[pos:pos+ngg+1]
+    return {
+        'za': float(head[0]),
+        'awr': float(head[1]),
+        'temperature': float(cont[0]),
+        'sigz': sigz,
+        'egn': egn,
+        'egg': egg,
+    }
+
+
+def _parse_gendf_section(mf, mt, values):
+    head = values[0]
+    nl = int(head[2])
+    nz = int(head[3])
+    groups = []
+    ng2s = []
+    ig2los = []
+    data = []
+    temperature = None
+    row = 1
+    while row < len(values):
+        cont = values[row]
+        temperature = float(cont[0])
+        ng2 = int(cont[2])
+        ig2lo = int(cont[3])
+        nw = int(cont[4])
+        ig = int(cont[5])
+        nrows = -(-nw // 6)
+        listdata = values[row+1:row+1+nrows].reshape(-1)[:nw]
+        groups.append(ig)
+        ng2s.append(ng2)
+        ig2los.append(ig2lo)
+        data.append(listdata.reshape(ng2, nz, nl) if nw == ng2*nz*nl else listdata)
+        row += 1 + nrows
+    return {
+        'mf': mf,
+        'mt': mt,
+        'za': float(head[0]),
+        'awr': float(head[1]),
+        'nl': nl,
+        'nz': nz,
+        'lrflag': int(head[4]),
+        'ngn': int(head[5]),
+        'temperature': temperature,
+        'groups': np.array(groups, dtype=np.int64),
+        'ng2': np.array(ng2s, dtype=np.int64),
+        'ig2lo': np.array(ig2los, dtype=np.int64),
+        'data': data,
+    }
+
+
+def read_gendf(filename):
+    """Read a GENDF file and return a list of materials.
+
+    Each material (one per MAT number and temperature) is a dictionary
+    with the information of MF1/MT451 (sigma zero values, neutron and
+    gamma group boundaries) and `sections` indexed by (MF, MT). Each
+    section contains the group indices in `groups` and the LIST data
+    of each group in `data`, shaped as (NG2, NZ, NL).
+    """
+    materials = []
+    curmat = None
+    for mat, mf, mt, lines in iter_endf_sections(filename):
+        values = _parse_section_values(lines)
+        if mf == 1 and mt == 451:
+            curmat = _parse_gendf_info(values)
+            curmat['mat'] = mat
+            curmat['sections'] = {}
+            materials.append(curmat)
+            continue
+        if curmat is None or curmat['mat'] != mat:
+            raise ValueError(f'section MF{mf}/MT{mt} of MAT{mat} without MF1/MT451')
+        curmat['sections'][(mf, mt)] = _parse_gendf_section(mf, mt, values)
+    return materials
+
+
+def get_gendf_section(materials, mat, mf, mt, temperature=None):
+    """Return a section of a material read by `read_gendf`."""
+    for curmat in materials:
+        if curmat['mat'] != mat:
+            continue
+        if temperature is not None and curmat['temperature'] != temperature:
+            continue
+        return curmat['sections'][(mf, mt)]
+    raise KeyError(f'no section MF{mf}/MT{mt} for MAT{mat}')
+
+
+if __name__ == '__main__':
+
+    gendfpath = sys.argv[1]
+    materials = read_gendf(gendfpath)
+    for curmat in materials:
+        print(f'{os.path.basename(gendfpath)}: MAT{curmat["mat"]} '
+              f'temp={curmat["temperature"]} '
+              f'neutron groups={len(curmat["egn"])-1} '
+              f'gamma groups={max(len(curmat["egg"])-1, 0)}')
+        for mf, mt in curmat['sections']:
+            sec = curmat['sections'][(mf, mt)]
+            print(f'    MF{mf}/MT{mt}: {len(sec["groups"])} groups')
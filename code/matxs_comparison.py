@@ -0,0 +1,187 @@
+############################################################
+#
+# Numerical comparison of MATXS files (.m) per material,
+# vector and scattering matrix with relative and absolute
+# tolerances (defaults as in compare_matxsr_mfiles.sh).
+#
+# Usage:
+#     python matxs_comparison.py <file1> <file2>
+#     python matxs_comparison.py --commits <commit1> <commit2> <file>
+#
+#     <file1>, <file2>: MATXS files or npz files created
+#                       with matxs_file.py to compare
+#     <commit1>, <commit2>: commits with the versions of <file>
+#                           in the git-annex repository
+#
+############################################################
+
+import sys
+import argparse
+import numpy as np
+
+from matxs_file import read_matxs, load_matxs_npz, get_dense_matrix
+from numeric_comparison import compare_arrays, get_annex_path_at_commit
+
+
+DEFAULT_RTOL = 1e-4
+DEFAULT_ATOL = 1e-10
+
+
+def load_matxs(filename):
+    if filename.endswith('.npz'):
+        return load_matxs_npz(filename)
+    return read_matxs(filename)
+
+
+def compare_matxs_matrices(mtx1, mtx2, ngr_out, ngr_in, rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL):
+    """Compare two scattering matrices.
+
+    If the band structure is the same, only the stored values
+    are compared, otherwise the densified matrices.
+    """
+    if mtx1['lord'] != mtx2['lord']:
+        return {'equal': False, 'shape_mismatch': True, 'lord_mismatch': True}
+    same_layout = (np.array_equal(mtx1['sink'], mtx2['sink']) and
+                   np.array_equal(mtx1['source'], mtx2['source']))
+    if same_layout:
+        res = compare_arrays(mtx1['values'], mtx2['values'], rtol, atol)
+    else:
+        res = compare_arrays(get_dense_matrix(mtx1, ngr_out, ngr_in),
+                             get_dense_matrix(mtx2, ngr_out, ngr_in), rtol, atol)
+    res['lord_mismatch'] = False
+    res['layout_mismatch'] = not same_layout
+    const1 = mtx1['constant']
+    const2 = mtx2['constant']
+    if const1 is not None or const2 is not None:
+        if const1 is None or const2 is None:
+            res['equal'] = False
+        else:
+            res['equal'] = res['equal'] and compare_arrays(const1, const2, rtol, atol)['equal']
+    return res
+
+
+def compare_matxs_files(file1, file2, rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL):
+    """Compare two MATXS files and return a report dictionary.
+
+    Materials are matched by name, submaterials by data type,
+    temperature and sigma zero value. The report contains the
+    results for the group structures, vectors and matrices.
+    """
+    matxs1 = load_matxs(file1)
+    matxs2 = load_matxs(file2)
+    report = {'file1': file1, 'file2': file2, 'equal': True,
+              'group_bounds': {}, 'materials': {}}
+    if (matxs1['particles'] != matxs2['particles'] or
+            matxs1['types'] != matxs2['types'] or
+            set(matxs1['materials']) != set(matxs2['materials'])):
+        report['equal'] = False
+        report['structure_mismatch'] = True
+        return report
+    for part in matxs1['particles']:
+        report['group_bounds'][part] = compare_arrays(
+            matxs1['group_bounds'][part], matxs2['group_bounds'][part], rtol, atol
+        )
+    ngrps = {p: len(g) - 1 for p, g in matxs1['group_bounds'].items()}
+    for matname, mat1 in matxs1['materials'].items():
+        mat2 = matxs2['materials'][matname]
+        subs2 = {(s['type'], s['temperature'], s['sigz']): s for s in mat2['submaterials']}
+        matreport = {'submaterials': {}}
+        for sub1 in mat1['submaterials']:
+            key = (sub1['type'], sub1['temperature'], sub1['sigz'])
+            sub2 = subs2.pop(key, None)
+            if sub2 is None:
+                matreport['submaterials'][key] = {'equal': False, 'missing': True}
+                continue
+            itype = matxs1['types'].index(sub1['type'])
+            ngr_in = ngrps[matxs1['particles'][matxs1['jinp'][itype]-1]]
+            ngr_out = ngrps[matxs1['particles'][matxs1['joutp'][itype]-1]]
+            subreport = {'missing': False, 'vectors': {}, 'matrices': {}}
+            for name in sorted(set(sub1['vectors']) | set(sub2['vectors'])):
+                if name not in sub1['vectors'] or name not in sub2['vectors']:
+                    subreport['vectors'][name] = {'equal': False, 'missing': True}
+                    continue
+                res = compare_arrays(sub1['vectors'][name], sub2['vectors'][name], rtol, atol)
+                res['missing'] = False
+                subreport['vectors'][name] = res
+            for name in sorted(set(sub1['matrices']) | set(sub2['matrices'])):
+                if name not in sub1['matrices'] or name not in sub2['matrices']:
+                    subreport['matrices'][name] = {'equal': False, 'missing': True}
+                    continue
+                res = compare_matxs_matrices(sub1['matrices'][name], sub2['matrices'][name],
+                                             ngr_out, ngr_in, rtol, atol)
+                res['missing'] = False
+                subreport['matrices'][name] = res
+            subreport['equal'] = (
+                all(r['equal'] for r in subreport['vectors'].values()) and
+                all(r['equal'] for r in subreport['matrices'].values())
+            )
+            matreport['submaterials'][key] = subreport
+        for key in subs2:
+            matreport['submaterials'][key] = {'equal': False, 'missing': True}
+        matreport['equal'] = all(r['equal'] for r in matreport['submaterials'].values())
+        report['materials'][matname] = matreport
+    report['equal'] = (
+        all(r['equal'] for r in report['group_bounds'].values()) and
+        all(r['equal'] for r in report['materials'].values())
+    )
+    return report
+
+
+def _format_result(res):
+    if res['missing']:
+        return 'only present in one file'
+    if res['shape_mismatch']:
+        return 'different shape'
+    return (f'max abs diff {res["max_abs_diff"]:.4e}, '
+            f'max rel diff {res["max_rel_diff"]:.4e}, '
+            f'{res["num_differences"]} values differ')
+
+
+def print_matxs_report(report):
+    if report['equal']:
+        return
+    print(f'Difference in {report["file2"]}')
+    if report.get('structure_mismatch', False):
+        print('    different particles, data types or materials')
+        return
+    for part, res in report['group_bounds'].items():
+        if not res['equal']:
+            print(f'    group structure of {part} differs')
+    for matname, matreport in report['materials'].items():
+        for (dtype, temp, sigz), subreport in matreport['submaterials'].items():
+            if subreport['equal']:
+                continue
+            prefix = f'    {matname} {dtype} temp={temp} sigz={sigz:.3e}'
+            if subreport['missing']:
+                print(f'{prefix}: only present in one file')
+                continue
+            for kind, label in (('vectors', 'vector'), ('matrices', 'matrix')):
+                for name, res in subreport[kind].items():
+                    if not res['equal']:
+                        print(f'{prefix} {label} {name}: {_format_result(res)}')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='+', help='files to compare')
+    parser.add_argument('--commits', nargs=2, default=None,
+                        help='compare the versions of a file at two commits')
+    parser.add_argument('--rtol', type=float, default=DEFAULT_RTOL)
+    parser.add_argument('--atol', type=float, default=DEFAULT_ATOL)
+    args = parser.parse_args()
+
+    if args.commits is not None:
+        if len(args.paths) != 1:
+            parser.error('exactly one path expected together with --commits')
+        path1 = get_annex_path_at_commit(args.commits[0], args.paths[0])
+        path2 = get_annex_path_at_commit(args.commits[1], args.paths[0])
+    else:
+        if len(args.paths) != 2:
+            parser.error('exactly two paths expected')
+        path1, path2 = args.paths
+
+    report = compare_matxs_files(path1, path2, args.rtol, args.atol)
+    print_matxs_report(report)
+    if not report['equal']:
+        sys.exit(1)
@@ -0,0 +1,339 @@
+############################################################
+#
+# Reader for MATXS files in BCD (ASCII) format as produced
+# by the MATXSR module of NJOY2016. Group structures and
+# vector cross sections are returned as NumPy arrays,
+# scattering matrices in coordinate (sink, source) form.
+# The data can be exported to and loaded from npz files.
+#
+# Usage:
+#     python matxs_file.py <matxs-file> [<npz-file>]
+#
+#     <matxs-file>: A MATXS file, e.g. a .m file
+#     <npz-file>:   Optional npz file to export the data to
+#
+############################################################
+
+import os
+import sys
+import json
+import numpy as np
+
+from fortran_format import parse_fortran_floats
+
+
+MATXS_FLOAT_WIDTH = 12
+MATXS_INT_WIDTH = 6
+MATXS_HOLL_WIDTH = 8
+MATXS_LINE_WIDTH = 72
+MATXS_RECORD_IDS = ('0v', '1d', '2d', '3d', '4d', '5d', '6d', '7d', '8d', '9d', '10d')
+
+
+def iter_matxs_records(filename):
+    """Yield (record id, lines) for each record of a MATXS file.
+
+    Records begin with a line whose first four characters contain
+    the record identification, e.g. ` 4d `.
+    """
+    with open(filename, 'r') as f:
+        recid = None
+        lines = []
+        for line in f:
+            line = line.rstrip('\r\n')
+            curid = line[:4].strip()
+            if curid in MATXS_RECORD_IDS:
+                if recid is not None:
+                    yield recid, lines
+                recid = curid
+                lines = [line]
+            else:
+                lines.append(line)
+        if recid is not None:
+            yield recid, lines
+
+
+def _count_fields(text, width):
+    text = text.rstrip()
+    return -(-len(text) // width)
+
+
+def _parse_floats(lines, first_col=12):
+    """Parse the floats of a record with 5 values in the first line."""
+    chunks = []
+    segments = [lines[0][first_col:MATXS_LINE_WIDTH]]
+    segments += [line[:MATXS_LINE_WIDTH] for line in lines[1:]]
+    for seg in segments:
+        nfields = _count_fields(seg, MATXS_FLOAT_WIDTH)
+        chunks.append(seg.ljust(nfields*MATXS_FLOAT_WIDTH)[:nfields*MATXS_FLOAT_WIDTH])
+    return parse_fortran_floats(''.join(chunks).encode(), MATXS_FLOAT_WIDTH)
+
+
+def _parse_hollerith(lines, num, first_col=8):
+    """Parse `num` hollerith words beginning in the first line of `lines`.
+
+    Return the words and the number of lines consumed.
+    """
+    words = []
+    text = lines[0][first_col:MATXS_LINE_WIDTH].ljust(MATXS_LINE_WIDTH - first_col)
+    nlines = 1
+    while True:
+        while text and len(words) < num:
+            words.append(text[:MATXS_HOLL_WIDTH].strip())
+            text = text[MATXS_HOLL_WIDTH:]
+        if len(words) >= num:
+            return words, nlines
+        text = lines[nlines][:MATXS_LINE_WIDTH].ljust(MATXS_LINE_WIDTH)
+        nlines += 1
+
+
+def _parse_ints(lines):
+    values = []
+    for line in lines:
+        line = line[:MATXS_LINE_WIDTH]
+        nfields = _count_fields(line, MATXS_INT_WIDTH)
+        line = line.ljust(nfields*MATXS_INT_WIDTH)
+        for i in range(nfields):
+            values.append(int(line[i*MATXS_INT_WIDTH:(i+1)*MATXS_INT_WIDTH]))
+    return np.array(values, dtype=np.int64)
+
+
+def _build_matrix(hmtx, lord, jconst, jband, ijj, subblocks, constant):
+    nnz = int(jband.sum())
+    if sum(b.size for b in subblocks) != lord * nnz:
+        raise ValueError(f'unexpected size of scattering matrix {hmtx}')
+    # each sub-block stores ((scat(k,l), k=1,kmax), l=1,lord) where
+    # kmax is the sum of the band widths of its sink groups
+    blocks = []
+    for block in subblocks:
+        if block.size % lord != 0:
+            raise ValueError(f'inconsistent sub-block of scattering matrix {hmtx}')
+        blocks.append(block.reshape(lord, block.size // lord))
+    data = np.concatenate(blocks, axis=1) if blocks else np.empty((lord, 0))
+    sink = np.repeat(np.arange(1, len(jband)+1), jband)
+    band_start = np.repeat(np.cumsum(jband) - jband, jband)
+    source = np.repeat(ijj, jband) - (np.arange(nnz) - band_start)
+    return {
+        'name': hmtx,
+        'lord': lord,
+        'jconst': jconst,
+        'sink': sink,
+        'source': source,
+        'values': data,
+        'constant': constant,
+    }
+
+
+def read_matxs(filename):
+    """Read a MATXS file and return its content as a dictionary.
+
+    The dictionary contains the particle, data type and material names,
+    the group boundaries of each particle and for each material
+    the submaterials with their vectors and scattering matrices.
+    """
+    records = list(iter_matxs_records(filename))
+    pos = 0
+
+    def next_record(expected):
+        nonlocal pos
+        recid, lines = records[pos]
+        if recid != expected:
+            raise ValueError(f'expected record {expected} but found {recid}')
+        pos += 1
+        return lines
+
+    lines = next_record('0v')
+    matxs = {
+        'hname': lines[0][4:12].strip(),
+        'huse': [lines[0][13:21].strip(), lines[0][21:29].strip()],
+        'ivers': int(lines[0][30:36]),
+    }
+    lines = next_record('1d')
+    npart, ntype, nholl, nmat, maxw, length = [int(x) for x in lines[0][6:].split()[:6]]
+    lines = next_record('2d')
+    matxs['hsetid'], _ = _parse_hollerith(lines, nholl, first_col=4)
+    lines = next_record('3d')
+    names, nlines = _parse_hollerith(lines, npart + ntype + nmat)
+    ints = _parse_ints(lines[nlines:])
+    matxs['particles'] = names[:npart]
+    matxs['types'] = names[npart:npart+ntype]
+    matnames = names[npart+ntype:]
+    ngrp = ints[:npart]
+    jinp = ints[npart:npart+ntype]
+    joutp = ints[npart+ntype:npart+2*ntype]
+    nsubm = ints[npart+2*ntype:npart+2*ntype+nmat]
+    matxs['jinp'] = jinp
+    matxs['joutp'] = joutp
+    matxs['group_bounds'] = {}
+    for ipart in range(npart):
+        gpb = _parse_floats(next_record('4d'))
+        matxs['group_bounds'][matxs['particles'][ipart]] = gpb[:ngrp[ipart]+1]
+    matxs['materials'] = {}
+    for imat in range(nmat):
+        lines = next_record('5d')
+        material = {
+            'name': lines[0][8:16].strip(),
+            'amass': float(_parse_floats(lines[:1], first_col=17)[0]),
+            'submaterials': [],
+        }
+        subinfo = []
+        for line in lines[1:1+nsubm[imat]]:
+            line = line.ljust(48)
+            temp, sigz = parse_fortran_floats(line[:24].encode(), MATXS_FLOAT_WIDTH)
+            itype, n1d, n2d, locs = [int(line[24+6*i:30+6*i]) for i in range(4)]
+            subinfo.append((temp, sigz, itype, n1d, n2d, locs))
+        for temp, sigz, itype, n1d, n2d, locs in subinfo:
+            ngr_in = int(ngrp[jinp[itype-1]-1])
+            ngr_out = int(ngrp[joutp[itype-1]-1])
+            sub = {
+                'temperature': float(temp),
+                'sigz': float(sigz),
+                'type': matxs['types'][itype-1],
+                'vectors': {},
+                'matrices': {},
+            }
+            if n1d > 0:
+                lines = next_record('6d')
+                vnames, nlines = _parse_hollerith(lines, n1d)
+                ints = _parse_ints(lines[nlines:])
+                nfg = ints[:n1d]
+                nlg = ints[n1d:2*n1d]
+                chunks = []
+                while pos < len(records) and records[pos][0] == '7d':
+                    chunks.append(_parse_floats(next_record('7d')))
+                vps = np.concatenate(chunks) if chunks else np.empty(0)
+                vpos = 0
+                for name, first, last in zip(vnames, nfg, nlg):
+                    vec = np.zeros(ngr_in)
+                    nvals = last - first + 1
+                    vec[first-1:last] = vps[vpos:vpos+nvals]
+                    vpos += nvals
+                    sub['vectors'][name] = vec
+            for imtx in range(n2d):
+                lines = next_record('8d')
+                hmtx = lines[0][8:16].strip()
+                lord = int(lines[0][17:23])
+                jconst = int(lines[0][23:29])
+                ints = _parse_ints(lines[1:])
+                jband = ints[:ngr_out]
+                ijj = ints[ngr_out:2*ngr_out]
+                subblocks = []
+                while pos < len(records) and records[pos][0] == '9d':
+                    subblocks.append(_parse_floats(next_record('9d')))
+                constant = None
+                if jconst > 0:
+                    constant = _parse_floats(next_record('10d'))
+                sub['matrices'][hmtx] = _build_matrix(
+                    hmtx, lord, jconst, jband, ijj, subblocks, constant
+                )
+            material['submaterials'].append(sub)
+        matxs['materials'][matnames[imat]] = material
+    return matxs
+
+
+def get_dense_matrix(matrix, ngr_out, ngr_in):
+    """Return a scattering matrix as array of shape (lord, ngr_out, ngr_in)."""
+    dense = np.zeros((matrix['lord'], ngr_out, ngr_in))
+    dense[:, matrix['sink']-1, matrix['source']-1] = matrix['values']
+    return dense
+
+
+def export_matxs_npz(matxs, filename):
+    """Store the content read by `read_matxs` in a compressed npz file."""
+    arrays = {}
+    meta = {
+        'hname': matxs['hname'],
+        'huse': matxs['huse'],
+        'ivers': matxs['ivers'],
+        'hsetid': matxs['hsetid'],
+        'particles': matxs['particles'],
+        'types': matxs['types'],
+        'materials': {},
+    }
+    arrays['jinp'] = matxs['jinp']
+    arrays['joutp'] = matxs['joutp']
+    for part, gpb in matxs['group_bounds'].items():
+        arrays[f'group_bounds/{part}'] = gpb
+    for matname, material in matxs['materials'].items():
+        matmeta = {'name': material['name'], 'amass': material['amass'],
+                   'submaterials': []}
+        for isub, sub in enumerate(material['submaterials']):
+            prefix = f'{matname}/{isub}'
+            submeta = {
+                'temperature': sub['temperature'],
+                'sigz': sub['sigz'],
+                'type': sub['type'],
+                'vectors': list(sub['vectors']),
+                'matrices': {},
+            }
+            for name, vec in sub['vectors'].items():
+                arrays[f'{prefix}/vector/{name}'] = vec
+            for name, mtx in sub['matrices'].items():
+                submeta['matrices'][name] = {
+                    'lord': mtx['lord'],
+                    'jconst': mtx['jconst'],
+                    'has_constant': mtx['constant'] is not None,
+                }
+                for field in ('sink', 'source', 'values'):
+                    arrays[f'{prefix}/matrix/{name}/{field}'] = mtx[field]
+                if mtx['constant'] is not None:
+                    arrays[f'{prefix}/matrix/{name}/constant'] = mtx['constant']
+            matmeta['submaterials'].append(submeta)
+        meta['materials'][matname] = matmeta
+    arrays['meta'] = np.array(json.dumps(meta))
+    np.savez_compressed(filename, **arrays)
+
+
+def load_matxs_npz(filename):
+    """Load a npz file created by `export_matxs_npz`."""
+    with np.load(filename) as npz:
+        arrays = {k: npz[k] for k in npz.files}
+    meta = json.loads(str(arrays['meta']))
+    matxs = {k: meta[k] for k in ('hname', 'huse', 'ivers', 'hsetid',
+                                  'particles', 'types')}
+    matxs['jinp'] = arrays['jinp']
+    matxs['joutp'] = arrays['joutp']
+    matxs['group_bounds'] = {
+        part: arrays[f'group_bounds/{part}'] for part in meta['particles']
+        if f'group_bounds/{part}' in arrays
+    }
+    matxs['materials'] = {}
+    for matname, matmeta in meta['materials'].items():
+        material = {'name': matmeta['name'], 'amass': matmeta['amass'],
+                    'submaterials': []}
+        for isub, submeta in enumerate(matmeta['submaterials']):
+            prefix = f'{matname}/{isub}'
+            sub = {k: submeta[k] for k in ('temperature', 'sigz', 'type')}
+            sub['vectors'] = {
+                name: arrays[f'{prefix}/vector/{name}'] for name in submeta['vectors']
+            }
+            sub['matrices'] = {}
+            for name, mtxmeta in submeta['matrices'].items():
+                mprefix = f'{prefix}/matrix/{name}'
+                sub['matrices'][name] = {
+                    'name': name,
+                    'lord': mtxmeta['lord'],
+                    'jconst': mtxmeta['jconst'],
+                    'sink': arrays[f'{mprefix}/sink'],
+                    'source': arrays[f'{mprefix}/source'],
+                    'values': arrays[f'{mprefix}/values'],
+                    'constant': arrays[f'{mprefix}/constant']
+                    if mtxmeta['has_constant'] else None,
+                }
+            material['submaterials'].append(sub)
+        matxs['materials'][matname] = material
+    return matxs
+
+
+if __name__ == '__main__':
+
+    matxspath = sys.argv[1]
+    matxs = read_matxs(matxspath)
+    print(f'{os.path.basename(matxspath)}: particles ' + ' '.join(
+        f'{p}({len(g)-1})' for p, g in matxs['group_bounds'].items()))
+    for matname, material in matxs['materials'].items():
+        for sub in material['submaterials']:
+            print(f'    {matname} {sub["type"]} temp={sub["temperature"]} '
+                  f'sigz={sub["sigz"]:.3e} vectors={len(sub["vectors"])} '
+                  f'matrices={len(sub["matrices"])}')
+    if len(sys.argv) > 2:
+        export_matxs_npz(matxs, sys.argv[2])
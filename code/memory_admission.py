@@ -0,0 +1,119 @@
+############################################################
+#
+# Admission control of NJOY runs by memory. The peak RSS
+# of NJOY recorded for each material in the trackdb index
+# is used to predict the memory of a task, materials never
+# run are estimated from the size of their ENDF inputs.
+# Tasks are only started while the predicted memory of the
+# running tasks fits the configured budget. A task that
+# alone exceeds the budget is run when nothing else runs.
+#
+############################################################
+
+import threading
+import statistics
+
+from trackdb_index import get_njoy_usage_records, get_trackfile_ids
+
+
+# memory estimate for materials without recorded peak RSS
+DEFAULT_MEMORY_BASE = 64 * 1024**2
+DEFAULT_MEMORY_PER_INPUT_BYTE = 20
+# margin applied to recorded values
+MEMORY_SAFETY_FACTOR = 1.2
+
+
+def get_task_ids(task):
+    return get_trackfile_ids(task['fendl_paths']['trackfile'])
+
+
+def get_memory_per_input_byte(tasks, usage_records):
+    """Return the median ratio of peak RSS to input size of recorded tasks."""
+    ratios = []
+    for task in tasks:
+        usage = usage_records.get(get_task_ids(task))
+        if usage is not None and task['cost'] > 0:
+            ratios.append(usage['maxrss_kb'] * 1024 / task['cost'])
+    if not ratios:
+        return DEFAULT_MEMORY_PER_INPUT_BYTE
+    return statistics.median(ratios)
+
+
+def predict_task_memory(tasks, usage_records=None):
+    """Return the predicted peak memory in bytes of each task.
+
+    Recorded peak RSS values are increased by a safety margin,
+    the memory of other tasks is estimated from their input size
+    using the ratio observed for the recorded tasks.
+    """
+    if usage_records is None:
+        usage_records = get_njoy_usage_records()
+    per_byte = get_memory_per_input_byte(tasks, usage_records)
+    predictions = []
+    for task in tasks:
+        usage = usage_records.get(get_task_ids(task))
+        if usage is not None:
+            predictions.append(int(usage['maxrss_kb'] * 1024 * MEMORY_SAFETY_FACTOR))
+        else:
+            predictions.append(int(DEFAULT_MEMORY_BASE + per_byte * task['cost']))
+    return predictions
+
+
+class MemoryScheduler:
+    """Hand out tasks while their predicted memory fits a budget.
+
+    The tasks are considered in the given order and the first one
+    fitting into the remaining budget is started, so smaller tasks
+    fill the gaps left by large ones. Without a budget, the tasks
+    are handed out in order.
+    """
+
+    def __init__(self, tasks, budget=None, predictions=None):
+        if budget is not None and predictions is None:
+            predictions = predict_task_memory(tasks)
+        if predictions is None:
+            predictions = [0] * len(tasks)
+        self.budget = budget
+        self._pending = list(zip(tasks, predictions))
+        self._running = {}
+        self._used = 0
+        self._cond = threading.Condition()
+
+    def _select(self):
+        if self.budget is None or not self._running:
+            return 0
+        for idx, (_, memory) in enumerate(self._pending):
+            if self._used + memory <= self.budget:
+                return idx
+        return None
+
+    def acquire(self, block=True):
+        """Return the next admissible task.
+
+        None is returned if no task is pending or, if `block` is false,
+        if no pending task fits into the remaining budget.
+        """
+        with self._cond:
+            while self._pending:
+                idx = self._select()
+                if idx is not None:
+                    task, memory = self._pending.pop(idx)
+                    self._running[id(task)] = memory
+                    self._used += memory
+                    return task
+                if not block:
+                    return None
+                self._cond.wait()
+            return None
+
+    def release(self, task):
+        """Return the memory of a finished task to the budget."""
+        with self._cond:
+            memory = self._running.pop(id(task), None)
+            if memory is not None:
+                self._used -= memory
+                self._cond.notify_all()
+
+    def num_pending(self):
+        with self._cond:
+            return len(self._pending)
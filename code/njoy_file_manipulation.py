@@ -1,12 +1,119 @@
+import os
 import re
+import hashlib
+
+
+NJOY_MODULE_NAMES = (
+    'moder', 'reconr', 'broadr', 'unresr', 'heatr', 'thermr', 'groupr',
+    'gaminr', 'errorr', 'covr', 'dtfr', 'ccccr', 'matxsr', 'resxsr',
+    'acer', 'powr', 'wimsr', 'plotr', 'viewr', 'mixr', 'purr', 'leapr',
+    'gaspr', 'stop'
+)
+
+
+def _get_module_name(line):
+    for name in NJOY_MODULE_NAMES:
+        if line[:len(name)] == name:
+            return name
+    return None
+
+
+class NjoyInput(list):
+    """Lines of an NJOY input file indexed by module cards.
+
+    The input is scanned once for the lines starting with a module
+    name. The comment locators below use this index instead of scanning
+    all lines if they are given an NjoyInput object. Lines can be
+    replaced but must not be inserted or removed.
+    """
+
+    def __init__(self, lines=()):
+        super().__init__(lines)
+        self._cards = {}
+        for idx, line in enumerate(self):
+            name = _get_module_name(line)
+            if name is not None:
+                self._cards.setdefault(name, []).append(idx)
+
+    @classmethod
+    def read(cls, filename):
+        with open(filename, 'r') as f:
+            return cls(s.rstrip('\n') for s in f)
+
+    def __setitem__(self, idx, line):
+        if not isinstance(idx, int):
+            raise TypeError('only single lines can be replaced')
+        idx = idx if idx >= 0 else idx + len(self)
+        oldname = _get_module_name(self[idx])
+        newname = _get_module_name(line)
+        super().__setitem__(idx, line)
+        if oldname != newname:
+            if oldname is not None:
+                self._cards[oldname].remove(idx)
+            if newname is not None:
+                self._cards.setdefault(newname, []).append(idx)
+                self._cards[newname].sort()
+
+    def get_module_card_indices(self, name):
+        """Return the indices of the lines starting with a module name."""
+        return list(self._cards.get(name, []))
+
+    def get_modules(self):
+        """Return (name, line index, tape numbers) for each module card."""
+        modules = []
+        for name, indices in self._cards.items():
+            for idx in indices:
+                tapes = []
+                if idx + 1 < len(self):
+                    for field in self[idx+1].split('/')[0].split():
+                        try:
+                            tapes.append(int(field))
+                        except ValueError:
+                            break
+                modules.append((name, idx, tapes))
+        return sorted(modules, key=lambda x: x[1])
+
+    def update(self, edits):
+        """Replace several lines given as dictionary {index: line}."""
+        for idx, line in edits.items():
+            self[idx] = line
+
+    def serialize(self):
+        return ''.join(s + '\n' for s in self)
+
+    def write(self, filename):
+        """Write the lines to a file if its content is different.
+
+        Return whether the file has been written.
+        """
+        content = self.serialize()
+        try:
+            with open(filename, 'r', newline='') as f:
+                if f.read() == content:
+                    return False
+        except FileNotFoundError:
+            pass
+        if os.path.lexists(filename):
+            os.unlink(filename)
+        with open(filename, 'w') as fout:
+            fout.write(content)
+        return True
+
+
+def _iter_module_card_indices(lines, name, nlines):
+    """Yield the indices of module cards followed by at least `nlines` lines."""
+    if isinstance(lines, NjoyInput):
+        candidates = lines.get_module_card_indices(name)
+    else:
+        candidates = (i for i, line in enumerate(lines) if line[:len(name)] == name)
+    for idx in candidates:
+        if idx + nlines >= len(lines):
+            break
+        yield idx
 
 
 def get_moder_comment_line_idx(lines):
-    idx = -1
-    while idx+2 < len(lines):
-        idx += 1
-        if lines[idx][:len('moder')] != 'moder':
-            continue
+    for idx in _iter_module_card_indices(lines, 'moder', 2):
         if lines[idx+1].rstrip('/').split() != ['1', '-21']:
             continue
         if not lines[idx+2].startswith("'"):
@@ -29,11 +136,7 @@ def set_moder_comment(lines, comment):
 
 
 def _get_reconr_comment_line_idx(lines, tapeids):
-    idx = -1
-    while idx+6 < len(lines):
-        idx += 1
-        if lines[idx][:len('reconr')] != 'reconr':
-            continue
+    for idx in _iter_module_card_indices(lines, 'reconr', 6):
         if lines[idx+1].rstrip('/').split() != tapeids:
             continue
         if not lines[idx+2].startswith("'"):
@@ -83,11 +186,7 @@ def set_reconr_comments2(lines, comments):
 
 
 def get_ace_comment_line_idx(lines):
-    idx = -1
-    while idx+4 < len(lines):
-        idx += 1
-        if lines[idx][:len('acer')] != 'acer':
-            continue
+    for idx in _iter_module_card_indices(lines, 'acer', 3):
         if lines[idx+1].rstrip('/').split()[3] != '27':
             continue
         if lines[idx+3][0] != '\'' or lines[idx+3][-2:] != '\'/':
@@ -110,11 +209,7 @@ def set_ace_comment(lines, comment):
 
 
 def get_g_comment_line_idx(lines):
-    idx = -1
-    while idx+4 < len(lines):
-        idx += 1
-        if lines[idx][:len('groupr')] != 'groupr':
-            continue
+    for idx in _iter_module_card_indices(lines, 'groupr', 3):
         if lines[idx+1].rstrip('/').split()[3] != '31':
             continue
         if lines[idx+3][0] != "'" or lines[idx+3][-2:] != "'/":
@@ -137,11 +232,7 @@ def set_g_comment(lines, comment):
 
 
 def get_gam_comment_line_idx(lines):
-    idx = -1
-    while idx+4 < len(lines):
-        idx += 1
-        if lines[idx][:len('gaminr')] != 'gaminr':
-            continue
+    for idx in _iter_module_card_indices(lines, 'gaminr', 3):
         if lines[idx+1].rstrip('/').split()[3] != '43':
             continue
         if lines[idx+3][0] != "'" or lines[idx+3][-2:] != "'/":
@@ -164,11 +255,7 @@ def set_gam_comment(lines, comment):
 
 
 def get_m_comment_line_idx(lines):
-    idx = -1
-    while idx+4 < len(lines):
-        idx += 1
-        if lines[idx][:len('matxsr')] != 'matxsr':
-            continue
+    for idx in _iter_module_card_indices(lines, 'matxsr', 3):
         if lines[idx+1].rstrip('/').split()[2] != '44':
             continue
         if lines[idx+2][:3] != "1 '" or lines[idx+2][-2:] != "'/":
@@ -191,11 +278,7 @@ def set_m_comment(lines, comment):
 
 
 def get_m_long_comment_line_idx(lines):
-    idx = -1
-    while idx+4 < len(lines):
-        idx += 1
-        if lines[idx][:len('matxsr')] != 'matxsr':
-            continue
+    for idx in _iter_module_card_indices(lines, 'matxsr', 6):
         if lines[idx+1].rstrip('/').split()[2] != '44':
             continue
         if not lines[idx+4].startswith("'"):
@@ -230,56 +313,130 @@ def set_m_long_comments(lines, comments):
     lines[idx+2] = f"'{comments[2]}'/"
 
 
-def set_njoy_outfile_date(filename, datetime_obj):
-    with open(filename, 'r') as f:
-        lines = f.readlines()
-    datestr1 = lines[6][61:67]
-    datestr2 = lines[6][67:75]
-    if datestr1 != 'date: ':
-        raise ValueError('date signature not matching')
-    if not re.match('^[0-9]{2}/[0-9]{2}/[0-9]{2}$', datestr2):
-        raise ValueError(f'unknown date format {datestr2}')
-    timestr1 = lines[7][61:67]
-    timestr2 = lines[7][67:75]
-    if timestr1 != 'time: ':
+NJOY_OUT_DATE_REGEX = re.compile(b'^ {20} *date  [0-9]{2}/[0-9]{2}/[0-9]{2} *$')
+NJOY_OUT_DURATION_REGEX = re.compile(b'[0-9]{1,4}\\.[0-9]s$')
+NJOY_OUT_DATE_FORMAT = b'^[0-9]{2}/[0-9]{2}/[0-9]{2}$'
+NJOY_OUT_TIME_FORMAT = b'^[0-9]{2}:[0-9]{2}:[0-9]{2}$'
+NJOY_OUT_TIMER_REGEX = re.compile(b' ([0-9]+\\.[0-9])s$')
+NJOY_OUT_MODULE_REGEX = re.compile(b'^ ([a-z0-9]+)\\.\\.\\.')
+
+
+def _patch_njoy_outfile_header_line(line, label, fmt, newstr):
+    if line[61:67] != label:
         raise ValueError('date signature not matching')
-    if not re.match('^[0-9]{2}:[0-9]{2}:[0-9]{2}$', timestr2):
-        raise ValueError(f'unknown time format {timestr2}')
-    datestr = datetime_obj.strftime('%m/%d/%y')
-    timestr = datetime_obj.strftime('%H:%M:%S')
-    lines[6] = lines[6][:67] + datestr + lines[6][75:]
-    lines[7] = lines[7][:67] + timestr + lines[7][75:]
-    # there is another occurrence of the date
-    rex = re.compile('^ {20} *date  [0-9]{2}/[0-9]{2}/[0-9]{2} *$')
-    line_idx = None
-    for i in range(len(lines)):
-        if rex.match(lines[i]):
-            line_idx = i
-            break
-    if line_idx is None:
-        raise IndexError('second date string not found')
-    line = lines[line_idx]
-    start_idx = line.index('date') + len('date  ')
-    line = line[:start_idx] + datestr + line[start_idx+8:]
-    lines[line_idx] = line
-    with open(filename, 'w') as f:
-        f.writelines(lines)
+    if not re.match(fmt, line[67:75]):
+        raise ValueError(f'unknown {label[:4].decode()} format {line[67:75].decode()}')
+    return line[:67] + newstr + line[75:]
+
+
+def _zero_njoy_outfile_duration(line):
+    eol = line[len(line.rstrip(b'\r\n')):]
+    content = line[:len(line)-len(eol)]
+    m = NJOY_OUT_DURATION_REGEX.search(content)
+    if not m:
+        return line
+    content = content[:m.start()].ljust(m.end())
+    return content[:-4] + b'0.0s' + (eol or b'\n')
+
+
+def get_njoy_module_timings(lines):
+    """Return the elapsed seconds of the modules in NJOY output lines.
+
+    NJOY prints the time elapsed since its start at the end of the
+    header line of each module and at the end of the run. A module
+    lasts until the next timer line with a module header or until
+    the last timer line of its run. A drop of the timer marks the
+    start of another run in a composed listing. Return a list of
+    (module, seconds) tuples in the order of the modules.
+    """
+    timings = []
+    current = None
+    last_time = 0.0
+    for line in lines:
+        content = line.rstrip(b'\r\n')
+        m = NJOY_OUT_TIMER_REGEX.search(content)
+        if not m:
+            continue
+        cur_time = float(m.group(1))
+        if cur_time < last_time and current is not None:
+            timings.append((current[0], last_time - current[1]))
+            current = None
+        modm = NJOY_OUT_MODULE_REGEX.match(content)
+        if modm:
+            if current is not None:
+                timings.append((current[0], cur_time - current[1]))
+            current = (modm.group(1).decode(), cur_time)
+        last_time = cur_time
+    if current is not None:
+        timings.append((current[0], last_time - current[1]))
+    return [(name, round(secs, 1)) for name, secs in timings]
+
+
+def normalize_njoy_outfile(filename, datetime_obj=None, zero_durations=True,
+                           module_timings=None):
+    """Set the date and zero the durations in an NJOY output file.
+
+    The file is streamed line by line into a temporary file which
+    replaces the original one so memory usage does not depend on the
+    file size. Listings composed of several NJOY runs are supported,
+    the date is replaced in each of them. If a list is passed as
+    `module_timings`, the module timings found before the durations
+    are zeroed are appended to it (see `get_njoy_module_timings`).
+    Return the sha256 hash of the new content.
+    """
+    if datetime_obj is not None:
+        datestr = datetime_obj.strftime('%m/%d/%y').encode()
+        timestr = datetime_obj.strftime('%H:%M:%S').encode()
+    tmpfile = filename + '.tmp'
+    hasher = hashlib.sha256()
+    num_headers = 0
+    num_second_dates = 0
+    timer_lines = []
+    try:
+        with open(filename, 'rb') as fin, open(tmpfile, 'wb') as fout:
+            for i, line in enumerate(fin):
+                if datetime_obj is not None:
+                    if i == 6 or (i > 7 and line[61:67] == b'date: ' and
+                                  re.match(NJOY_OUT_DATE_FORMAT, line[67:75])):
+                        line = _patch_njoy_outfile_header_line(
+                            line, b'date: ', NJOY_OUT_DATE_FORMAT, datestr
+                        )
+                        num_headers += 1
+                    elif i == 7 or (i > 7 and line[61:67] == b'time: ' and
+                                    re.match(NJOY_OUT_TIME_FORMAT, line[67:75])):
+                        line = _patch_njoy_outfile_header_line(
+                            line, b'time: ', NJOY_OUT_TIME_FORMAT, timestr
+                        )
+                    elif (num_second_dates < max(num_headers, 1) and
+                          NJOY_OUT_DATE_REGEX.match(line.rstrip(b'\r\n'))):
+                        # there is another occurrence of the date
+                        start_idx = line.index(b'date') + len(b'date  ')
+                        line = line[:start_idx] + datestr + line[start_idx+8:]
+                        num_second_dates += 1
+                if module_timings is not None and line.rstrip(b'\r\n').endswith(b's'):
+                    timer_lines.append(line)
+                if zero_durations:
+                    line = _zero_njoy_outfile_duration(line)
+                hasher.update(line)
+                fout.write(line)
+        if datetime_obj is not None and num_second_dates == 0:
+            raise IndexError('second date string not found')
+        os.chmod(tmpfile, os.stat(filename).st_mode & 0o7777)
+        os.replace(tmpfile, filename)
+        if module_timings is not None:
+            module_timings.extend(get_njoy_module_timings(timer_lines))
+    finally:
+        if os.path.exists(tmpfile):
+            os.unlink(tmpfile)
+    return hasher.hexdigest()
+
+
+def set_njoy_outfile_date(filename, datetime_obj):
+    return normalize_njoy_outfile(filename, datetime_obj, zero_durations=False)
 
 
 def zero_njoy_outfile_durations(filename):
-    with open(filename, 'r') as f:
-        lines = f.readlines()
-    rex = re.compile('[0-9]{1,4}\.[0-9]s$')
-    for i in range(len(lines)):
-        line = lines[i]
-        m = rex.search(line)
-        if m:
-            line = line[:m.start()]
-            line = line.ljust(m.end())
-            line = line[:-4] + '0.0s\n'
-            lines[i] = line
-    with open(filename, 'w') as f:
-        f.writelines(lines)
+    return normalize_njoy_outfile(filename, None, zero_durations=True)
 
 
 def get_acefile_date(filename):
@@ -292,14 +449,15 @@ def get_acefile_date(filename):
 
 
 def set_acefile_date(filename, datetime_obj):
-    with open(filename, 'rb') as f:
-        data = f.read()
-    old_datestr = data[37:45]
-    if not re.match(b'^[0-9]{2}/[0-9]{2}/[0-9]{2}$', old_datestr):
-        raise ValueError(f'unknown date format {datestr}')
+    """Overwrite the date in the header of an ACE file in place."""
     datestr = datetime_obj.strftime('%m/%d/%y').encode()
-    if len(old_datestr) != len(datestr):
-        raise ValueError('old and new date of different length')
-    new_data = data[:37] + datestr + data[45:]
-    with open(filename, 'wb') as f:
-        f.write(new_data)
+    fd = os.open(filename, os.O_RDWR)
+    try:
+        old_datestr = os.pread(fd, 8, 37)
+        if not re.match(b'^[0-9]{2}/[0-9]{2}/[0-9]{2}$', old_datestr):
+            raise ValueError(f'unknown date format {old_datestr}')
+        if len(old_datestr) != len(datestr):
+            raise ValueError('old and new date of different length')
+        os.pwrite(fd, datestr, 37)
+    finally:
+        os.close(fd)
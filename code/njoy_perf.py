@@ -0,0 +1,203 @@
+############################################################
+#
+# Database of the elapsed times of the NJOY modules. The
+# times are taken from the NJOY output listings before
+# the durations in them are zeroed and stored together
+# with the NJOY version and the hash of the NJOY binary.
+# A report compares the times of two NJOY builds and
+# flags modules and materials whose runtime changed more
+# than a threshold.
+#
+# The path of the database is taken from the environment
+# variable FENDL_NJOY_PERF_DB (default .cache/njoy_perf.sqlite),
+# an empty value disables the recording.
+#
+# Usage:
+#     python njoy_perf.py builds
+#     python njoy_perf.py report <build_a> <build_b>
+#                                [<threshold>] [<min_seconds>]
+#
+#     A build is given by the NJOY version or a prefix of
+#     the hash of the NJOY binary. Changes are flagged if
+#     the relative change exceeds <threshold> (default: 0.2)
+#     and the absolute change exceeds <min_seconds> (default: 1).
+#
+############################################################
+
+import os
+import sys
+import time
+import sqlite3
+
+
+NJOY_PERF_DB_ENV = 'FENDL_NJOY_PERF_DB'
+DEFAULT_NJOY_PERF_DB = os.path.join('.cache', 'njoy_perf.sqlite')
+DEFAULT_REGRESSION_THRESHOLD = 0.2
+DEFAULT_REGRESSION_MIN_SECONDS = 1.0
+
+
+def get_njoy_perf_db_path():
+    """Return the path of the performance database or None if disabled."""
+    path = os.environ.get(NJOY_PERF_DB_ENV, DEFAULT_NJOY_PERF_DB)
+    return path if path else None
+
+
+def open_njoy_perf_db(path=None):
+    if path is None:
+        path = get_njoy_perf_db_path()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=60)
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS module_timings ('
+        'njoy_version TEXT, njoy_hash TEXT, material TEXT, '
+        'seq INTEGER, module TEXT, seconds REAL, recorded REAL)'
+    )
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS module_timings_build '
+        'ON module_timings (njoy_version, njoy_hash)'
+    )
+    conn.commit()
+    return conn
+
+
+def store_njoy_module_timings(material, njoy_version, njoy_hash, timings):
+    """Store the (module, seconds) timings of an NJOY run of a material."""
+    if not timings or get_njoy_perf_db_path() is None:
+        return
+    now = time.time()
+    conn = open_njoy_perf_db()
+    try:
+        with conn:
+            conn.executemany(
+                'INSERT INTO module_timings (njoy_version, njoy_hash, material, '
+                'seq, module, seconds, recorded) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(njoy_version, njoy_hash, material, seq, module, seconds, now)
+                 for seq, (module, seconds) in enumerate(timings)]
+            )
+    finally:
+        conn.close()
+
+
+def get_njoy_builds(conn):
+    """Return (version, hash, number of materials, last record) of the builds."""
+    return conn.execute(
+        'SELECT njoy_version, njoy_hash, COUNT(DISTINCT material), MAX(recorded) '
+        'FROM module_timings GROUP BY njoy_version, njoy_hash ORDER BY MAX(recorded)'
+    ).fetchall()
+
+
+def _resolve_build(conn, build):
+    matches = [
+        (version, njoy_hash) for version, njoy_hash, _, _ in get_njoy_builds(conn)
+        if version == build or njoy_hash.startswith(build)
+    ]
+    if not matches:
+        raise ValueError(f'no timings recorded for NJOY build {build}')
+    if len(matches) > 1:
+        raise ValueError(f'NJOY build {build} is ambiguous, use a hash prefix')
+    return matches[0]
+
+
+def get_build_timings(conn, build):
+    """Return the mean seconds per (material, module) of a build.
+
+    The times of repeated modules in a run, e.g. moder, are summed.
+    """
+    version, njoy_hash = _resolve_build(conn, build)
+    rows = conn.execute(
+        'SELECT material, module, SUM(seconds), COUNT(DISTINCT recorded) '
+        'FROM module_timings WHERE njoy_version = ? AND njoy_hash = ? '
+        'GROUP BY material, module', (version, njoy_hash)
+    ).fetchall()
+    return {(material, module): total / nruns
+            for material, module, total, nruns in rows}
+
+
+def _is_regression(old, new, threshold, min_seconds):
+    diff = new - old
+    if abs(diff) < min_seconds:
+        return False
+    return old == 0 or abs(diff) / old > threshold
+
+
+def compare_njoy_builds(conn, build_a, build_b,
+                        threshold=DEFAULT_REGRESSION_THRESHOLD,
+                        min_seconds=DEFAULT_REGRESSION_MIN_SECONDS):
+    """Return the modules and materials whose runtime changed between builds.
+
+    Only materials processed by both builds are compared.
+    """
+    timings_a = get_build_timings(conn, build_a)
+    timings_b = get_build_timings(conn, build_b)
+    common = sorted(set(timings_a).intersection(timings_b))
+    module_totals = {}
+    material_totals = {}
+    changes = []
+    for material, module in common:
+        old = timings_a[(material, module)]
+        new = timings_b[(material, module)]
+        for totals, key in ((module_totals, module), (material_totals, material)):
+            tot = totals.setdefault(key, [0.0, 0.0])
+            tot[0] += old
+            tot[1] += new
+        if _is_regression(old, new, threshold, min_seconds):
+            changes.append({'material': material, 'module': module,
+                            'old': old, 'new': new})
+
+    def flagged(totals, label):
+        return [
+            {label: key, 'old': old, 'new': new}
+            for key, (old, new) in sorted(totals.items())
+            if _is_regression(old, new, threshold, min_seconds)
+        ]
+
+    return {
+        'build_a': build_a,
+        'build_b': build_b,
+        'num_compared': len(common),
+        'modules': flagged(module_totals, 'module'),
+        'materials': flagged(material_totals, 'material'),
+        'material_modules': changes,
+    }
+
+
+def _format_change(entry):
+    old, new = entry['old'], entry['new']
+    rel = f'{(new - old) / old:+.0%}' if old > 0 else 'new'
+    return f'{old:10.1f}s -> {new:10.1f}s  ({rel})'
+
+
+def print_njoy_perf_report(report):
+    print(f'--- NJOY timings {report["build_a"]} -> {report["build_b"]} '
+          f'({report["num_compared"]} module runs compared) ---')
+    print('modules:')
+    for entry in report['modules']:
+        print(f'  {entry["module"]:<10} {_format_change(entry)}')
+    print('materials:')
+    for entry in report['materials']:
+        print(f'  {entry["material"]:<24} {_format_change(entry)}')
+    print('modules of materials:')
+    for entry in report['material_modules']:
+        label = f'{entry["material"]} {entry["module"]}'
+        print(f'  {label:<32} {_format_change(entry)}')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ('builds', 'report'):
+        print('usage: python njoy_perf.py builds')
+        print('       python njoy_perf.py report <build_a> <build_b> '
+              '[<threshold>] [<min_seconds>]')
+        sys.exit(2)
+    conn = open_njoy_perf_db()
+    if sys.argv[1] == 'builds':
+        for version, njoy_hash, nmat, recorded in get_njoy_builds(conn):
+            datestr = time.strftime('%Y-%m-%d %H:%M', time.localtime(recorded))
+            print(f'{version:<16} {njoy_hash[:12]}  {nmat:>5} materials  {datestr}')
+    else:
+        threshold = float(sys.argv[4]) if len(sys.argv) > 4 else DEFAULT_REGRESSION_THRESHOLD
+        min_seconds = float(sys.argv[5]) if len(sys.argv) > 5 else DEFAULT_REGRESSION_MIN_SECONDS
+        report = compare_njoy_builds(conn, sys.argv[2], sys.argv[3],
+                                     threshold, min_seconds)
+        print_njoy_perf_report(report)
+        if report['modules'] or report['materials'] or report['material_modules']:
+            sys.exit(1)
@@ -0,0 +1,212 @@
+############################################################
+#
+# Supervision of NJOY runs. The output of NJOY is streamed
+# and the run is killed as soon as a fatal `***error`
+# message appears, if neither the output nor the tapes in
+# the working directory grew for a stall timeout or if the
+# time limit of the material is exceeded. The time limit
+# is a multiple of the predicted runtime of the material
+# (see cost_model.py) and shared by all NJOY runs of it.
+# Runs are also killed if their task is aborted, e.g. when
+# the lease of a work queue item has been lost.
+#
+# The environment variable FENDL_NJOY_TIMEOUT_FACTOR
+# (default 5) sets the multiple of the predicted runtime,
+# the time limit is at least NJOY_MIN_TIMEOUT seconds.
+# FENDL_NJOY_STALL_TIMEOUT sets the stall timeout in
+# seconds (default 1800). Empty values or 0 disable the
+# respective check.
+#
+############################################################
+
+import os
+import sys
+import time
+import signal
+import threading
+import subprocess
+import collections
+
+from stage_timing import timed_stage, record_child_usage
+
+
+NJOY_TIMEOUT_FACTOR_ENV = 'FENDL_NJOY_TIMEOUT_FACTOR'
+DEFAULT_NJOY_TIMEOUT_FACTOR = 5.0
+NJOY_MIN_TIMEOUT = 1800.0
+NJOY_STALL_TIMEOUT_ENV = 'FENDL_NJOY_STALL_TIMEOUT'
+DEFAULT_NJOY_STALL_TIMEOUT = 1800.0
+NJOY_ERROR_MARKER = '***error'
+# interval of the checks for stalls, timeouts and aborts in seconds
+SUPERVISE_INTERVAL = 1.0
+# number of output lines included in error messages
+NJOY_TAIL_LINES = 20
+
+_njoy_deadline = threading.local()
+_njoy_abort = threading.local()
+
+
+def _get_env_seconds(name, default):
+    value = os.environ.get(name, str(default))
+    value = float(value) if value else 0.0
+    return value if value > 0 else None
+
+
+def get_njoy_timeout(predicted_runtime):
+    """Return the time limit for a material or None if disabled."""
+    factor = _get_env_seconds(NJOY_TIMEOUT_FACTOR_ENV, DEFAULT_NJOY_TIMEOUT_FACTOR)
+    if factor is None:
+        return None
+    return max(factor * predicted_runtime, NJOY_MIN_TIMEOUT)
+
+
+def get_njoy_stall_timeout():
+    return _get_env_seconds(NJOY_STALL_TIMEOUT_ENV, DEFAULT_NJOY_STALL_TIMEOUT)
+
+
+def set_njoy_time_limit(seconds):
+    """Limit the total runtime of the following NJOY runs of this thread."""
+    _njoy_deadline.value = None if seconds is None else time.monotonic() + seconds
+
+
+def get_remaining_njoy_time():
+    """Return the seconds left of the time limit or None if unlimited."""
+    deadline = getattr(_njoy_deadline, 'value', None)
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0.0)
+
+
+def set_njoy_abort_event(event):
+    """Kill the following NJOY runs of this thread once `event` is set."""
+    _njoy_abort.event = event
+
+
+def _get_dir_size(path):
+    size = 0
+    for entry in os.scandir(path):
+        try:
+            size += entry.stat(follow_symlinks=False).st_size
+        except FileNotFoundError:
+            pass
+    return size
+
+
+def _kill_process_group(proc):
+    # NJOY runs in its own session, so children holding the output
+    # pipe open are killed as well
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def _read_output(stream, tail, progress, error_seen, wakeup):
+    for line in stream:
+        sys.stdout.write(line)
+        tail.append(line)
+        progress['lines'] += 1
+        if NJOY_ERROR_MARKER in line:
+            error_seen.set()
+            wakeup.set()
+    sys.stdout.flush()
+
+
+def _wait_for_exit(pid, exited, wakeup):
+    # WNOWAIT leaves the process unreaped, so its pid and process
+    # group cannot be reused before the supervisor collects it
+    try:
+        os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+    except ChildProcessError:
+        pass
+    exited.set()
+    wakeup.set()
+
+
+def run_njoy_supervised(args, stdin, cwd, timeout=None, stall_timeout=None):
+    """Run NJOY with streamed output and kill it if it fails or hangs.
+
+    The run is killed if a fatal error is printed, if the output and
+    the files in `cwd` do not change for `stall_timeout` seconds or if
+    it takes longer than `timeout` seconds. CalledProcessError is raised
+    for errors, TimeoutExpired for timeouts and RuntimeError for stalls
+    and if the abort event of the thread (see `set_njoy_abort_event`)
+    is set.
+    The resource usage is available as `rusage` attribute of the
+    returned CompletedProcess.
+    """
+    with timed_stage(os.path.basename(args[0])):
+        proc = subprocess.Popen(
+            args, stdin=stdin, cwd=cwd, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, text=True, errors='replace',
+            start_new_session=True
+        )
+        tail = collections.deque(maxlen=NJOY_TAIL_LINES)
+        progress = {'lines': 0}
+        error_seen = threading.Event()
+        exited = threading.Event()
+        wakeup = threading.Event()
+        reader = threading.Thread(
+            target=_read_output,
+            args=(proc.stdout, tail, progress, error_seen, wakeup)
+        )
+        reader.start()
+        waiter = threading.Thread(
+            target=_wait_for_exit, args=(proc.pid, exited, wakeup), daemon=True
+        )
+        waiter.start()
+        abort = getattr(_njoy_abort, 'event', None)
+        start = last_progress = time.monotonic()
+        last_state = None
+        reason = None
+        try:
+            while True:
+                wakeup.clear()
+                if exited.is_set():
+                    _, status, rusage = os.wait4(proc.pid, 0)
+                    break
+                now = time.monotonic()
+                cur_state = (progress['lines'], _get_dir_size(cwd))
+                if cur_state != last_state:
+                    last_state = cur_state
+                    last_progress = now
+                if error_seen.is_set():
+                    reason = 'error'
+                elif timeout is not None and now - start > timeout:
+                    reason = 'timeout'
+                elif stall_timeout is not None and now - last_progress > stall_timeout:
+                    reason = 'stall'
+                elif abort is not None and abort.is_set():
+                    reason = 'abort'
+                if reason is not None:
+                    _kill_process_group(proc)
+                    _, status, rusage = os.wait4(proc.pid, 0)
+                    break
+                # woken up early by the exit of NJOY or an error message
+                wakeup.wait(SUPERVISE_INTERVAL)
+        except BaseException:
+            _kill_process_group(proc)
+            proc.wait()
+            raise
+        finally:
+            reader.join()
+            waiter.join()
+            proc.stdout.close()
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        record_child_usage(rusage)
+    if reason is None and error_seen.is_set():
+        reason = 'error'
+    output = ''.join(tail)
+    if reason == 'error':
+        raise subprocess.CalledProcessError(proc.returncode, args, output=output)
+    if reason == 'timeout':
+        raise subprocess.TimeoutExpired(args, timeout, output=output)
+    if reason == 'abort':
+        raise RuntimeError('NJOY killed because its task was aborted')
+    if reason == 'stall':
+        raise RuntimeError(
+            f'NJOY killed after no output or tape growth for '
+            f'{stall_timeout:.0f} seconds, last output:\n{output}'
+        )
+    completed = subprocess.CompletedProcess(args, proc.returncode, stdout=output)
+    completed.rusage = rusage
+    return completed
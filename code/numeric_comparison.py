@@ -0,0 +1,58 @@
+import os
+import subprocess
+import numpy as np
+
+
+def compare_arrays(arr1, arr2, rtol, atol):
+    """Compare two arrays elementwise with tolerances.
+
+    As in numdiff, two values are considered different only if both
+    the absolute difference exceeds `atol` and the relative difference
+    exceeds `rtol`. Return a dictionary with the maximal deviations
+    and the number of differing values.
+    """
+    arr1 = np.asarray(arr1, dtype=np.float64)
+    arr2 = np.asarray(arr2, dtype=np.float64)
+    if arr1.shape != arr2.shape:
+        return {
+            'equal': False,
+            'shape_mismatch': True,
+            'shape1': list(arr1.shape),
+            'shape2': list(arr2.shape),
+        }
+    absdiff = np.abs(arr1 - arr2)
+    scale = np.maximum(np.abs(arr1), np.abs(arr2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        reldiff = np.where(scale > 0, absdiff / scale, 0.)
+    differs = (absdiff > atol) & (reldiff > rtol)
+    numdiff = int(np.count_nonzero(differs))
+    result = {
+        'equal': numdiff == 0,
+        'shape_mismatch': False,
+        'num_differences': numdiff,
+        'max_abs_diff': float(absdiff.max()) if absdiff.size > 0 else 0.,
+        'max_rel_diff': float(reldiff.max()) if reldiff.size > 0 else 0.,
+    }
+    if numdiff > 0:
+        result['first_difference'] = int(np.argmax(differs.reshape(-1)))
+    return result
+
+
+def get_annex_path_at_commit(commit, fpath):
+    """Return the path to the content of a git-annex file at a commit.
+
+    `fpath` is the path of the file in the working tree relative to
+    the current directory. The content must be present in the local annex.
+    """
+    ret = subprocess.run(['git', 'show', f'{commit}:./{fpath}'],
+                         capture_output=True, text=True)
+    ret.check_returncode()
+    target = ret.stdout.strip()
+    if target.startswith('/annex/objects/'):
+        # pointer file of an unlocked file
+        key = os.path.basename(target)
+        ret = subprocess.run(['git', 'annex', 'contentlocation', key],
+                             capture_output=True, text=True)
+        ret.check_returncode()
+        return ret.stdout.strip()
+    return os.path.join(os.path.dirname(fpath), target)
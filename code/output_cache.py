@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import fcntl
+from contextlib import contextmanager
+
+
+OUTPUT_CACHE_ENV = 'FENDL_OUTPUT_CACHE'
+OUTPUT_CACHE_SIZE_ENV = 'FENDL_OUTPUT_CACHE_SIZE'
+DEFAULT_OUTPUT_CACHE = os.path.join('.cache', 'outputs')
+DEFAULT_OUTPUT_CACHE_SIZE = 20 * 1024**3
+
+# ioctl request code to clone a file on copy-on-write filesystems
+FICLONE = 0x40049409
+
+
+def get_output_cache_dir():
+    """Return the directory of the output cache or None if disabled.
+
+    The directory can be changed by the environment variable
+    FENDL_OUTPUT_CACHE, an empty value disables the cache.
+    """
+    path = os.environ.get(OUTPUT_CACHE_ENV, DEFAULT_OUTPUT_CACHE)
+    return path if path else None
+
+
+def get_output_cache_size():
+    """Return the maximal size of the output cache in bytes."""
+    size = os.environ.get(OUTPUT_CACHE_SIZE_ENV, None)
+    return int(size) if size else DEFAULT_OUTPUT_CACHE_SIZE
+
+
+def reflink_file(src, dst):
+    """Create a copy-on-write clone of a file; raise OSError if unsupported."""
+    with open(src, 'rb') as fsrc:
+        with open(dst, 'wb') as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            except OSError:
+                fdst.close()
+                os.unlink(dst)
+                raise
+
+
+def link_or_copy_file(src, dst):
+    """Place the content of `src` at `dst` without copying if possible.
+
+    A reflink is tried first, then a hardlink and finally
+    a regular copy of the file.
+    """
+    try:
+        reflink_file(src, dst)
+        return 'reflink'
+    except OSError:
+        pass
+    try:
+        os.link(src, dst)
+        return 'hardlink'
+    except OSError:
+        pass
+    shutil.copyfile(src, dst)
+    return 'copy'
+
+
+def get_output_cache_key(input_hashes, outputs, options=None):
+    """Return the cache key for the hashes of the input files.
+
+    The basenames of the output files are included as well
+    because some outputs, e.g. the xsd file, contain them.
+    Processing options affecting the outputs can be
+    provided as dictionary in `options`.
+    """
+    keydata = {
+        'inputs': input_hashes,
+        'outputs': {k: os.path.basename(f) for k, f in outputs.items()},
+        'options': options if options is not None else {},
+    }
+    keystr = json.dumps(keydata, sort_keys=True)
+    return hashlib.sha256(keystr.encode()).hexdigest()
+
+
+def _get_index_connection(cachedir):
+    os.makedirs(cachedir, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(cachedir, 'index.sqlite'), timeout=60)
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS entries ('
+        'key TEXT PRIMARY KEY, size INTEGER, last_used REAL)'
+    )
+    return conn
+
+
+def _get_entry_dir(cachedir, key):
+    return os.path.join(cachedir, key[:2], key)
+
+
+def _get_pin_file(cachedir, key):
+    return _get_entry_dir(cachedir, key) + '.pin'
+
+
+def open_locked_file(path, operation):
+    """Open and lock a lock file with flock, return the descriptor.
+
+    The lock is released by closing the descriptor. A lock file may
+    only be removed by the holder of an exclusive lock, so the lock is
+    retried if the locked file is no longer the current one.
+    BlockingIOError is raised if `operation` is non-blocking and the
+    file is locked by another process.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, operation)
+            if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                return fd
+        except FileNotFoundError:
+            pass
+        except BaseException:
+            os.close(fd)
+            raise
+        os.close(fd)
+
+
+@contextmanager
+def pinned_cache_entry(key, cachedir=None):
+    """Protect a cache entry from eviction while the context is active.
+
+    The entry does not have to exist yet, so it can be pinned before
+    it is looked up or stored. The pin is a shared lock which is
+    released by the operating system if the process dies.
+    """
+    if cachedir is None:
+        cachedir = get_output_cache_dir()
+    if cachedir is None:
+        yield
+        return
+    fd = open_locked_file(_get_pin_file(cachedir, key), fcntl.LOCK_SH)
+    try:
+        yield
+    finally:
+        os.close(fd)
+
+
+def restore_cached_outputs(key, outputs, cachedir=None):
+    """Restore the output files from the cache.
+
+    Return a dictionary with the hashes of the outputs
+    or None if no cache entry is available. Another cache
+    than the output cache can be selected by `cachedir`.
+    The entry should be pinned (see `pinned_cache_entry`).
+    If restoring fails, the outputs restored so far are removed.
+    """
+    if cachedir is None:
+        cachedir = get_output_cache_dir()
+    if cachedir is None:
+        return None
+    entrydir = _get_entry_dir(cachedir, key)
+    metafile = os.path.join(entrydir, 'meta.json')
+    if not os.path.isfile(metafile):
+        return None
+    with open(metafile, 'r') as f:
+        meta = json.load(f)
+    if set(meta['hashes']) != set(outputs):
+        return None
+    restored = []
+    try:
+        for k, curpath in outputs.items():
+            os.makedirs(os.path.dirname(curpath), exist_ok=True)
+            link_or_copy_file(os.path.join(entrydir, k), curpath)
+            restored.append(curpath)
+    except BaseException:
+        for curpath in restored:
+            os.unlink(curpath)
+        raise
+    with _get_index_connection(cachedir) as conn:
+        conn.execute(
+            'UPDATE entries SET last_used = ? WHERE key = ?',
+            (time.time(), key)
+        )
+    conn.close()
+    return meta['hashes']
+
+
+def get_cached_entry_files(key, cachedir=None):
+    """Return the paths of the files of a cache entry or None.
+
+    The files must not be modified by the caller.
+    """
+    if cachedir is None:
+        cachedir = get_output_cache_dir()
+    if cachedir is None:
+        return None
+    entrydir = _get_entry_dir(cachedir, key)
+    metafile = os.path.join(entrydir, 'meta.json')
+    if not os.path.isfile(metafile):
+        return None
+    with open(metafile, 'r') as f:
+        meta = json.load(f)
+    with _get_index_connection(cachedir) as conn:
+        conn.execute(
+            'UPDATE entries SET last_used = ? WHERE key = ?',
+            (time.time(), key)
+        )
+    conn.close()
+    return {k: os.path.join(entrydir, k) for k in meta['hashes']}
+
+
+def store_outputs_in_cache(key, outputs, output_hashes, cachedir=None, max_size=None):
+    """Store the output files in the cache and evict old entries."""
+    if cachedir is None:
+        cachedir = get_output_cache_dir()
+        max_size = get_output_cache_size()
+    if cachedir is None:
+        return
+    entrydir = _get_entry_dir(cachedir, key)
+    if os.path.isdir(entrydir):
+        return
+    os.makedirs(os.path.dirname(entrydir), exist_ok=True)
+    tmpdir = entrydir + f'.tmp-{os.getpid()}'
+    os.makedirs(tmpdir)
+    size = 0
+    for k, curpath in outputs.items():
+        dst = os.path.join(tmpdir, k)
+        shutil.copyfile(curpath, dst)
+        # cached files may be hardlinked into the working tree
+        os.chmod(dst, 0o444)
+        size += os.path.getsize(dst)
+    with open(os.path.join(tmpdir, 'meta.json'), 'w') as f:
+        json.dump({'hashes': output_hashes}, f, indent=4)
+    try:
+        os.rename(tmpdir, entrydir)
+    except OSError:
+        # another process stored the same entry in the meantime
+        shutil.rmtree(tmpdir)
+        return
+    with _get_index_connection(cachedir) as conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO entries (key, size, last_used) '
+            'VALUES (?, ?, ?)', (key, size, time.time())
+        )
+    conn.close()
+    if max_size is not None:
+        evict_output_cache_entries(max_size, cachedir)
+
+
+def evict_output_cache_entries(max_size, cachedir=None):
+    """Remove least recently used entries until the cache fits `max_size`.
+
+    Pinned entries (see `pinned_cache_entry`) are kept, so the cache
+    can exceed `max_size` until they are released.
+    """
+    if cachedir is None:
+        cachedir = get_output_cache_dir()
+    if cachedir is None:
+        return []
+    evicted = []
+    locks = []
+    try:
+        with _get_index_connection(cachedir) as conn:
+            rows = conn.execute(
+                'SELECT key, size FROM entries ORDER BY last_used DESC'
+            ).fetchall()
+            total_size = 0
+            for key, size in rows:
+                total_size += size
+                if total_size <= max_size:
+                    continue
+                try:
+                    locks.append(open_locked_file(
+                        _get_pin_file(cachedir, key), fcntl.LOCK_EX | fcntl.LOCK_NB
+                    ))
+                except BlockingIOError:
+                    continue
+                evicted.append(key)
+            conn.executemany(
+                'DELETE FROM entries WHERE key = ?', [(k,) for k in evicted]
+            )
+        conn.close()
+        for key in evicted:
+            shutil.rmtree(_get_entry_dir(cachedir, key), ignore_errors=True)
+            os.unlink(_get_pin_file(cachedir, key))
+    finally:
+        for fd in locks:
+            os.close(fd)
+    return evicted
@@ -1,9 +1,15 @@
 import re
+import zlib
 import hashlib
-import subprocess
 import tempfile
 import os
 
+from stage_timing import timed_stage, run_child_process
+
+
+PDF_ENGINE_ENV = 'FENDL_PDF_ENGINE'
+PDF_ENGINES = ('toolchain', 'inprocess')
+
 
 def insert_pdf_trailer_ids(data, id1, id2):
     assert isinstance(id1, str)
@@ -18,17 +24,17 @@ def insert_pdf_trailer_ids(data, id1, id2):
     except:
         raise TypeError('ids must be hexadecimal strings')
     new_idstr = b'/ID [<' + id1 + b'><' + id2 + b'>]'
-    myiter = re.finditer(b'/ID \[(<[0-9a-z]{32}>){2}\]', data)
+    myiter = re.finditer(rb'/ID \[(<[0-9A-Fa-f]{32}>){2}\]', data)
     last_end = 0
-    new_data = b''
+    chunks = []
     for m in myiter:
         cur_start = m.start()
         cur_end = m.end()
-        new_data += data[last_end:cur_start]
-        new_data += new_idstr
+        chunks.append(data[last_end:cur_start])
+        chunks.append(new_idstr)
         last_end = cur_end
-    new_data += data[last_end:]
-    return new_data
+    chunks.append(data[last_end:])
+    return b''.join(chunks)
 
 
 def zero_pdf_trailer_ids(data):
@@ -56,7 +62,7 @@ def remove_pdf_documentid(data):
         fpath = os.path.join(tmpdir, 'tempfile')
         with open(fpath, 'wb') as f:
             f.write(data)
-        p = subprocess.run(['exiftool', '-DocumentID=', '-overwrite_original', fpath])
+        p = run_child_process(['exiftool', '-DocumentID=', '-overwrite_original', fpath])
         with open(fpath, 'rb') as f:
             new_data = f.read()
     if p.returncode != 0:
@@ -69,8 +75,8 @@ def _set_pdf_dates(data, datestr):
         fpath = os.path.join(tmpdir, 'tempfile')
         with open(fpath, 'wb') as f:
             f.write(data)
-        p1 = subprocess.run(['exiftool', f'-ModifyDate={datestr}', '-overwrite_original', fpath])
-        p2 = subprocess.run(['exiftool', f'-CreateDate={datestr}', '-overwrite_original', fpath])
+        p1 = run_child_process(['exiftool', f'-ModifyDate={datestr}', '-overwrite_original', fpath])
+        p2 = run_child_process(['exiftool', f'-CreateDate={datestr}', '-overwrite_original', fpath])
         with open(fpath, 'rb') as f:
             new_data = f.read()
     if p1.returncode != 0 or p2.returncode != 0:
@@ -93,7 +99,7 @@ def linearize_pdf(data):
         fout_path = os.path.join(tmpdir, 'output')
         with open(fin_path, 'wb') as fin:
             fin.write(data)
-        p = subprocess.run(['qpdf', '--linearize', fin_path, fout_path]) 
+        p = run_child_process(['qpdf', '--linearize', fin_path, fout_path]) 
         if p.returncode != 0:
             raise OSError('unable to run/apply qpdf command-line tool')
         with open(fout_path, 'rb') as fout:
@@ -101,7 +107,172 @@ def linearize_pdf(data):
     return new_data
 
 
-def remove_volatile_pdf_metadata(data, datetime_obj=None):
+def get_pdf_engine():
+    """Return the engine used for the normalization of PDF files.
+
+    The engine is selected by the environment variable FENDL_PDF_ENGINE,
+    `toolchain` (default) uses exiftool and qpdf and `inprocess`
+    patches the PDF in memory. The engines produce files with the same
+    content but not the same bytes: the in-process engine neither
+    linearizes the file nor rewrites the XMP packet like exiftool, so
+    the committed PDF files must be produced with the toolchain.
+    """
+    engine = os.environ.get(PDF_ENGINE_ENV, 'toolchain')
+    if engine not in PDF_ENGINES:
+        raise ValueError(f'unknown PDF engine `{engine}`')
+    return engine
+
+
+def _get_pdf_xref_table(data):
+    m = re.search(rb'startxref\s+([0-9]+)\s+%%EOF\s*$', data)
+    if not m:
+        raise ValueError('startxref not found')
+    xref_start = int(m.group(1))
+    if data[xref_start:xref_start+4] != b'xref':
+        raise ValueError('only PDF files with a classic xref table are supported')
+    if data.count(b'startxref') != 1:
+        raise ValueError('PDF files with incremental updates are not supported')
+    trailer_start = data.index(b'trailer', xref_start)
+    return xref_start, trailer_start
+
+
+def _parse_pdf_xref_entries(xref_data):
+    entries = []
+    lines = xref_data.split(b'\n')[1:]
+    objnum = 0
+    for line in lines:
+        fields = line.split()
+        if len(fields) == 2:
+            objnum = int(fields[0])
+        elif len(fields) == 3:
+            entries.append((objnum, int(fields[0]), int(fields[1]), fields[2]))
+            objnum += 1
+    return entries
+
+
+def _format_pdf_xref_table(entries):
+    chunks = [b'xref\n']
+    i = 0
+    while i < len(entries):
+        j = i
+        while j+1 < len(entries) and entries[j+1][0] == entries[j][0] + 1:
+            j += 1
+        chunks.append(b'%d %d\n' % (entries[i][0], j-i+1))
+        for objnum, offset, gen, flag in entries[i:j+1]:
+            chunks.append(b'%010d %05d %s \n' % (offset, gen, flag))
+        i = j+1
+    return b''.join(chunks)
+
+
+def _format_pdf_date(datetime_obj):
+    return datetime_obj.strftime('D:%Y%m%d%H%M%S').encode()
+
+
+def _format_xmp_date(datetime_obj):
+    return datetime_obj.strftime('%Y-%m-%dT%H:%M:%S').encode()
+
+
+def _patch_info_dates(obj, datetime_obj):
+    rex = re.compile(rb'/(CreationDate|ModDate)\s*\([^)]*\)')
+    if datetime_obj is None:
+        return rex.sub(b'', obj)
+    datestr = _format_pdf_date(datetime_obj)
+    return rex.sub(lambda m: b'/' + m.group(1) + b'(' + datestr + b')', obj)
+
+
+def _patch_xmp_packet(xmp, datetime_obj):
+    datefields = rb'(xmp|xap):(CreateDate|ModifyDate|MetadataDate)'
+    idfields = rb'(xmpMM|xapMM):(DocumentID|InstanceID)'
+    elem_dates = re.compile(b'<' + datefields + rb'>[^<]*</\1:\2>')
+    attr_dates = re.compile(rb'\s' + datefields + rb"""=(["'])[^"']*\3""")
+    elem_ids = re.compile(b'<' + idfields + rb'>[^<]*</\1:\2>')
+    attr_ids = re.compile(rb'\s' + idfields + rb"""=(["'])[^"']*\3""")
+    about_uuid = re.compile(rb"""rdf:about=(["'])uuid:[^"']*\1""")
+    xmp = elem_ids.sub(b'', xmp)
+    xmp = attr_ids.sub(b'', xmp)
+    xmp = about_uuid.sub(rb'rdf:about=\1\1', xmp)
+    if datetime_obj is None:
+        xmp = elem_dates.sub(b'', xmp)
+        xmp = attr_dates.sub(b'', xmp)
+    else:
+        datestr = _format_xmp_date(datetime_obj)
+        xmp = elem_dates.sub(
+            lambda m: b'<%s:%s>%s</%s:%s>' % (m.group(1), m.group(2), datestr,
+                                              m.group(1), m.group(2)), xmp)
+        xmp = attr_dates.sub(
+            lambda m: b' %s:%s=%s%s%s' % (m.group(1), m.group(2), m.group(3),
+                                          datestr, m.group(3)), xmp)
+    return xmp
+
+
+def _patch_metadata_stream(obj, datetime_obj):
+    m = re.search(rb'stream\r?\n', obj)
+    if not m:
+        raise ValueError('metadata object without stream')
+    length_match = re.search(rb'/Length\s+([0-9]+)(?!\s+[0-9]+\s+R)', obj[:m.start()])
+    if not length_match:
+        raise ValueError('metadata stream without direct /Length')
+    length = int(length_match.group(1))
+    dict_part = obj[:m.start()]
+    stream_start = m.end()
+    stream = obj[stream_start:stream_start+length]
+    tail = obj[stream_start+length:]
+    compressed = b'/FlateDecode' in dict_part
+    if compressed:
+        stream = zlib.decompress(stream)
+    stream = _patch_xmp_packet(stream, datetime_obj)
+    if compressed:
+        stream = zlib.compress(stream, 9)
+    dict_part = (dict_part[:length_match.start(1)] + b'%d' % len(stream) +
+                 dict_part[length_match.end(1):])
+    return dict_part + obj[m.start():stream_start] + stream + tail
+
+
+def normalize_pdf_inprocess(data, datetime_obj=None):
+    """Remove volatile metadata of a PDF file in a single pass.
+
+    The dates in the document information dictionary and the XMP
+    metadata are set to `datetime_obj` (or removed if None), the
+    DocumentID is removed, object offsets in the cross-reference table
+    are updated and the trailer IDs are derived from the content.
+    Only PDF files with a single classic cross-reference table, as
+    produced by ps2pdf, are supported, otherwise ValueError is raised.
+    """
+    xref_start, trailer_start = _get_pdf_xref_table(data)
+    entries = _parse_pdf_xref_entries(data[xref_start:trailer_start])
+    trailer = data[trailer_start:data.rindex(b'startxref')]
+    m = re.search(rb'/Info\s+([0-9]+)\s+[0-9]+\s+R', trailer)
+    info_objnum = int(m.group(1)) if m else None
+    used = sorted((e for e in entries if e[3] == b'n'), key=lambda e: e[1])
+    if not used:
+        raise ValueError('no objects found in PDF file')
+    bounds = [e[1] for e in used] + [xref_start]
+    chunks = [data[:bounds[0]]]
+    pos = bounds[0]
+    new_offsets = {}
+    for i, entry in enumerate(used):
+        objnum = entry[0]
+        obj = data[bounds[i]:bounds[i+1]]
+        if objnum == info_objnum:
+            obj = _patch_info_dates(obj, datetime_obj)
+        elif re.search(rb'/Type\s*/Metadata', obj[:obj.find(b'stream')]):
+            obj = _patch_metadata_stream(obj, datetime_obj)
+        new_offsets[objnum] = pos
+        chunks.append(obj)
+        pos += len(obj)
+    new_entries = [
+        (e[0], new_offsets[e[0]] if e[3] == b'n' else e[1], e[2], e[3])
+        for e in entries
+    ]
+    chunks.append(_format_pdf_xref_table(new_entries))
+    chunks.append(trailer)
+    chunks.append(b'startxref\n%d\n%%%%EOF\n' % pos)
+    new_data = b''.join(chunks)
+    new_data = normalize_pdf_trailer_ids(new_data)
+    return new_data
+
+
+def remove_volatile_pdf_metadata_toolchain(data, datetime_obj=None):
     new_data = remove_pdf_documentid(data)
     if datetime_obj is None:
         new_data = remove_pdf_dates(new_data)
@@ -112,9 +283,22 @@ def remove_volatile_pdf_metadata(data, datetime_obj=None):
     return new_data
 
 
-def remove_metadata_from_pdf(filename, datetime_obj=None):
-    with open(filename, 'rb') as f:
-        data = f.read()
-    new_data = remove_volatile_pdf_metadata(data, datetime_obj)
-    with open(filename, 'wb') as f:
-        f.write(new_data)
+def remove_volatile_pdf_metadata(data, datetime_obj=None, engine=None):
+    if engine is None:
+        engine = get_pdf_engine()
+    if engine == 'inprocess':
+        try:
+            return normalize_pdf_inprocess(data, datetime_obj)
+        except ValueError:
+            # fall back to exiftool/qpdf for unsupported PDF structures
+            pass
+    return remove_volatile_pdf_metadata_toolchain(data, datetime_obj)
+
+
+def remove_metadata_from_pdf(filename, datetime_obj=None, engine=None):
+    with timed_stage('pdf_metadata'):
+        with open(filename, 'rb') as f:
+            data = f.read()
+        new_data = remove_volatile_pdf_metadata(data, datetime_obj, engine)
+        with open(filename, 'wb') as f:
+            f.write(new_data)
@@ -0,0 +1,246 @@
+############################################################
+#
+# PENDF checkpoints for NJOY runs. The NJOY input is split
+# after the modules producing the PENDF tapes (moder,
+# reconr, broadr, heatr, ...). The tapes written by this
+# upstream part are cached, keyed by the hashes of all
+# input tapes, the upstream cards and the NJOY binary,
+# so that changes to the acer, groupr, gaminr or matxsr
+# cards only rerun the downstream modules. These modules
+# get copies (reflinks where supported) of the cached
+# tapes, so that they cannot modify the cache.
+#
+# The checkpoints are enabled by setting the environment
+# variable FENDL_PENDF_CACHE to the cache directory. The
+# NJOY output listing is composed of the listings of the
+# two runs without the end of the first and the banner of
+# the second run, so that it matches the listing of one
+# run once the dates and durations are normalized. NJOY is
+# run in one go if the listings cannot be spliced.
+#
+############################################################
+
+import os
+import re
+import json
+import hashlib
+import tempfile
+
+from njoy_file_manipulation import NjoyInput
+from file_hashing import filehash, stream_filehash
+from output_cache import (
+    get_cached_entry_files,
+    store_outputs_in_cache,
+    pinned_cache_entry
+)
+from tape_staging import (
+    run_njoy_staged,
+    run_njoy_in_dir,
+    choose_scratch_dir,
+    collect_output_file,
+    copy_input_file,
+    output_fence
+)
+
+
+PENDF_CACHE_ENV = 'FENDL_PENDF_CACHE'
+PENDF_CACHE_SIZE_ENV = 'FENDL_PENDF_CACHE_SIZE'
+DEFAULT_PENDF_CACHE = os.path.join('.cache', 'pendf')
+DEFAULT_PENDF_CACHE_SIZE = 50 * 1024**3
+PENDF_MODULES = ('moder', 'reconr', 'broadr', 'unresr', 'heatr',
+                 'thermr', 'purr', 'gaspr')
+NJOY_LISTING_MODULE_REGEX = re.compile(b'^ [a-z0-9]+\\.\\.\\.')
+NJOY_LISTING_TIMER_REGEX = re.compile(b'[0-9]+\\.[0-9]s$')
+
+# closing lines of the NJOY listing of each NJOY binary
+_njoy_listing_ends = {}
+
+
+def get_pendf_cache_dir():
+    """Return the directory of the PENDF cache or None if disabled."""
+    path = os.environ.get(PENDF_CACHE_ENV, '')
+    return path if path else None
+
+
+def get_pendf_cache_size():
+    size = os.environ.get(PENDF_CACHE_SIZE_ENV, None)
+    return int(size) if size else DEFAULT_PENDF_CACHE_SIZE
+
+
+def split_njoy_input(lines):
+    """Split NJOY input lines at the end of the PENDF modules.
+
+    Return the upstream and downstream lines, both terminated by
+    `stop`, or None if the input cannot be split.
+    """
+    deck = lines if isinstance(lines, NjoyInput) else NjoyInput(lines)
+    modules = deck.get_modules()
+    split_idx = None
+    for name, idx, _ in modules:
+        if name not in PENDF_MODULES:
+            split_idx = idx
+            break
+    if split_idx is None or split_idx == 0 or modules[0][0] not in PENDF_MODULES:
+        return None
+    upstream = list(deck[:split_idx]) + ['stop']
+    downstream = list(deck[split_idx:])
+    return upstream, downstream
+
+
+def get_pendf_checkpoint_key(upstream, input_tapes, njoy_files):
+    """Return the cache key of the tapes produced by the upstream modules.
+
+    All input tapes are hashed, not only those of the upstream modules,
+    because their tape numbers are spread over several cards, e.g. the
+    ENDF tape of moder is only given on the card after the unit numbers.
+    """
+    keydata = {
+        'cards': upstream,
+        'inputs': {
+            tapename: filehash(path) for tapename, path in input_tapes.items()
+        },
+        'njoy': [filehash(f) for f in njoy_files if f is not None and os.path.exists(f)],
+    }
+    keystr = json.dumps(keydata, sort_keys=True)
+    return hashlib.sha256(keystr.encode()).hexdigest()
+
+
+def _write_lines(lines, filename):
+    with open(filename, 'w') as f:
+        f.writelines(s + '\n' for s in lines)
+
+
+def _run_upstream(workdir, njoyexe, upstream, input_tapes):
+    """Run the upstream modules and return the tapes they produce."""
+    inpfile = os.path.join(workdir, 'upstream.nji')
+    _write_lines(upstream, inpfile)
+    run_njoy_in_dir(workdir, njoyexe, inpfile, input_tapes, {})
+    files = {}
+    for fname in os.listdir(workdir):
+        fpath = os.path.join(workdir, fname)
+        if fname in input_tapes or os.path.islink(fpath):
+            continue
+        if fname.startswith('tape') or fname == 'output':
+            files[fname] = fpath
+    return files
+
+
+def _read_listing(filename):
+    with open(filename, 'rb') as f:
+        return f.readlines()
+
+
+def _mask_timer(line):
+    return NJOY_LISTING_TIMER_REGEX.sub(b'0.0s', line.rstrip(b'\r\n'))
+
+
+def _get_banner_length(listing):
+    for idx, line in enumerate(listing):
+        if NJOY_LISTING_MODULE_REGEX.match(line):
+            return idx
+    raise ValueError('no module found in NJOY listing')
+
+
+def get_njoy_listing_end(njoyexe, banner_length, scratch_dir):
+    """Return the lines NJOY prints after the last module.
+
+    They are obtained from the listing of a run without modules,
+    i.e. the banner followed by the closing lines.
+    """
+    key = (os.path.abspath(njoyexe), filehash(njoyexe))
+    if key not in _njoy_listing_ends:
+        with tempfile.TemporaryDirectory(dir=scratch_dir) as workdir:
+            inpfile = os.path.join(workdir, 'stop.nji')
+            _write_lines(['stop'], inpfile)
+            rundir = os.path.join(workdir, 'run')
+            os.mkdir(rundir)
+            run_njoy_in_dir(rundir, njoyexe, inpfile, {}, {})
+            listing = _read_listing(os.path.join(rundir, 'output'))
+        _njoy_listing_ends[key] = listing[banner_length:]
+    return _njoy_listing_ends[key]
+
+
+def compose_njoy_listing(upstream_file, downstream_file, listing_end, dst):
+    """Write the listing of one NJOY run composed of two listings.
+
+    The closing lines `listing_end` are removed from the upstream
+    listing and the banner from the downstream listing. ValueError
+    is raised if the listings do not have the expected structure.
+    """
+    upstream = _read_listing(upstream_file)
+    downstream = _read_listing(downstream_file)
+    num_end = len(upstream) - len(listing_end)
+    if num_end < 0 or (list(map(_mask_timer, upstream[num_end:])) !=
+                       list(map(_mask_timer, listing_end))):
+        raise ValueError('unexpected end of the upstream NJOY listing')
+    banner_length = _get_banner_length(downstream)
+    tmpdst = dst + '.tmp'
+    with open(tmpdst, 'wb') as fout:
+        fout.writelines(upstream[:num_end])
+        fout.writelines(downstream[banner_length:])
+    os.replace(tmpdst, dst)
+
+
+def run_njoy_checkpointed(njoyexe, njoyinp, input_tapes, output_tapes, njoy_files=()):
+    """Run NJOY reusing cached PENDF tapes if available.
+
+    The arguments are the same as for `run_njoy_staged`, `njoy_files`
+    are the files of the NJOY installation included in the cache key.
+    If the checkpoints are disabled or the input cannot be split,
+    NJOY is run in one go.
+    """
+    cachedir = get_pendf_cache_dir()
+    split = None
+    if cachedir is not None:
+        split = split_njoy_input(NjoyInput.read(njoyinp))
+    if split is None:
+        run_njoy_staged(njoyexe, njoyinp, input_tapes, output_tapes)
+        return
+    upstream, downstream = split
+    key = get_pendf_checkpoint_key(upstream, input_tapes, [njoyexe, *njoy_files])
+    scratch_dir = choose_scratch_dir(input_tapes.values())
+    # the cached tapes must not be evicted before they are collected
+    with pinned_cache_entry(key, cachedir), \
+            tempfile.TemporaryDirectory(dir=scratch_dir) as workdir:
+        checkpoint = get_cached_entry_files(key, cachedir)
+        if checkpoint is None:
+            updir = os.path.join(workdir, 'upstream')
+            os.mkdir(updir)
+            checkpoint = _run_upstream(updir, njoyexe, upstream, input_tapes)
+            hashes = {k: stream_filehash(f) for k, f in checkpoint.items()}
+            store_outputs_in_cache(key, checkpoint, hashes, cachedir,
+                                   get_pendf_cache_size())
+            checkpoint = get_cached_entry_files(key, cachedir) or checkpoint
+        downdir = os.path.join(workdir, 'downstream')
+        os.mkdir(downdir)
+        # the downstream modules get copies of the cached tapes, so that
+        # a module writing to one of them cannot modify the cache entry
+        for k, f in checkpoint.items():
+            if k != 'output':
+                copy_input_file(f, os.path.join(downdir, k))
+        inpfile = os.path.join(workdir, 'downstream.nji')
+        _write_lines(downstream, inpfile)
+        run_njoy_in_dir(downdir, njoyexe, inpfile, input_tapes, {})
+        composed = os.path.join(workdir, 'output')
+        if 'output' in output_tapes:
+            try:
+                listing_end = get_njoy_listing_end(
+                    njoyexe, _get_banner_length(_read_listing(checkpoint['output'])),
+                    scratch_dir
+                )
+                compose_njoy_listing(checkpoint['output'],
+                                     os.path.join(downdir, 'output'),
+                                     listing_end, composed)
+            except ValueError as exc:
+                print(f'cannot compose NJOY listing ({exc}), running NJOY in one go')
+                run_njoy_staged(njoyexe, njoyinp, input_tapes, output_tapes)
+                return
+        with output_fence():
+            for tapename, dst in output_tapes.items():
+                src = os.path.join(downdir, tapename)
+                if tapename == 'output':
+                    collect_output_file(composed, dst)
+                elif os.path.exists(src) and not os.path.islink(src):
+                    collect_output_file(src, dst)
+                else:
+                    raise FileNotFoundError(f'NJOY did not produce {tapename}')
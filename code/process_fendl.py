@@ -19,17 +19,135 @@
 #     <endf_file> to process (optional). If none provided,
 #                 all files of the sublibrary will be processed.
 #
+#     --jobs N    process the ENDF files of all selected
+#                 sublibraries in a pool of N processes
+#     --plan [F]  write the list of materials that need to be
+#                 reprocessed as JSON to file F (default: stdout)
+#                 without running NJOY or modifying any file,
+#                 the caches in .cache are only read; sublibraries
+#                 verified as up-to-date are listed with their
+#                 number of materials
+#     --output-cache-size GB
+#                 maximal size of the cache of processed files
+#                 in .cache/outputs (default: 20 GB)
+#     --pdf-engine E
+#                 `toolchain` (exiftool/qpdf, default) or `inprocess`
+#                 to normalize the metadata of the PDF plots, the
+#                 in-process engine is faster but its files are not
+#                 byte-identical, use it only for local builds (the
+#                 trackdb records are marked, so a run with the
+#                 toolchain reprocesses the materials)
+#     --pipeline  run NJOY (--jobs workers), the plot conversion
+#                 (--plot-workers) and the output fix-ups
+#                 (--fixup-workers) as overlapping stages
+#     --scratch-dir D
+#                 directory for the NJOY tapes, e.g. /dev/shm
+#                 (default: .cache/scratch, also used if D
+#                 has not enough free space)
+#     --pendf-checkpoint
+#                 cache the tapes of the PENDF modules in
+#                 .cache/pendf and only rerun the modules
+#                 after them if their input cards change
+#     --work-queue Q
+#                 lease the ENDF files from the SQLite work queue
+#                 in file Q instead of using lock files. Processes
+#                 on the same host can share the queue, leases of
+#                 crashed workers expire after --lease-time seconds
+#                 (default: 600) and a report of the whole run
+#                 --run-id (default: default) is printed at the end.
+#                 --reset-run removes the items of a previous run.
+#                 Q must not be on NFS, whose locking is unreliable
+#                 for SQLite, so the queue cannot coordinate
+#                 several nodes sharing the repository.
+#
+#     --memory-budget GB
+#                 only start NJOY runs while the predicted peak
+#                 memory of the concurrent runs fits into GB
+#                 (--jobs and --pipeline). The prediction uses the
+#                 peak memory recorded in the last run of a material
+#                 or is based on the size of its ENDF files.
+#
+#     --watch     keep running and reprocess the materials whose
+#                 input files (ENDF files, NJOY inputs, config.py)
+#                 change. Changes are detected with inotify or by
+#                 polling every --watch-poll seconds and processed
+#                 after no further change for --watch-debounce
+#                 seconds (default: 2). Uses --jobs and --pipeline.
+#                 config.py and the NJOY version are read again
+#                 before each batch of materials.
+#
+#     --njoy-timeout-factor F
+#                 kill NJOY runs of a material taking longer than
+#                 F times its predicted runtime, but at least 30
+#                 minutes (default: 5, 0 disables the limit)
+#     --njoy-stall-timeout MIN
+#                 kill NJOY runs without new output or growing
+#                 tapes for MIN minutes (default: 30, 0 disables).
+#                 Runs printing `***error` are always killed.
+#
+#     --timing-log F
+#                 record the duration, I/O and child process memory
+#                 of the processing stages as JSON lines in file F
+#                 and as Chrome trace in F with suffix .trace.json,
+#                 see stage_timing.py for a summary of the stages
+#                 and slowest materials
+#
+#     --full-check
+#                 check every material even if its sublibrary has
+#                 been verified as up-to-date (see below)
+#
+#     The trackdb records are also indexed in .cache/trackdb.sqlite
+#     (see trackdb_index.py for queries and library roots).
+#     After a run of a whole sublibrary without failures, its
+#     trackdb root is recorded together with a digest of the
+#     stat information of its files. Later runs skip the
+#     sublibrary as long as both are unchanged. The root of
+#     the whole trackdb is listed as `all`.
+#     The NJOY runtimes recorded there train the runtime model
+#     (see cost_model.py) that orders the materials, longest
+#     first, and gives the ETA in the progress output.
+#
 ############################################################
 
 import sys
+import os
+import json
+import atexit
 from process_fendl_base import (
     get_njoy_version,
     get_fendl_version,
-    get_creation_date
+    get_creation_date,
+    reload_config,
+    process_fendl_tasks,
+    process_fendl_queue,
+    plan_fendl_tasks,
+    get_verified_sublibs,
+    skip_verified_sublibs,
+    record_verified_sublibs,
+    FULL_CHECK_ENV
+)
+from file_hashing import evict_stale_hash_cache_entries, READ_ONLY_ENV
+from output_cache import OUTPUT_CACHE_SIZE_ENV
+from pdf_manipulation import PDF_ENGINES, PDF_ENGINE_ENV
+from tape_staging import SCRATCH_DIR_ENV
+from work_queue import WorkQueue, DEFAULT_LEASE_TIME
+from stage_timing import TIMING_LOG_ENV, export_chrome_trace
+from njoy_supervisor import NJOY_TIMEOUT_FACTOR_ENV, NJOY_STALL_TIMEOUT_ENV
+from pendf_checkpoint import PENDF_CACHE_ENV, DEFAULT_PENDF_CACHE
+from fendl_pipeline import run_fendl_pipeline
+from fendl_watch import watch_fendl_inputs, DEFAULT_DEBOUNCE
+from process_fendl_neutron import (
+    process_fendl_neutron_lib,
+    get_fendl_neutron_tasks
+)
+from process_fendl_proton import (
+    process_fendl_proton_lib,
+    get_fendl_proton_tasks
+)
+from process_fendl_deuteron import (
+    process_fendl_deuteron_lib,
+    get_fendl_deuteron_tasks
 )
-from process_fendl_neutron import process_fendl_neutron_lib
-from process_fendl_proton import process_fendl_proton_lib
-from process_fendl_deuteron import process_fendl_deuteron_lib
 import argparse
 
 
@@ -42,16 +160,235 @@ parser.add_argument(
     'endf_file', type=str, default=None, nargs='?',
     help='specific ENDF file of sublibrary to process'
 )
+parser.add_argument(
+    '--jobs', type=int, default=None,
+    help='number of ENDF files processed in parallel'
+)
+parser.add_argument(
+    '--plan', type=str, default=None, nargs='?', const='-',
+    help='write the build plan as JSON to a file (default: stdout)'
+)
+parser.add_argument(
+    '--output-cache-size', type=float, default=None,
+    help='maximal size of the output cache in GB'
+)
+parser.add_argument(
+    '--pdf-engine', choices=PDF_ENGINES, default=None,
+    help='engine to remove volatile metadata from PDF files'
+)
+parser.add_argument(
+    '--scratch-dir', type=str, default=None,
+    help='directory for the temporary NJOY tapes, e.g. on a tmpfs'
+)
+parser.add_argument(
+    '--pendf-checkpoint', action='store_true',
+    help='reuse cached PENDF tapes if only downstream cards change'
+)
+parser.add_argument(
+    '--pipeline', action='store_true',
+    help='overlap NJOY runs with the post-processing of outputs'
+)
+parser.add_argument(
+    '--plot-workers', type=int, default=1,
+    help='number of plot conversion workers in pipeline mode'
+)
+parser.add_argument(
+    '--fixup-workers', type=int, default=1,
+    help='number of output fix-up workers in pipeline mode'
+)
+parser.add_argument(
+    '--queue-size', type=int, default=2,
+    help='capacity of the queues between pipeline stages'
+)
+parser.add_argument(
+    '--work-queue', type=str, default=None,
+    help='SQLite file of a work queue shared by processes on this host'
+)
+parser.add_argument(
+    '--run-id', type=str, default='default',
+    help='identifier of the run in the work queue'
+)
+parser.add_argument(
+    '--lease-time', type=float, default=DEFAULT_LEASE_TIME,
+    help='seconds after which a lease without heartbeat expires'
+)
+parser.add_argument(
+    '--reset-run', action='store_true',
+    help='remove the items of the run from the work queue first'
+)
+parser.add_argument(
+    '--memory-budget', type=float, default=None,
+    help='memory budget in GB for the concurrent NJOY runs'
+)
+parser.add_argument(
+    '--full-check', action='store_true',
+    help='check all materials even if their sublibrary is verified'
+)
+parser.add_argument(
+    '--watch', action='store_true',
+    help='reprocess materials whenever their input files change'
+)
+parser.add_argument(
+    '--watch-debounce', type=float, default=DEFAULT_DEBOUNCE,
+    help='seconds without changes before changed files are processed'
+)
+parser.add_argument(
+    '--watch-poll', type=float, default=None,
+    help='poll for changes with this interval in seconds instead of inotify'
+)
+parser.add_argument(
+    '--njoy-timeout-factor', type=float, default=None,
+    help='time limit of NJOY runs as multiple of the predicted runtime'
+)
+parser.add_argument(
+    '--njoy-stall-timeout', type=float, default=None,
+    help='minutes without NJOY output or tape growth before a run is killed'
+)
+parser.add_argument(
+    '--timing-log', type=str, default=None,
+    help='JSON lines file for the timing of the processing stages'
+)
 args = parser.parse_args()
+if args.jobs is not None and args.jobs < 1:
+    parser.error('--jobs must be at least 1')
+if args.plot_workers < 1 or args.fixup_workers < 1 or args.queue_size < 1:
+    parser.error('--plot-workers, --fixup-workers and --queue-size must be at least 1')
+if args.work_queue is not None and args.pipeline:
+    parser.error('--work-queue cannot be combined with --pipeline')
+if args.work_queue is not None and args.memory_budget is not None:
+    parser.error('--work-queue cannot be combined with --memory-budget')
+if args.watch and (args.work_queue is not None or args.plan is not None):
+    parser.error('--watch cannot be combined with --work-queue or --plan')
+
+if args.plan is not None:
+    os.environ[READ_ONLY_ENV] = '1'
+if args.output_cache_size is not None:
+    cache_size = int(args.output_cache_size * 1024**3)
+    os.environ[OUTPUT_CACHE_SIZE_ENV] = str(cache_size)
+if args.pdf_engine is not None:
+    os.environ[PDF_ENGINE_ENV] = args.pdf_engine
+if args.scratch_dir is not None:
+    os.environ[SCRATCH_DIR_ENV] = args.scratch_dir
+if args.full_check:
+    os.environ[FULL_CHECK_ENV] = '1'
+if args.pendf_checkpoint:
+    os.environ[PENDF_CACHE_ENV] = DEFAULT_PENDF_CACHE
+if args.njoy_timeout_factor is not None:
+    os.environ[NJOY_TIMEOUT_FACTOR_ENV] = str(args.njoy_timeout_factor)
+if args.njoy_stall_timeout is not None:
+    os.environ[NJOY_STALL_TIMEOUT_ENV] = str(args.njoy_stall_timeout * 60)
+memory_budget = None
+if args.memory_budget is not None:
+    memory_budget = int(args.memory_budget * 1024**3)
+if args.timing_log is not None:
+    timing_log = os.path.abspath(args.timing_log)
+    open(timing_log, 'w').close()
+    os.environ[TIMING_LOG_ENV] = timing_log
+    trace_file = os.path.splitext(timing_log)[0] + '.trace.json'
+    atexit.register(export_chrome_trace, timing_log, trace_file)
 
 library_type = args.library_type
 endf_file = args.endf_file
 
 njoyexe = '/opt/NJOY2016/bin/njoy'
 njoylib = '/opt/NJOY2016/bin/libnjoy.so'
-njoyvers = get_njoy_version('/opt/NJOY2016')
-fendlvers = get_fendl_version()
-cdate = get_creation_date()
+
+
+def read_versions():
+    return get_njoy_version('/opt/NJOY2016'), get_fendl_version(), get_creation_date()
+
+
+njoyvers, fendlvers, cdate = read_versions()
+
+
+def get_tasks():
+    tasks = []
+    if library_type in ('neutron', 'all'):
+        tasks += get_fendl_neutron_tasks('.', njoyexe, njoylib, endf_file)
+    if library_type in ('proton', 'all'):
+        tasks += get_fendl_proton_tasks('.', njoyexe, njoylib, endf_file)
+    if library_type in ('deuteron', 'all'):
+        tasks += get_fendl_deuteron_tasks('.', njoyexe, njoylib, endf_file)
+    return tasks
+
+
+def process_tasks(tasks, njobs):
+    if args.pipeline:
+        return run_fendl_pipeline(
+            tasks, njoyvers, fendlvers, cdate, njoy_workers=njobs,
+            plot_workers=args.plot_workers, fixup_workers=args.fixup_workers,
+            queue_size=args.queue_size, memory_budget=memory_budget
+        )
+    return process_fendl_tasks(
+        tasks, njobs, njoyvers, fendlvers, cdate, memory_budget=memory_budget
+    )
+
+
+def process_watched_tasks(tasks, njobs):
+    # config.py and NJOY may have changed since the last batch
+    global njoyvers, fendlvers, cdate
+    try:
+        reload_config()
+        njoyvers, fendlvers, cdate = read_versions()
+    except Exception as exc:
+        print(f'--- cannot read config.py or the NJOY version ({exc}), '
+              f'skipping {len(tasks)} materials until they change ---')
+        return []
+    return process_tasks(tasks, njobs)
+
+
+if args.watch:
+    njobs = args.jobs if args.jobs is not None else 1
+    watch_fendl_inputs(
+        get_tasks, lambda tasks: process_watched_tasks(tasks, njobs),
+        debounce=args.watch_debounce, poll_interval=args.watch_poll
+    )
+    evict_stale_hash_cache_entries()
+    sys.exit(0)
+
+use_tasks = args.jobs is not None or args.pipeline or args.work_queue is not None
+if use_tasks or args.plan is not None:
+    all_tasks = get_tasks()
+    tasks = all_tasks
+    if endf_file is None and args.plan is not None:
+        # the plan lists the verified sublibraries instead of printing them
+        verified = get_verified_sublibs(all_tasks, njoyvers, fendlvers, cdate)
+        tasks = [t for t in all_tasks if t['sublib'] not in verified]
+    elif endf_file is None and args.work_queue is None:
+        tasks = skip_verified_sublibs(all_tasks, njoyvers, fendlvers, cdate)
+
+if args.plan is not None:
+    njobs = args.jobs if args.jobs is not None else os.cpu_count()
+    plan = plan_fendl_tasks(tasks, njobs, njoyvers, fendlvers, cdate,
+                            verified if endf_file is None else None)
+    if args.plan == '-':
+        json.dump(plan, sys.stdout, indent=4)
+        print()
+    else:
+        with open(args.plan, 'w') as f:
+            json.dump(plan, f, indent=4)
+    sys.exit(0)
+
+if use_tasks:
+    njobs = args.jobs if args.jobs is not None else 1
+    print(f'--- processing {len(tasks)} ENDF files with {njobs} jobs ---')
+    if args.work_queue is not None:
+        if args.reset_run:
+            with WorkQueue(args.work_queue, args.run_id) as queue:
+                queue.reset()
+        report = process_fendl_queue(
+            tasks, njobs, args.work_queue, args.run_id, args.lease_time,
+            njoyvers, fendlvers, cdate
+        )
+        evict_stale_hash_cache_entries()
+        sys.exit(1 if report['counts'].get('failed', 0) > 0 else 0)
+    results = process_tasks(tasks, njobs)
+    if endf_file is None:
+        record_verified_sublibs(all_tasks, results, njoyvers, fendlvers, cdate)
+    evict_stale_hash_cache_entries()
+    if any(res['status'] == 'failed' for res in results):
+        sys.exit(1)
+    sys.exit(0)
 
 if library_type in ('neutron', 'all'):
     print('--- processing neutron ENDF files ---')
@@ -70,3 +407,5 @@ if library_type in ('deuteron', 'all'):
     process_fendl_deuteron_lib(
         '.', njoyexe, njoylib, njoyvers, fendlvers, cdate, endf_file=endf_file
     )
+
+evict_stale_hash_cache_entries()
@@ -1,9 +1,17 @@
 import os
-import json
 import hashlib
+import importlib
+import json
 import re
 import sys
+import time
+import tempfile
+import traceback
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 from njoy_file_manipulation import (
+    NjoyInput,
     set_ace_comment,
     set_g_comment,
     set_gam_comment,
@@ -14,12 +22,50 @@ from njoy_file_manipulation import (
     set_reconr_comments2,
     set_moder_comment,
     set_acefile_date,
-    zero_njoy_outfile_durations,
-    set_njoy_outfile_date
+    normalize_njoy_outfile
+)
+from pdf_manipulation import remove_metadata_from_pdf, get_pdf_engine
+from file_hashing import filehash, store_filehash
+from pendf_checkpoint import get_pendf_cache_dir
+from work_queue import WorkQueue, get_worker_id
+from trackdb_index import (
+    read_trackdb_record,
+    write_trackdb_file,
+    get_trackfile_ids,
+    store_njoy_usage,
+    store_verified_root,
+    is_verified_root,
+    get_trackdb_root
+)
+from stage_timing import timed_stage, run_child_process
+from tape_staging import (
+    reset_njoy_usage,
+    get_njoy_usage,
+    set_output_fence,
+    output_fence,
+    choose_scratch_dir,
+    collect_output_file
+)
+from njoy_supervisor import (
+    set_njoy_time_limit,
+    get_njoy_timeout,
+    set_njoy_abort_event
+)
+from memory_admission import MemoryScheduler
+from cost_model import predict_runtimes, order_tasks_longest_first
+from progress_report import ProgressReporter
+from njoy_perf import store_njoy_module_timings
+from output_cache import (
+    get_output_cache_key,
+    restore_cached_outputs,
+    store_outputs_in_cache,
+    pinned_cache_entry
 )
-from pdf_manipulation import remove_metadata_from_pdf
 sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
-from config import CREATION_DATE, FENDL_VERSION
+import config
+
+
+FULL_CHECK_ENV = 'FENDL_FULL_CHECK'
 
 
 def lock_file(filename):
@@ -36,12 +82,23 @@ def is_lockfile(filename):
     return filename.endswith('.lock')
 
 
+def reload_config():
+    """Read config.py again, e.g. after it changed in watch mode."""
+    importlib.reload(config)
+
+
 def get_fendl_version():
-    return FENDL_VERSION
+    return config.FENDL_VERSION
 
 
 def get_creation_date():
-    return CREATION_DATE
+    return config.CREATION_DATE
+
+
+def get_fendl_material_name(fendl_paths):
+    """Return the name of a material used in logs, e.g. `neutron/26Fe056`."""
+    sublib, material = get_trackfile_ids(fendl_paths['trackfile'])
+    return f'{sublib}/{material}'
 
 
 def get_njoy_version(njoy_path):
@@ -66,10 +123,12 @@ def extract_isotope_info(njoyinp):
     return charge, sym, mass
 
 
-def update_njoy_inputfile(njoyinp, njoyvers, fendlvers, cdate):
-    with open(njoyinp, 'r') as fin:
-        lines = fin.readlines()
-    lines = [s.rstrip('\n') for s in lines]
+def get_updated_njoy_input(njoyinp, njoyvers, fendlvers, cdate):
+    """Return the lines of the NJOY input file with updated comments.
+
+    The file itself is not modified.
+    """
+    lines = NjoyInput.read(njoyinp)
     njoyinp_basename = os.path.basename(njoyinp)
     osd = os.path.dirname
     particle = os.path.basename(osd(osd(njoyinp)))
@@ -102,22 +161,23 @@ def update_njoy_inputfile(njoyinp, njoyvers, fendlvers, cdate):
             f"Processed by NJOY{njoyvers}"
         ]
         set_reconr_comments2(lines, reconr_comments1)
-    os.unlink(njoyinp)
-    lines = [s + '\n' for s in lines]
-    with open(njoyinp, 'w') as fout:
-        fout.writelines(lines)
+    return lines
 
 
-def filehash(fname):
-    """Calculate sha256 hash of file."""
-    sha256 = hashlib.sha256()
-    with open(fname, 'rb') as f:
-        while True:
-            data = f.read(65536)
-            if not data:
-                break
-            sha256.update(data)
-    return sha256.hexdigest()
+def get_njoy_input_hash(lines):
+    """Return the sha256 hash of NJOY input lines as written to disk."""
+    content = ''.join(s + '\n' for s in lines)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def update_njoy_inputfile(njoyinp, njoyvers, fendlvers, cdate):
+    """Update the comments in the NJOY input file.
+
+    The file is only rewritten if its content changes
+    so that its modification time is preserved otherwise.
+    """
+    lines = get_updated_njoy_input(njoyinp, njoyvers, fendlvers, cdate)
+    return lines.write(njoyinp)
 
 
 def is_endf_file(fpath):
@@ -151,60 +211,218 @@ def check_input_files_available(fendl_paths):
     return
 
 
-def should_reprocess(fendl_paths):
-    """Return boolean indicating whether running NJOY is necessary"""
+def get_reprocess_reasons(fendl_paths, input_hashes=None, stop_early=False):
+    """Return a list of reasons why running NJOY is necessary.
+
+    Hashes provided in `input_hashes` take precedence over the hashes
+    of the input files on disk. If `stop_early` is true, the evaluation
+    stops after the first reason found.
+    """
+    reasons = []
     for k, f in fendl_paths['outputs'].items():
         if not os.path.isfile(f):
-            return True
-    trackfile = fendl_paths['trackfile']
-    if not os.path.isfile(trackfile):
-        return True
-    with open(trackfile, 'r') as f:
-        storedhashes = json.load(f)
-    curhashes = {k: filehash(f) for k, f in fendl_paths['outputs'].items()}
-    for k in curhashes:
-        if curhashes[k] != storedhashes['outputs'][k]:
-            raise ValueError(
-                'Hashes of output files do not match those in trackdb!\n'
-                'maybe files were reprocessed without using this script?'
-            )
-
-    curhashes = {k: filehash(f) for k, f in fendl_paths['inputs'].items()}
-    for k in curhashes:
-        if curhashes[k] != storedhashes['inputs'][k]:
-            return True
-    return False
+            reasons.append(f'missing_output:{k}')
+            if stop_early:
+                return reasons
+    storedhashes = read_trackdb_record(fendl_paths['trackfile'])
+    if storedhashes is None:
+        reasons.append('missing_trackfile')
+        return reasons
+    stored_options = storedhashes.get('options', {})
+    if stored_options and stored_options != get_build_options():
+        reasons.append('build_options')
+        if stop_early:
+            return reasons
+    if not reasons:
+        curhashes = {k: filehash(f) for k, f in fendl_paths['outputs'].items()}
+        for k in curhashes:
+            if curhashes[k] != storedhashes['outputs'].get(k):
+                reasons.append(f'output_mismatch:{k}')
+                if stop_early:
+                    return reasons
+
+    if input_hashes is None:
+        input_hashes = {}
+    for k, f in fendl_paths['inputs'].items():
+        curhash = input_hashes[k] if k in input_hashes else filehash(f)
+        if curhash != storedhashes['inputs'].get(k):
+            reasons.append(f'changed_input:{k}')
+            if stop_early:
+                return reasons
+    return reasons
 
 
-def process_fendl_endf(run_fendl_njoy, fendl_paths, njoyvers, fendlvers, cdate):
-    """Process one neutron ENDF file in FENDL library."""
+def should_reprocess(fendl_paths):
+    """Return boolean indicating whether running NJOY is necessary"""
+    reasons = get_reprocess_reasons(fendl_paths, stop_early=True)
+    if any(r.startswith('output_mismatch:') for r in reasons):
+        raise ValueError(
+            'Hashes of output files do not match those in trackdb!\n'
+            'maybe files were reprocessed without using this script?'
+        )
+    return len(reasons) > 0
+
+
+def get_build_options():
+    """Return the options under which outputs differ from a standard build.
+
+    The options are stored in the trackdb records, so outputs built with
+    them stand out in the trackdb and are reprocessed by a standard run,
+    which has to be used for the outputs committed to the repository.
+    """
+    options = {}
+    if get_pdf_engine() != 'toolchain':
+        options['pdf_engine'] = get_pdf_engine()
+    return options
+
+
+def write_trackdb_record(trackfile, hashes):
+    """Write the hashes of input and output files to the trackdb."""
+    options = get_build_options()
+    if options:
+        hashes = dict(hashes, options=options)
+    with output_fence():
+        write_trackdb_file(trackfile, hashes)
+
+
+def prepare_fendl_endf(fendl_paths, njoyvers, fendlvers, cdate):
+    """Prepare the processing of an ENDF file.
+
+    Return None if the output files are up-to-date. Otherwise the
+    outdated output files are removed and a dictionary with the input
+    hashes and the cache key is returned. If the outputs could be
+    restored from the output cache, the dictionary contains the
+    output hashes as well and the trackdb record is already written.
+    """
+    with timed_stage('prepare', get_fendl_material_name(fendl_paths)):
+        return _prepare_fendl_endf(fendl_paths, njoyvers, fendlvers, cdate)
+
+
+def _prepare_fendl_endf(fendl_paths, njoyvers, fendlvers, cdate):
     check_input_files_available(fendl_paths)
     njoyinp = fendl_paths['inputs']['njoyinp']
     update_njoy_inputfile(njoyinp, njoyvers, fendlvers, cdate)
-    if should_reprocess(fendl_paths):
-        for k, curpath in fendl_paths['outputs'].items():
+    with timed_stage('check_trackdb'):
+        if not should_reprocess(fendl_paths):
+            return None
+    outputs = fendl_paths['outputs']
+    with output_fence():
+        for k, curpath in outputs.items():
             if os.path.isfile(curpath) or os.path.islink(curpath):
                 os.unlink(curpath)
-        trackfile = fendl_paths['trackfile']
-        run_fendl_njoy(fendl_paths)
-        # specify dates and remove metadata of pdfs for reproducibility
-        for p in fendl_paths['outputs'].values():
-            if p.endswith('.pdf'):
-                remove_metadata_from_pdf(p, cdate)
-        ace_file = fendl_paths['outputs']['ace']
-        set_acefile_date(ace_file, cdate)
-        njoy_outfile = fendl_paths['outputs']['njoyout']
-        set_njoy_outfile_date(njoy_outfile, cdate)
-        zero_njoy_outfile_durations(njoy_outfile)
-        # record checksums
+    with timed_stage('hash_inputs'):
         curhashes_inputs = {k: filehash(f) for k, f in fendl_paths['inputs'].items()}
-        curhashes_outputs = {k: filehash(f) for k, f in fendl_paths['outputs'].items()}
-        curhashes = {'inputs': curhashes_inputs, 'outputs': curhashes_outputs}
-        trackfile_dirname = os.path.dirname(trackfile)
-        os.makedirs(trackfile_dirname, exist_ok=True)
-        with open(trackfile, 'w') as outf:
-            json.dump(curhashes, outf, indent=4)
-    return
+    cache_options = {'pdf_engine': get_pdf_engine()}
+    if get_pendf_cache_dir() is not None:
+        cache_options['pendf_checkpoint'] = True
+    cache_key = get_output_cache_key(curhashes_inputs, outputs, cache_options)
+    with timed_stage('restore_cache'), pinned_cache_entry(cache_key), output_fence():
+        curhashes_outputs = restore_cached_outputs(cache_key, outputs)
+        if curhashes_outputs is not None:
+            for k, f in outputs.items():
+                store_filehash(f, curhashes_outputs[k])
+            curhashes = {'inputs': curhashes_inputs, 'outputs': curhashes_outputs}
+            write_trackdb_record(fendl_paths['trackfile'], curhashes)
+    state = {
+        'input_hashes': curhashes_inputs,
+        'cache_key': cache_key,
+        'output_hashes': curhashes_outputs,
+        'njoy_version': njoyvers,
+    }
+    return state
+
+
+def convert_plots_to_pdf(fendl_paths, cdate):
+    """Convert the PostScript plots produced by NJOY to PDF files.
+
+    The volatile metadata is removed from the PDF files in a scratch
+    directory before they are moved into place.
+    """
+    outputs = fendl_paths['outputs']
+    for k, curpath in outputs.items():
+        pdfkey = k + 'pdf'
+        if pdfkey not in outputs:
+            continue
+        with tempfile.TemporaryDirectory(dir=choose_scratch_dir([curpath])) as tmpdir:
+            tmppath = os.path.join(tmpdir, os.path.basename(outputs[pdfkey]))
+            ret = run_child_process(['ps2pdf', curpath, tmppath])
+            ret.check_returncode()
+            # specify dates and remove metadata of pdfs for reproducibility
+            remove_metadata_from_pdf(tmppath, cdate)
+            with output_fence():
+                collect_output_file(tmppath, outputs[pdfkey])
+
+
+def postprocess_fendl_plots(fendl_paths, cdate):
+    """Convert plots to PDF and remove their volatile metadata."""
+    with timed_stage('plots', get_fendl_material_name(fendl_paths)):
+        convert_plots_to_pdf(fendl_paths, cdate)
+
+
+def finalize_fendl_outputs(fendl_paths, state, cdate):
+    """Fix dates in output files, record checksums and cache outputs.
+
+    The outputs are modified inside the output fence of the thread.
+    """
+    material = get_fendl_material_name(fendl_paths)
+    with timed_stage('finalize', material), output_fence():
+        outputs = fendl_paths['outputs']
+        with timed_stage('patch_dates'):
+            ace_file = outputs['ace']
+            set_acefile_date(ace_file, cdate)
+            njoy_outfile = outputs['njoyout']
+            # the module timings are lost once the durations are zeroed
+            module_timings = []
+            njoy_outfile_hash = normalize_njoy_outfile(
+                njoy_outfile, cdate, module_timings=module_timings
+            )
+            store_filehash(njoy_outfile, njoy_outfile_hash)
+        # record checksums, the NJOY listing has been hashed while rewriting it
+        with timed_stage('hash_outputs'):
+            curhashes_outputs = {
+                k: njoy_outfile_hash if k == 'njoyout' else filehash(f)
+                for k, f in outputs.items()
+            }
+        with timed_stage('store_cache'), pinned_cache_entry(state['cache_key']):
+            store_outputs_in_cache(state['cache_key'], outputs, curhashes_outputs)
+        curhashes = {'inputs': state['input_hashes'], 'outputs': curhashes_outputs}
+        write_trackdb_record(fendl_paths['trackfile'], curhashes)
+    store_njoy_module_timings(
+        material, state['njoy_version'],
+        state['input_hashes']['njoyexe'], module_timings
+    )
+
+
+def run_fendl_njoy_supervised(run_fendl_njoy, fendl_paths, predicted_runtime=None):
+    """Run NJOY for a material and record its peak memory and runtime.
+
+    The NJOY runs are killed if they exceed a time limit scaled by
+    the predicted runtime of the material.
+    """
+    if predicted_runtime is None:
+        predicted_runtime = predict_runtimes([fendl_paths])[0]
+    reset_njoy_usage()
+    set_njoy_time_limit(get_njoy_timeout(predicted_runtime))
+    try:
+        run_fendl_njoy(fendl_paths)
+    finally:
+        set_njoy_time_limit(None)
+    usage = get_njoy_usage()
+    if usage is not None:
+        store_njoy_usage(fendl_paths['trackfile'], usage)
+
+
+def process_fendl_endf(run_fendl_njoy, fendl_paths, njoyvers, fendlvers, cdate,
+                       predicted_runtime=None):
+    """Process one neutron ENDF file in FENDL library."""
+    state = prepare_fendl_endf(fendl_paths, njoyvers, fendlvers, cdate)
+    if state is None:
+        return False
+    if state['output_hashes'] is None:
+        run_fendl_njoy_supervised(run_fendl_njoy, fendl_paths, predicted_runtime)
+        postprocess_fendl_plots(fendl_paths, cdate)
+        finalize_fendl_outputs(fendl_paths, state, cdate)
+    return True
 
 
 def process_fendl_sublib(
@@ -214,23 +432,450 @@ def process_fendl_sublib(
     endf_sublib = os.path.join(repodir, sublib_path)
     endf_files = os.listdir(endf_sublib)
     endf_files = [f for f in endf_files if not is_lockfile(f)]
-    lock_fails = 0
+    tasks = []
     for cur_endf_file in endf_files:
         if endf_file is not None and endf_file != cur_endf_file:
             continue
+        fendl_endf_file = os.path.join(endf_sublib, cur_endf_file)
+        info = get_endf_info(fendl_endf_file)
+        fendl_paths = determine_fendl_paths(info, repodir, njoyexe, njoylib)
+        tasks.append({
+            'sublib': get_trackfile_ids(fendl_paths['trackfile'])[0],
+            'endf_file': fendl_endf_file,
+            'fendl_paths': fendl_paths,
+        })
+    all_tasks = tasks
+    if endf_file is None:
+        tasks = skip_verified_sublibs(tasks, njoyvers, fendlvers, cdate)
+    predictions = predict_runtimes([t['fendl_paths'] for t in tasks])
+    for task, pred in zip(tasks, predictions):
+        task['predicted_runtime'] = pred
+    progress = ProgressReporter(tasks)
+    results = []
+    lock_fails = 0
+    for task in tasks:
+        fendl_endf_file = task['endf_file']
+        result = {'sublib': task['sublib'], 'endf_file': fendl_endf_file,
+                  'status': 'locked', 'duration': 0.0}
         try:
-            fendl_endf_file = os.path.join(endf_sublib, cur_endf_file)
             lock_file(fendl_endf_file)
-            info = get_endf_info(fendl_endf_file)
-            fendl_paths = determine_fendl_paths(info, repodir, njoyexe, njoylib)
-            process_fendl_endf(run_njoy, fendl_paths, njoyvers, fendlvers, cdate)
-            unlock_file(fendl_endf_file)
         except FileExistsError:
             lock_fails += 1
+            progress.finish(result, task)
             continue
-        except Exception as exc:
+        progress.start(task)
+        start_time = time.time()
+        try:
+            reprocessed = process_fendl_endf(
+                run_njoy, task['fendl_paths'], njoyvers, fendlvers, cdate,
+                task['predicted_runtime']
+            )
+        finally:
             unlock_file(fendl_endf_file)
-            raise exc
+        result['status'] = 'processed' if reprocessed else 'uptodate'
+        result['duration'] = time.time() - start_time
+        results.append(result)
+        progress.finish(result, task)
 
     if lock_fails > 0:
         print(f'\n\nWARNING: skipped {lock_fails} files because locking failed')
+    elif endf_file is None and tasks:
+        record_verified_sublibs(all_tasks, results, njoyvers, fendlvers, cdate)
+
+
+def _get_stat_state(fname):
+    try:
+        st = os.stat(fname)
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+def get_sublib_state(tasks, njoyvers, fendlvers, cdate):
+    """Return a digest of the state of the files of a sublibrary.
+
+    The digest covers the stat information of the input, output and
+    trackdb files of all tasks as well as the versions and options
+    determining the outputs, so no file has to be hashed.
+    """
+    files = []
+    for task in sorted(tasks, key=lambda t: t['fendl_paths']['trackfile']):
+        fendl_paths = task['fendl_paths']
+        paths = [fendl_paths['trackfile'], *fendl_paths['inputs'].values(),
+                 *fendl_paths['outputs'].values()]
+        files.extend((p, _get_stat_state(p)) for p in paths)
+    statedata = {
+        'versions': [njoyvers, fendlvers, str(cdate)],
+        'options': get_build_options(),
+        'files': files,
+    }
+    statestr = json.dumps(statedata, sort_keys=True)
+    return hashlib.sha256(statestr.encode()).hexdigest()
+
+
+def _group_tasks_by_sublib(tasks):
+    groups = {}
+    for task in tasks:
+        groups.setdefault(task['sublib'], []).append(task)
+    return groups
+
+
+def get_verified_sublibs(tasks, njoyvers, fendlvers, cdate):
+    """Return the tasks of the sublibraries known to be up-to-date.
+
+    A sublibrary is up-to-date if the trackdb root and the state of its
+    files are those recorded after its last complete run, see
+    `record_verified_sublibs`. No sublibrary is returned if the
+    environment variable FENDL_FULL_CHECK is set to a non-empty value.
+    """
+    if os.environ.get(FULL_CHECK_ENV, ''):
+        return {}
+    verified = {}
+    for sublib, sublib_tasks in _group_tasks_by_sublib(tasks).items():
+        state = get_sublib_state(sublib_tasks, njoyvers, fendlvers, cdate)
+        if is_verified_root(sublib, state):
+            verified[sublib] = sublib_tasks
+    return verified
+
+
+def skip_verified_sublibs(tasks, njoyvers, fendlvers, cdate):
+    """Remove the tasks of sublibraries known to be up-to-date."""
+    verified = get_verified_sublibs(tasks, njoyvers, fendlvers, cdate)
+    for sublib, sublib_tasks in verified.items():
+        print(f'--- {sublib}: {len(sublib_tasks)} materials up-to-date '
+              f'(verified trackdb root) ---')
+    return [t for t in tasks if t['sublib'] not in verified]
+
+
+def record_verified_sublibs(tasks, results, njoyvers, fendlvers, cdate):
+    """Record the sublibraries whose tasks all ended up-to-date or processed.
+
+    `tasks` must comprise all materials of the sublibraries.
+    """
+    ok_files = set(res['endf_file'] for res in results
+                   if res['status'] in ('processed', 'uptodate'))
+    for sublib, sublib_tasks in _group_tasks_by_sublib(tasks).items():
+        if all(t['endf_file'] in ok_files for t in sublib_tasks):
+            state = get_sublib_state(sublib_tasks, njoyvers, fendlvers, cdate)
+            store_verified_root(sublib, state)
+
+
+def get_fendl_task_cost(fendl_paths):
+    """Return the summed size of the ENDF input files as cost estimate."""
+    cost = 0
+    for k, f in fendl_paths['inputs'].items():
+        if k.endswith('_endf') and os.path.isfile(f):
+            cost += os.path.getsize(f)
+    return cost
+
+
+def collect_fendl_sublib_tasks(
+    repodir, sublib, sublib_path, run_njoy, determine_fendl_paths,
+    njoyexe, njoylib, endf_file=None
+):
+    """Return a list of processing tasks for the ENDF files of a sublibrary."""
+    endf_sublib = os.path.join(repodir, sublib_path)
+    endf_files = os.listdir(endf_sublib)
+    endf_files = [f for f in endf_files if not is_lockfile(f)]
+    tasks = []
+    for cur_endf_file in sorted(endf_files):
+        if endf_file is not None and endf_file != cur_endf_file:
+            continue
+        fendl_endf_file = os.path.join(endf_sublib, cur_endf_file)
+        info = get_endf_info(fendl_endf_file)
+        fendl_paths = determine_fendl_paths(info, repodir, njoyexe, njoylib)
+        tasks.append({
+            'sublib': sublib,
+            'endf_file': fendl_endf_file,
+            'run_njoy': run_njoy,
+            'fendl_paths': fendl_paths,
+            'cost': get_fendl_task_cost(fendl_paths),
+        })
+    return tasks
+
+
+def process_fendl_task(task, njoyvers, fendlvers, cdate, use_lock=True):
+    """Process a single task and return a result dictionary.
+
+    Exceptions are caught and reported in the result so that a
+    failing material does not affect the processing of other ones.
+    The lock file is not used if `use_lock` is false, e.g. if the
+    task has been leased from a work queue.
+    """
+    fendl_endf_file = task['endf_file']
+    result = {
+        'sublib': task['sublib'],
+        'endf_file': fendl_endf_file,
+        'status': None,
+        'error': None,
+        'duration': 0.0,
+    }
+    start_time = time.time()
+    if use_lock:
+        try:
+            lock_file(fendl_endf_file)
+        except FileExistsError:
+            result['status'] = 'locked'
+            return result
+    try:
+        reprocessed = process_fendl_endf(
+            task['run_njoy'], task['fendl_paths'], njoyvers, fendlvers, cdate,
+            task.get('predicted_runtime')
+        )
+        result['status'] = 'processed' if reprocessed else 'uptodate'
+    except Exception:
+        result['status'] = 'failed'
+        result['error'] = traceback.format_exc()
+    finally:
+        if use_lock:
+            unlock_file(fendl_endf_file)
+        result['duration'] = time.time() - start_time
+    return result
+
+
+def print_fendl_summary(results):
+    """Print an aggregate summary of the task results."""
+    counts = {}
+    for res in results:
+        counts[res['status']] = counts.get(res['status'], 0) + 1
+    print('\n\n--- summary ---')
+    for status in ('processed', 'uptodate', 'locked', 'failed'):
+        print(f'{status:>10}: {counts.get(status, 0)}')
+    failed = [res for res in results if res['status'] == 'failed']
+    for res in failed:
+        print(f'\nFAILED: {res["endf_file"]}')
+        print(res['error'])
+    locked = [res for res in results if res['status'] == 'locked']
+    for res in locked:
+        print(f'LOCKED: {res["endf_file"]}')
+
+
+def get_failed_task_result(task, error):
+    """Return the result of a task that failed outside of its worker."""
+    return {
+        'sublib': task['sublib'],
+        'endf_file': task['endf_file'],
+        'status': 'failed',
+        'error': error,
+        'duration': 0.0,
+    }
+
+
+def process_fendl_tasks(tasks, njobs, njoyvers, fendlvers, cdate, memory_budget=None):
+    """Process tasks in a process pool, longest predicted runtime first.
+
+    If `memory_budget` (bytes) is given, tasks are only started while
+    the predicted NJOY memory of the running tasks fits the budget.
+    If a worker process dies, e.g. killed for lack of memory, the tasks
+    running in the pool are reported as failed and a new pool is
+    started for the remaining ones.
+    """
+    tasks = order_tasks_longest_first(tasks)
+    scheduler = MemoryScheduler(tasks, memory_budget)
+    progress = ProgressReporter(tasks, njobs)
+    results = []
+    executor = ProcessPoolExecutor(max_workers=njobs)
+    try:
+        running = {}
+        while scheduler.num_pending() > 0 or running:
+            while len(running) < njobs:
+                task = scheduler.acquire(block=False)
+                if task is None:
+                    break
+                try:
+                    fut = executor.submit(process_fendl_task, task, njoyvers, fendlvers, cdate)
+                except BrokenProcessPool:
+                    executor.shutdown(wait=False)
+                    executor = ProcessPoolExecutor(max_workers=njobs)
+                    fut = executor.submit(process_fendl_task, task, njoyvers, fendlvers, cdate)
+                running[fut] = (task, executor)
+                progress.start(task)
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                task, task_executor = running.pop(fut)
+                scheduler.release(task)
+                try:
+                    res = fut.result()
+                except BrokenProcessPool:
+                    res = get_failed_task_result(
+                        task, 'a worker process died while this material was '
+                        'processed, its lock file may have to be removed\n'
+                        + traceback.format_exc()
+                    )
+                    if task_executor is executor:
+                        executor.shutdown(wait=False)
+                        executor = ProcessPoolExecutor(max_workers=njobs)
+                except Exception:
+                    res = get_failed_task_result(task, traceback.format_exc())
+                results.append(res)
+                progress.finish(res, task)
+    finally:
+        executor.shutdown()
+    print_fendl_summary(results)
+    return results
+
+
+def get_fendl_task_key(task):
+    """Return the identifier of a task in a work queue."""
+    return os.path.relpath(task['endf_file'])
+
+
+def _send_heartbeats(queue_path, run_id, lease_time, key, worker_id, token, stop, lost):
+    with WorkQueue(queue_path, run_id, lease_time) as queue:
+        while not stop.wait(lease_time / 4):
+            if not queue.heartbeat(key, worker_id, token):
+                lost.set()
+                break
+
+
+def run_fendl_queue_worker(queue_path, run_id, lease_time, tasks, njoyvers, fendlvers, cdate):
+    """Process tasks leased from a work queue until it is empty.
+
+    Only the items of the given tasks are claimed. While a task is
+    processed, a thread renews its lease. If the lease is lost, NJOY
+    is killed. The outputs and the trackdb are only written inside
+    the fence of the lease (see `WorkQueue.fenced`), so that a worker
+    whose item has been handed out again does not modify them. If
+    other workers still hold leases, the worker waits because their
+    leases may expire and the items be handed out again.
+    """
+    tasks = {get_fendl_task_key(t): t for t in tasks}
+    worker_id = get_worker_id()
+    results = []
+    with WorkQueue(queue_path, run_id, lease_time) as queue:
+        while True:
+            lease = queue.claim(worker_id, tasks)
+            if lease is None:
+                if queue.num_unfinished(tasks) == 0:
+                    break
+                time.sleep(min(lease_time / 4, 30))
+                continue
+            key, token = lease
+            stop = threading.Event()
+            lost = threading.Event()
+            heartbeat = threading.Thread(
+                target=_send_heartbeats,
+                args=(queue_path, run_id, lease_time, key, worker_id, token, stop, lost)
+            )
+            heartbeat.start()
+            set_output_fence(lambda: queue.fenced(key, worker_id, token))
+            set_njoy_abort_event(lost)
+            try:
+                res = process_fendl_task(tasks[key], njoyvers, fendlvers, cdate,
+                                         use_lock=False)
+            finally:
+                set_output_fence(None)
+                set_njoy_abort_event(None)
+                stop.set()
+                heartbeat.join()
+            error = res['error'].splitlines()[-1] if res['error'] else None
+            if not queue.complete(key, worker_id, token, res['status'], error,
+                                  res['duration']):
+                res['status'] = 'failed'
+                res['error'] = f'lease of {key} lost'
+            print(f'{worker_id} {res["status"]}: {res["sublib"]} '
+                  f'{os.path.basename(key)} ({res["duration"]:.1f}s)', flush=True)
+            results.append(res)
+    return results
+
+
+def print_fendl_queue_report(report):
+    """Print the consolidated status of all items of a queue run."""
+    print(f'\n\n--- report of run {report["run_id"]} ---')
+    for status in ('processed', 'uptodate', 'failed', 'leased', 'pending'):
+        print(f'{status:>10}: {report["counts"].get(status, 0)}')
+    for item in report['items']:
+        if item['status'] == 'failed':
+            worker = f' on {item["worker"]}' if item['worker'] else ''
+            print(f'FAILED: {item["key"]}{worker} '
+                  f'after {item["attempts"]} attempt(s): {item["error"]}')
+        elif item['status'] in ('leased', 'pending'):
+            worker = f' on {item["worker"]}' if item['worker'] else ''
+            print(f'{item["status"].upper()}: {item["key"]}{worker}')
+
+
+def process_fendl_queue(tasks, njobs, queue_path, run_id, lease_time,
+                        njoyvers, fendlvers, cdate):
+    """Process tasks with workers sharing a work queue.
+
+    The tasks are added to the queue unless they are present already,
+    so several nodes can work on the same run. Return the report of
+    the queue after the local workers have finished.
+    """
+    njobs = njobs if njobs is not None else 1
+    tasks = order_tasks_longest_first(tasks)
+    # the queue hands out the items with the longest predicted runtime first
+    with WorkQueue(queue_path, run_id, lease_time) as queue:
+        queue.add_items(
+            (get_fendl_task_key(t), t['sublib'], int(t['predicted_runtime'] * 1000))
+            for t in tasks
+        )
+    with ProcessPoolExecutor(max_workers=njobs) as executor:
+        futures = [
+            executor.submit(run_fendl_queue_worker, queue_path, run_id, lease_time,
+                            tasks, njoyvers, fendlvers, cdate)
+            for _ in range(njobs)
+        ]
+        for fut in futures:
+            fut.result()
+    with WorkQueue(queue_path, run_id, lease_time) as queue:
+        report = queue.get_report()
+    print_fendl_queue_report(report)
+    return report
+
+
+def plan_fendl_task(task, njoyvers, fendlvers, cdate):
+    """Return a plan entry of a task without modifying any file."""
+    fendl_paths = task['fendl_paths']
+    entry = {
+        'sublib': task['sublib'],
+        'endf_file': task['endf_file'],
+        'reprocess': True,
+        'reasons': [],
+        'estimated_cost': task['cost'],
+        'predicted_runtime': round(task['predicted_runtime'], 1),
+    }
+    missing = [k for k, f in fendl_paths['inputs'].items()
+               if not os.path.isfile(f)]
+    if missing:
+        entry['reasons'] = [f'missing_input:{k}' for k in missing]
+        return entry
+    njoyinp = fendl_paths['inputs']['njoyinp']
+    lines = get_updated_njoy_input(njoyinp, njoyvers, fendlvers, cdate)
+    input_hashes = {'njoyinp': get_njoy_input_hash(lines)}
+    reasons = get_reprocess_reasons(fendl_paths, input_hashes)
+    entry['reprocess'] = len(reasons) > 0
+    entry['reasons'] = reasons
+    return entry
+
+
+def plan_fendl_tasks(tasks, njobs, njoyvers, fendlvers, cdate, verified=None):
+    """Return a build plan for the tasks evaluated in a process pool.
+
+    `verified` are the tasks of sublibraries known to be up-to-date by
+    sublibrary (see `get_verified_sublibs`). They are not evaluated but
+    counted in the number of materials and listed by sublibrary.
+    """
+    if verified is None:
+        verified = {}
+    tasks = order_tasks_longest_first(tasks)
+    with ProcessPoolExecutor(max_workers=njobs) as executor:
+        futures = [
+            executor.submit(plan_fendl_task, task, njoyvers, fendlvers, cdate)
+            for task in tasks
+        ]
+        entries = [fut.result() for fut in futures]
+    stale = [e for e in entries if e['reprocess']]
+    plan = {
+        'fendl_version': fendlvers,
+        'njoy_version': njoyvers,
+        'cost_unit': 'bytes',
+        'num_materials': len(entries) + sum(len(t) for t in verified.values()),
+        'num_stale': len(stale),
+        'trackdb_root': get_trackdb_root(),
+        'verified_sublibs': {sublib: len(t) for sublib, t in verified.items()},
+        'total_estimated_cost': sum(e['estimated_cost'] for e in stale),
+        'total_predicted_runtime': round(sum(e['predicted_runtime'] for e in stale), 1),
+        'materials': entries,
+    }
+    return plan
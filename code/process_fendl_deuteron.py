@@ -17,14 +17,15 @@
 #
 ############################################################
 
-import subprocess
-import tempfile
-import shutil
 import os
 
 from construct_xsd_file import write_xsd_file
+from pendf_checkpoint import run_njoy_checkpointed
+from stage_timing import timed_stage
 from process_fendl_base import (
+    get_fendl_material_name,
     process_fendl_sublib,
+    collect_fendl_sublib_tasks,
     get_njoy_version,
     get_fendl_version,
     get_creation_date
@@ -35,24 +36,17 @@ def run_fendl_njoy(pardic):
     """Invoke NJOY for ENDF files in FENDL library."""
     inputs = pardic['inputs']
     outputs = pardic['outputs']
-    tmpdir = tempfile.TemporaryDirectory()
-    shutil.copy(inputs['d_endf'], os.path.join(tmpdir.name, 'tape20'))
-    shutil.copy(inputs['njoyinp'], os.path.join(tmpdir.name, 'input'))
-
-    njoyinp = open(os.path.join(tmpdir.name, 'input'))
-    ret = subprocess.run([inputs['njoyexe']], stdin=njoyinp,
-                         text=True, cwd = tmpdir.name)
-    njoyinp.close()
-    ret.check_returncode()
-
-    shutil.copy(os.path.join(tmpdir.name, 'tape29'), outputs['ace'])
-    write_xsd_file(outputs['ace'], outputs['xsd'])
-    shutil.copy(os.path.join(tmpdir.name, 'tape35'), outputs['aceplot'])
-    shutil.copy(os.path.join(tmpdir.name, 'output'), outputs['njoyout'])
-    tmpdir.cleanup()
-
-    ret = subprocess.run(['ps2pdf', outputs['aceplot'], outputs['aceplotpdf']])
-    ret.check_returncode()
+    input_tapes = {'tape20': inputs['d_endf']}
+    output_tapes = {
+        'tape29': outputs['ace'],
+        'tape35': outputs['aceplot'],
+        'output': outputs['njoyout'],
+    }
+    with timed_stage('run_fendl_njoy', get_fendl_material_name(pardic)):
+        run_njoy_checkpointed(inputs['njoyexe'], inputs['njoyinp'], input_tapes,
+                              output_tapes, [inputs['njoylib']])
+        with timed_stage('write_xsd'):
+            write_xsd_file(outputs['ace'], outputs['xsd'])
     return
 
 
@@ -100,6 +94,14 @@ def process_fendl_deuteron_lib(
                          njoyvers, fendlvers, cdate, endf_file=endf_file)
 
 
+def get_fendl_deuteron_tasks(repodir, njoyexe, njoylib, endf_file=None):
+    """Return processing tasks for the deuteron ENDF files in FENDL library."""
+    endf_sublib = os.path.join('fendl-endf', 'general-purpose/deuteron')
+    return collect_fendl_sublib_tasks(repodir, 'deuteron', endf_sublib,
+                                      run_fendl_njoy, determine_fendl_paths,
+                                      njoyexe, njoylib, endf_file=endf_file)
+
+
 if __name__ == '__main__':
     njoyvers = get_njoy_version('/opt/NJOY2016')
     fendlvers = get_fendl_version()
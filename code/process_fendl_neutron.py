@@ -17,14 +17,15 @@
 #
 ############################################################
 
-import subprocess
-import tempfile
-import shutil
 import os
 
 from construct_xsd_file import write_xsd_file
+from pendf_checkpoint import run_njoy_checkpointed
+from stage_timing import timed_stage
 from process_fendl_base import (
+    get_fendl_material_name,
     process_fendl_sublib,
+    collect_fendl_sublib_tasks,
     get_njoy_version,
     get_fendl_version,
     get_creation_date,
@@ -35,31 +36,22 @@ def run_fendl_njoy(pardic):
     """Invoke NJOY for ENDF files in FENDL library."""
     inputs = pardic['inputs']
     outputs = pardic['outputs']
-    tmpdir = tempfile.TemporaryDirectory()
-    shutil.copy(inputs['n_endf'], os.path.join(tmpdir.name, 'tape20'))
-    shutil.copy(inputs['ph_endf'], os.path.join(tmpdir.name, 'tape40'))
-    shutil.copy(inputs['njoyinp'], os.path.join(tmpdir.name, 'input'))
-
-    njoyinp = open(os.path.join(tmpdir.name, 'input'))
-    ret = subprocess.run([inputs['njoyexe']], stdin=njoyinp,
-                         text=True, cwd = tmpdir.name)
-    njoyinp.close()
-    ret.check_returncode()
-
-    shutil.copy(os.path.join(tmpdir.name, 'tape29'), outputs['ace'])
-    write_xsd_file(outputs['ace'], outputs['xsd'])
-    shutil.copy(os.path.join(tmpdir.name, 'tape35'), outputs['aceplot'])
-    shutil.copy(os.path.join(tmpdir.name, 'tape31'), outputs['g'])
-    shutil.copy(os.path.join(tmpdir.name, 'tape32'), outputs['htrplot'])
-    shutil.copy(os.path.join(tmpdir.name, 'tape43'), outputs['gam'])
-    shutil.copy(os.path.join(tmpdir.name, 'tape44'), outputs['m'])
-    shutil.copy(os.path.join(tmpdir.name, 'output'), outputs['njoyout'])
-    tmpdir.cleanup()
-
-    ret = subprocess.run(['ps2pdf', outputs['aceplot'], outputs['aceplotpdf']])
-    ret.check_returncode()
-    ret = subprocess.run(['ps2pdf', outputs['htrplot'], outputs['htrplotpdf']])
-    ret.check_returncode()
+    input_tapes = {'tape20': inputs['n_endf'], 'tape40': inputs['ph_endf']}
+    output_tapes = {
+        'tape29': outputs['ace'],
+        'tape35': outputs['aceplot'],
+        'tape31': outputs['g'],
+        'tape32': outputs['htrplot'],
+        'tape43': outputs['gam'],
+        'tape44': outputs['m'],
+        'output': outputs['njoyout'],
+    }
+    njoy_files = [inputs['njoylib']]
+    with timed_stage('run_fendl_njoy', get_fendl_material_name(pardic)):
+        run_njoy_checkpointed(inputs['njoyexe'], inputs['njoyinp'], input_tapes,
+                              output_tapes, njoy_files)
+        with timed_stage('write_xsd'):
+            write_xsd_file(outputs['ace'], outputs['xsd'])
     return
 
 
@@ -119,6 +111,14 @@ def process_fendl_neutron_lib(
                          njoyvers, fendlvers, cdate, endf_file=endf_file)
 
 
+def get_fendl_neutron_tasks(repodir, njoyexe, njoylib, endf_file=None):
+    """Return processing tasks for the neutron ENDF files in FENDL library."""
+    endf_sublib = os.path.join('fendl-endf', 'general-purpose/neutron')
+    return collect_fendl_sublib_tasks(repodir, 'neutron', endf_sublib,
+                                      run_fendl_njoy, determine_fendl_paths,
+                                      njoyexe, njoylib, endf_file=endf_file)
+
+
 if __name__ == '__main__':
     njoyvers = get_njoy_version('/opt/NJOY2016')
     fendlvers = get_fendl_version()
@@ -0,0 +1,117 @@
+############################################################
+#
+# Progress output of sublibrary runs. After each finished
+# material, the throughput in materials per hour, the
+# predicted remaining time and the material on the critical
+# path, i.e. the one with the longest predicted remaining
+# runtime, are printed. The predictions of the runtime
+# model are rescaled by the ratio of the observed to the
+# predicted runtimes of the materials processed so far.
+# As materials found up-to-date take no time, the pending
+# materials are weighted by the fraction of the finished
+# ones that had to be processed.
+#
+############################################################
+
+import os
+import time
+import threading
+
+from trackdb_index import get_trackfile_ids
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f'{seconds}s'
+    if seconds < 3600:
+        return f'{seconds // 60}m{seconds % 60:02d}s'
+    return f'{seconds // 3600}h{seconds % 3600 // 60:02d}m'
+
+
+class ProgressReporter:
+    """Print progress lines with throughput and ETA of a set of tasks."""
+
+    def __init__(self, tasks, njobs=1):
+        self.njobs = njobs
+        self.num_tasks = len(tasks)
+        self._pending = {
+            t['fendl_paths']['trackfile']: t.get('predicted_runtime', 0.0)
+            for t in tasks
+        }
+        self._running = {}
+        self._names = {
+            t['fendl_paths']['trackfile']:
+                '/'.join(get_trackfile_ids(t['fendl_paths']['trackfile']))
+            for t in tasks
+        }
+        self._num_finished = 0
+        self._num_processed = 0
+        self._observed = 0.0
+        self._predicted = 0.0
+        self._start_time = time.time()
+        self._lock = threading.Lock()
+
+    def start(self, task):
+        key = task['fendl_paths']['trackfile']
+        with self._lock:
+            pred = self._pending.pop(key, 0.0)
+            self._running[key] = (time.time(), pred)
+
+    def _get_scale(self):
+        if self._predicted > 0:
+            return self._observed / self._predicted
+        return 1.0
+
+    def _get_stale_fraction(self):
+        # one pseudo-count of a processed material, so that a run of
+        # up-to-date materials does not predict zero remaining time
+        return (self._num_processed + 1) / (self._num_finished + 1)
+
+    def get_status(self):
+        """Return the throughput, remaining time and critical path."""
+        now = time.time()
+        scale = self._get_scale()
+        pending_scale = scale * self._get_stale_fraction()
+        remaining = {
+            key: max(pred * scale - (now - start), 0.0)
+            for key, (start, pred) in self._running.items()
+        }
+        remaining.update(
+            (key, pred * pending_scale) for key, pred in self._pending.items()
+        )
+        elapsed = now - self._start_time
+        rate = self._num_finished / elapsed * 3600 if elapsed > 0 else 0.0
+        status = {'rate': rate, 'eta': 0.0, 'critical': None, 'critical_time': 0.0}
+        if remaining:
+            critical = max(remaining, key=remaining.get)
+            status['critical'] = self._names[critical]
+            status['critical_time'] = remaining[critical]
+            # tasks are independent, so the longest one bounds the ETA
+            status['eta'] = max(sum(remaining.values()) / self.njobs,
+                                remaining[critical])
+        return status
+
+    def finish(self, result, task):
+        """Record a finished task and print a progress line."""
+        key = task['fendl_paths']['trackfile']
+        with self._lock:
+            # the prediction is dropped whatever the status, also for
+            # tasks finished without being started, e.g. locked ones
+            pred = self._pending.pop(key, 0.0)
+            _, pred = self._running.pop(key, (None, pred))
+            self._num_finished += 1
+            if result['status'] == 'processed':
+                self._num_processed += 1
+                if pred > 0:
+                    self._observed += result['duration']
+                    self._predicted += pred
+            status = self.get_status()
+            fname = os.path.basename(result['endf_file'])
+            line = (f'[{self._num_finished}/{self.num_tasks}] {result["status"]}: '
+                    f'{result["sublib"]} {fname} ({result["duration"]:.1f}s) | '
+                    f'{status["rate"]:.1f} mat/h')
+            if status['critical'] is not None:
+                line += (f', ETA {format_duration(status["eta"])}, critical: '
+                         f'{status["critical"]} ({format_duration(status["critical_time"])})')
+            print(line, flush=True)
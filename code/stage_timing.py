@@ -0,0 +1,245 @@
+############################################################
+#
+# Timing of the processing stages of the FENDL materials.
+# Stages are nested context managers that record their
+# duration, the bytes read and written by the calling
+# thread and its child processes and the peak resident
+# memory of the child processes. The events are appended
+# as JSON lines to the file given by the environment
+# variable FENDL_TIMING_LOG, the recording is disabled if
+# it is not set. The log can be converted to the Chrome
+# trace format (chrome://tracing, Perfetto) and summarized.
+#
+# Usage:
+#     python stage_timing.py summary <log> [<num>]
+#     python stage_timing.py trace <log> <trace_json>
+#
+#     <num> is the number of slowest materials shown
+#     (default: 10).
+#
+############################################################
+
+import os
+import sys
+import json
+import time
+import threading
+import subprocess
+from contextlib import contextmanager
+
+
+TIMING_LOG_ENV = 'FENDL_TIMING_LOG'
+# the block counts of child processes are given in units of 512 bytes
+RUSAGE_BLOCK_SIZE = 512
+
+_stages = threading.local()
+
+
+def get_timing_log_path():
+    """Return the path of the timing log or None if disabled."""
+    path = os.environ.get(TIMING_LOG_ENV, '')
+    return path if path else None
+
+
+def _get_stage_stack():
+    stack = getattr(_stages, 'stack', None)
+    if stack is None:
+        stack = []
+        _stages.stack = stack
+    return stack
+
+
+def _get_thread_io():
+    """Return the bytes read and written by the calling thread."""
+    try:
+        with open('/proc/thread-self/io', 'r') as f:
+            fields = dict(line.split(':') for line in f)
+    except OSError:
+        return (0, 0)
+    return (int(fields['rchar']), int(fields['wchar']))
+
+
+def _write_event(path, event):
+    line = json.dumps(event) + '\n'
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line.encode())
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def timed_stage(name, material=None):
+    """Record the duration and resource usage of a stage.
+
+    The material is inherited from the enclosing stage of the
+    same thread if not given.
+    """
+    path = get_timing_log_path()
+    if path is None:
+        yield
+        return
+    stack = _get_stage_stack()
+    if material is None and stack:
+        material = stack[-1]['material']
+    frame = {
+        'material': material,
+        'child_read': 0,
+        'child_written': 0,
+        'child_maxrss': None,
+    }
+    stack.append(frame)
+    start = time.time()
+    start_counter = time.perf_counter()
+    start_io = _get_thread_io()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start_counter
+        end_io = _get_thread_io()
+        stack.pop()
+        event = {
+            'name': name,
+            'material': material,
+            'start': start,
+            'duration': duration,
+            'depth': len(stack),
+            'pid': os.getpid(),
+            'tid': threading.get_native_id(),
+            'read_bytes': end_io[0] - start_io[0] + frame['child_read'],
+            'written_bytes': end_io[1] - start_io[1] + frame['child_written'],
+            'child_maxrss_kb': frame['child_maxrss'],
+        }
+        _write_event(path, event)
+
+
+def record_child_usage(rusage):
+    """Add the resource usage of a child process to the open stages."""
+    for frame in _get_stage_stack():
+        frame['child_read'] += rusage.ru_inblock * RUSAGE_BLOCK_SIZE
+        frame['child_written'] += rusage.ru_oublock * RUSAGE_BLOCK_SIZE
+        if frame['child_maxrss'] is None or rusage.ru_maxrss > frame['child_maxrss']:
+            frame['child_maxrss'] = rusage.ru_maxrss
+
+
+def run_child_process(args, **kwargs):
+    """Run a child process like `subprocess.run` and record its usage.
+
+    The process is run in a stage named after the executable.
+    The resource usage is available as `rusage` attribute of
+    the returned CompletedProcess.
+    """
+    with timed_stage(os.path.basename(args[0])):
+        proc = subprocess.Popen(args, **kwargs)
+        try:
+            _, status, rusage = os.wait4(proc.pid, 0)
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        record_child_usage(rusage)
+    completed = subprocess.CompletedProcess(args, proc.returncode)
+    completed.rusage = rusage
+    return completed
+
+
+def read_timing_log(path):
+    events = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                events.append(json.loads(line))
+    return events
+
+
+def export_chrome_trace(logfile, tracefile):
+    """Convert a timing log to a file in the Chrome trace format."""
+    events = read_timing_log(logfile)
+    trace_events = []
+    for ev in events:
+        trace_events.append({
+            'name': ev['name'],
+            'cat': ev['material'] or 'run',
+            'ph': 'X',
+            'ts': ev['start'] * 1e6,
+            'dur': ev['duration'] * 1e6,
+            'pid': ev['pid'],
+            'tid': ev['tid'],
+            'args': {
+                'material': ev['material'],
+                'read_bytes': ev['read_bytes'],
+                'written_bytes': ev['written_bytes'],
+                'child_maxrss_kb': ev['child_maxrss_kb'],
+            },
+        })
+    with open(tracefile, 'w') as f:
+        json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f)
+
+
+def summarize_timing_log(events, num=10):
+    """Return the statistics of the stages and the slowest materials.
+
+    The time of a material is the sum of its outermost stages.
+    """
+    stages = {}
+    materials = {}
+    for ev in events:
+        st = stages.setdefault(ev['name'], {
+            'name': ev['name'], 'count': 0, 'total': 0.0, 'max': 0.0,
+            'read_bytes': 0, 'written_bytes': 0, 'child_maxrss_kb': None,
+        })
+        st['count'] += 1
+        st['total'] += ev['duration']
+        st['max'] = max(st['max'], ev['duration'])
+        st['read_bytes'] += ev['read_bytes']
+        st['written_bytes'] += ev['written_bytes']
+        if ev['child_maxrss_kb'] is not None:
+            st['child_maxrss_kb'] = max(st['child_maxrss_kb'] or 0, ev['child_maxrss_kb'])
+        material = ev['material']
+        if material is None:
+            continue
+        mat = materials.setdefault(material, {
+            'material': material, 'total': 0.0, 'slowest_stage': None,
+            'slowest_duration': 0.0,
+        })
+        if ev['depth'] == 0:
+            mat['total'] += ev['duration']
+        elif ev['duration'] > mat['slowest_duration']:
+            mat['slowest_stage'] = ev['name']
+            mat['slowest_duration'] = ev['duration']
+    stage_list = sorted(stages.values(), key=lambda s: s['total'], reverse=True)
+    material_list = sorted(materials.values(), key=lambda m: m['total'], reverse=True)
+    return {'stages': stage_list, 'materials': material_list[:num]}
+
+
+def print_timing_summary(summary):
+    print('--- stages ---')
+    print(f'{"stage":<24} {"count":>6} {"total/s":>10} {"mean/s":>9} '
+          f'{"max/s":>9} {"read/MB":>9} {"written/MB":>10} {"maxrss/MB":>10}')
+    for st in summary['stages']:
+        maxrss = st['child_maxrss_kb']
+        maxrss_str = f'{maxrss / 1024:.1f}' if maxrss is not None else '-'
+        print(f'{st["name"]:<24} {st["count"]:>6} {st["total"]:>10.2f} '
+              f'{st["total"] / st["count"]:>9.3f} {st["max"]:>9.3f} '
+              f'{st["read_bytes"] / 1024**2:>9.1f} '
+              f'{st["written_bytes"] / 1024**2:>10.1f} {maxrss_str:>10}')
+    print('--- slowest materials ---')
+    for mat in summary['materials']:
+        slowest = mat['slowest_stage'] or '-'
+        print(f'{mat["material"]:<28} {mat["total"]:>10.2f}s  '
+              f'slowest stage: {slowest} ({mat["slowest_duration"]:.2f}s)')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] not in ('summary', 'trace'):
+        print('usage: python stage_timing.py summary <log> [<num>]')
+        print('       python stage_timing.py trace <log> <trace_json>')
+        sys.exit(2)
+    if sys.argv[1] == 'summary':
+        num = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+        summary = summarize_timing_log(read_timing_log(sys.argv[2]), num)
+        print_timing_summary(summary)
+    else:
+        export_chrome_trace(sys.argv[2], sys.argv[3])
@@ -0,0 +1,225 @@
+############################################################
+#
+# Staging of NJOY tapes in a scratch directory. Input
+# tapes are symlinked instead of copied and output tapes
+# are moved to their destination, falling back to a copy
+# only if the scratch directory is on another filesystem.
+#
+# The scratch directory is taken from the environment
+# variable FENDL_SCRATCH_DIR (default .cache/scratch).
+# It can point to a tmpfs such as /dev/shm. If there is
+# not enough free space, the default location is used.
+#
+# Outputs are moved into the repository inside the output
+# fence of the thread (see set_output_fence), e.g. the lease
+# of a work queue item, so that a task which has lost its
+# right to write does not overwrite the outputs of another.
+#
+############################################################
+
+import os
+import time
+import errno
+import shutil
+import threading
+import tempfile
+import subprocess
+from contextlib import contextmanager
+
+from output_cache import reflink_file
+from stage_timing import timed_stage
+from njoy_supervisor import (
+    run_njoy_supervised,
+    get_remaining_njoy_time,
+    get_njoy_stall_timeout
+)
+
+
+SCRATCH_DIR_ENV = 'FENDL_SCRATCH_DIR'
+DEFAULT_SCRATCH_DIR = '.cache/scratch'
+# the outputs of NJOY are estimated as this multiple of the input size
+SCRATCH_SPACE_FACTOR = 20
+# a failed run is repeated if less space is left in the scratch directory
+SCRATCH_MIN_FREE = 16 * 1024**2
+
+_njoy_usage = threading.local()
+_output_fence = threading.local()
+
+
+def get_scratch_dir():
+    scratch_dir = os.environ.get(SCRATCH_DIR_ENV, DEFAULT_SCRATCH_DIR)
+    return scratch_dir if scratch_dir else DEFAULT_SCRATCH_DIR
+
+
+def get_required_scratch_space(input_files):
+    """Return an estimate of the scratch space in bytes needed by NJOY."""
+    total = 0
+    for fname in input_files:
+        try:
+            total += os.stat(fname).st_size
+        except OSError:
+            pass
+    return total * SCRATCH_SPACE_FACTOR
+
+
+def has_enough_space(dirname, required):
+    try:
+        return shutil.disk_usage(dirname).free >= required
+    except OSError:
+        return False
+
+
+def choose_scratch_dir(input_files):
+    """Return the scratch directory to use for the given input files.
+
+    The configured directory is returned if it has enough free space
+    for the estimated NJOY tapes, otherwise the default one.
+    """
+    scratch_dir = get_scratch_dir()
+    os.makedirs(scratch_dir, exist_ok=True)
+    if scratch_dir == DEFAULT_SCRATCH_DIR:
+        return scratch_dir
+    required = get_required_scratch_space(input_files)
+    if has_enough_space(scratch_dir, required):
+        return scratch_dir
+    os.makedirs(DEFAULT_SCRATCH_DIR, exist_ok=True)
+    return DEFAULT_SCRATCH_DIR
+
+
+def stage_input_file(src, dst):
+    """Make `src` available as `dst` by a symbolic link."""
+    os.symlink(os.path.abspath(src), dst)
+
+
+def copy_input_file(src, dst):
+    """Make a private copy of `src` at `dst`, by reflink if possible."""
+    try:
+        reflink_file(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def collect_output_file(src, dst):
+    """Move `src` to `dst`, copying only across filesystems.
+
+    Return the method used: `move`, `reflink` or `copy`.
+    """
+    try:
+        os.replace(src, dst)
+        return 'move'
+    except OSError as exc:
+        if exc.errno != errno.EXDEV:
+            raise
+    tmpdst = dst + '.tmp'
+    try:
+        try:
+            reflink_file(src, tmpdst)
+            method = 'reflink'
+        except OSError:
+            shutil.copyfile(src, tmpdst)
+            method = 'copy'
+        os.replace(tmpdst, dst)
+    finally:
+        if os.path.exists(tmpdst):
+            os.unlink(tmpdst)
+    os.unlink(src)
+    return method
+
+
+def set_output_fence(fence):
+    """Guard the writes of outputs to the repository by this thread.
+
+    `fence` is called without arguments and returns a context manager
+    which is active while outputs are written. It raises an exception
+    if the task must not modify them, e.g. because the lease of its
+    work queue item has been lost. None removes the fence.
+    """
+    _output_fence.fence = fence
+    _output_fence.depth = 0
+
+
+@contextmanager
+def output_fence():
+    """Enter the output fence of the thread if there is one.
+
+    Nested uses enter the fence only once.
+    """
+    fence = getattr(_output_fence, 'fence', None)
+    if fence is None or _output_fence.depth > 0:
+        yield
+        return
+    with fence():
+        _output_fence.depth += 1
+        try:
+            yield
+        finally:
+            _output_fence.depth -= 1
+
+
+def reset_njoy_usage():
+    """Start recording the resource usage of the NJOY runs of this thread."""
+    _njoy_usage.maxrss_kb = 0
+    _njoy_usage.wall_time = 0.0
+    _njoy_usage.num_runs = 0
+
+
+def get_njoy_usage():
+    """Return the peak RSS and total wall time of the recorded NJOY runs.
+
+    None is returned if NJOY has not been run since `reset_njoy_usage`.
+    """
+    if not getattr(_njoy_usage, 'num_runs', 0):
+        return None
+    return {
+        'maxrss_kb': _njoy_usage.maxrss_kb,
+        'wall_time': _njoy_usage.wall_time,
+        'num_runs': _njoy_usage.num_runs,
+    }
+
+
+def _record_njoy_usage(rusage, wall_time):
+    if not hasattr(_njoy_usage, 'num_runs'):
+        reset_njoy_usage()
+    _njoy_usage.maxrss_kb = max(_njoy_usage.maxrss_kb, rusage.ru_maxrss)
+    _njoy_usage.wall_time += wall_time
+    _njoy_usage.num_runs += 1
+
+
+def run_njoy_in_dir(workdir, njoyexe, njoyinp, input_tapes, output_tapes):
+    """Run NJOY in `workdir` with staged inputs and collect the outputs."""
+    with timed_stage('stage_tapes'):
+        for tapename, src in input_tapes.items():
+            stage_input_file(src, os.path.join(workdir, tapename))
+    start = time.perf_counter()
+    with open(njoyinp, 'r') as fin:
+        ret = run_njoy_supervised(
+            [njoyexe], stdin=fin, cwd=workdir, timeout=get_remaining_njoy_time(),
+            stall_timeout=get_njoy_stall_timeout()
+        )
+    ret.check_returncode()
+    _record_njoy_usage(ret.rusage, time.perf_counter() - start)
+    with timed_stage('collect_tapes'), output_fence():
+        for tapename, dst in output_tapes.items():
+            collect_output_file(os.path.join(workdir, tapename), dst)
+
+
+def run_njoy_staged(njoyexe, njoyinp, input_tapes, output_tapes):
+    """Run NJOY in a scratch directory and collect the output tapes.
+
+    `input_tapes` and `output_tapes` map file names in the scratch
+    directory, e.g. `tape20` or `output`, to paths of the repository.
+    If the run fails in a scratch directory other than the default one
+    that has run out of space, it is repeated in the default one.
+    """
+    scratch_dir = choose_scratch_dir(input_tapes.values())
+    with tempfile.TemporaryDirectory(dir=scratch_dir) as workdir:
+        try:
+            run_njoy_in_dir(workdir, njoyexe, njoyinp, input_tapes, output_tapes)
+            return
+        except (subprocess.CalledProcessError, OSError):
+            if (scratch_dir == DEFAULT_SCRATCH_DIR or
+                    has_enough_space(scratch_dir, SCRATCH_MIN_FREE)):
+                raise
+    os.makedirs(DEFAULT_SCRATCH_DIR, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=DEFAULT_SCRATCH_DIR) as workdir:
+        run_njoy_in_dir(workdir, njoyexe, njoyinp, input_tapes, output_tapes)
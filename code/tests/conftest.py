@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+CODE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, CODE_DIR)
+sys.path.insert(0, os.path.join(CODE_DIR, 'benchmark'))
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Run each test in its own directory so that the caches in
+    .cache are not shared between tests."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
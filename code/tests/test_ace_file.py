@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+import ace_file
+from ace_file import open_ace_table
+
+
+NES = 3
+ENERGY = [1e-5, 1.0, 2e7]
+TOTAL = [10.0, 5.0, 2.0]
+ELASTIC = [9.0, 4.5, 1.5]
+MT102_XS = [0.5, 0.25]
+URR_ENERGY = [1e4, 1e5]
+
+
+def make_xss():
+    """Return the XSS array with NXS and JXS of a small ACE table."""
+    xss = list(ENERGY) + TOTAL + [1.0, 0.5, 0.5] + ELASTIC + [0.0] * NES
+    mtr = len(xss) + 1
+    xss += [102]
+    lqr = len(xss) + 1
+    xss += [6.5]
+    lsig = len(xss) + 1
+    xss += [1]
+    sig = len(xss) + 1
+    xss += [2, len(MT102_XS)] + MT102_XS
+    lunr = len(xss) + 1
+    xss += [len(URR_ENERGY), 1, 2, 0, 0, 1] + URR_ENERGY
+    xss += [float(k) for k in range(len(URR_ENERGY) * 6)]
+    nxs = [len(xss), 26056, NES, 1] + [0] * 12
+    jxs = [0] * 32
+    jxs[0], jxs[2], jxs[3], jxs[5], jxs[6], jxs[22] = 1, mtr, lqr, lsig, sig, lunr
+    return xss, nxs, jxs
+
+
+def write_ace_file(fname, xss, nxs, jxs):
+    with open(fname, 'w') as f:
+        f.write('%10s%12.6f%12.4E %10s\n' % ('26056.80c', 55.454, 2.5301e-8, '01/01/23'))
+        f.write('%-70s%10s\n' % ('26-Fe-56 test', 'mat2631'))
+        for i in range(4):
+            f.write('%7d%11.0f' % (0, 0.) * 4 + '\n')
+        for i in range(2):
+            f.write(''.join('%9d' % v for v in nxs[8*i:8*i+8]) + '\n')
+        for i in range(4):
+            f.write(''.join('%9d' % v for v in jxs[8*i:8*i+8]) + '\n')
+        for i in range(0, len(xss), 4):
+            f.write(''.join('%20.11E' % v for v in xss[i:i+4]) + '\n')
+
+
+@pytest.fixture
+def acefile(workdir):
+    fname = str(workdir / '26Fe056.ace')
+    write_ace_file(fname, *make_xss())
+    return fname
+
+
+def test_header(acefile):
+    with open_ace_table(acefile) as ace:
+        assert ace.zaid == '26056.80c'
+        assert ace.awr == pytest.approx(55.454)
+        assert ace.date == '01/01/23'
+        assert ace.comment == '26-Fe-56 test'
+        assert ace.mat == 'mat2631'
+
+
+def test_xss_across_blocks(acefile, monkeypatch):
+    monkeypatch.setattr(ace_file, 'XSS_BLOCK_LINES', 2)
+    xss = make_xss()[0]
+    with open_ace_table(acefile) as ace:
+        np.testing.assert_allclose(ace.xss, xss)
+        np.testing.assert_allclose(ace.get_xss(7, 5), xss[6:11])
+        with pytest.raises(IndexError):
+            ace.get_xss(len(xss), 2)
+
+
+def test_reactions(acefile):
+    with open_ace_table(acefile) as ace:
+        assert list(ace.reactions) == [1, 2, 102]
+        np.testing.assert_allclose(ace.get_reaction(1)['xs'], TOTAL)
+        np.testing.assert_allclose(ace.get_reaction(2)['xs'], ELASTIC)
+        capture = ace.get_reaction(102)
+        assert capture['q'] == 6.5
+        np.testing.assert_allclose(capture['energy'], ENERGY[1:])
+        np.testing.assert_allclose(capture['xs'], MT102_XS)
+
+
+def test_urr_ptable(acefile):
+    with open_ace_table(acefile) as ace:
+        ptable = ace.urr_ptable
+    assert ptable['interpolation'] == 2
+    assert ptable['factors_flag'] == 1
+    np.testing.assert_allclose(ptable['energy'], URR_ENERGY)
+    assert ptable['total'].shape == (len(URR_ENERGY), 1)
+    np.testing.assert_allclose(ptable['total'][:, 0], [1.0, 7.0])
+
+
+def test_truncated_file(workdir):
+    fname = str(workdir / 'short.ace')
+    with open(fname, 'w') as f:
+        f.write('26056.80c 55.454\n')
+    with pytest.raises(ValueError):
+        open_ace_table(fname)
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from gendf_file import iter_endf_sections, read_gendf, get_gendf_section
+
+
+MAT = 2631
+ZA = 26056.0
+AWR = 55.454
+EGN = [1e-5, 1.0, 2e7]
+SIGZ = [1e10]
+
+
+def endf_field(value):
+    """Format a number as NJOY does in ENDF files, e.g. 1.000000+0."""
+    if isinstance(value, int):
+        return str(value).rjust(11)
+    mantissa, exponent = f'{value:.6E}'.split('E')
+    return f'{mantissa}{int(exponent):+d}'.rjust(11)
+
+
+def endf_lines(values, mat, mf, mt):
+    lines = []
+    for i in range(0, len(values), 6):
+        fields = ''.join(endf_field(v) for v in values[i:i+6])
+        lines.append(f'{fields:<66}{mat:4d}{mf:2d}{mt:3d}{len(lines)+1:5d}\n')
+    return lines
+
+
+def gendf_material(temperature, xs):
+    """Return the lines of MF1/MT451 and MF3/MT1 of a material."""
+    ngn = len(EGN) - 1
+    lines = endf_lines([ZA, AWR, 0, len(SIGZ), -1, 0], MAT, 1, 451)
+    info = SIGZ + EGN + [0.0, 0.0]
+    lines += endf_lines([temperature, 0.0, ngn, 0, len(info), 0] + info, MAT, 1, 451)
+    lines += endf_lines([0] * 6, MAT, 1, 0)
+    lines += endf_lines([ZA, AWR, 1, len(SIGZ), 0, ngn], MAT, 3, 1)
+    for ig, sigma in enumerate(xs, start=1):
+        # flux and cross section of each group
+        lines += endf_lines([temperature, 0.0, 2, 0, 2, ig, 1.0, sigma], MAT, 3, 1)
+    lines += endf_lines([0] * 6, MAT, 3, 0)
+    lines += endf_lines([0] * 6, 0, 0, 0)
+    return lines
+
+
+@pytest.fixture
+def gendffile(workdir):
+    fname = str(workdir / '26Fe056.g')
+    with open(fname, 'w') as f:
+        f.write(' ' * 66 + '   1 0  0    0\n')
+        f.writelines(gendf_material(293.6, [3.0, 2.0]))
+        f.writelines(gendf_material(600.0, [4.0, 1.0]))
+        f.writelines(endf_lines([0] * 6, -1, 0, 0))
+    return fname
+
+
+def test_iter_endf_sections(gendffile):
+    keys = [s[:3] for s in iter_endf_sections(gendffile)]
+    assert keys == [(MAT, 1, 451), (MAT, 3, 1)] * 2
+
+
+def test_read_gendf(gendffile):
+    materials = read_gendf(gendffile)
+    assert [m['temperature'] for m in materials] == [293.6, 600.0]
+    info = materials[0]
+    assert info['za'] == ZA
+    np.testing.assert_allclose(info['sigz'], SIGZ)
+    np.testing.assert_allclose(info['egn'], EGN)
+    section = get_gendf_section(materials, MAT, 3, 1, temperature=600.0)
+    assert section['groups'].tolist() == [1, 2]
+    assert section['data'][0].shape == (2, 1, 1)
+    assert [d[1, 0, 0] for d in section['data']] == [4.0, 1.0]
+    with pytest.raises(KeyError):
+        get_gendf_section(materials, MAT, 3, 102)
+
+
+def test_section_without_material(workdir):
+    fname = str(workdir / 'bad.g')
+    with open(fname, 'w') as f:
+        f.write('\n')
+        f.writelines(endf_lines([ZA, AWR, 1, 1, 0, 2], MAT, 3, 1))
+        f.writelines(endf_lines([0] * 6, MAT, 3, 0))
+    with pytest.raises(ValueError):
+        read_gendf(fname)
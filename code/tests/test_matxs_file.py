@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from matxs_file import (
+    read_matxs,
+    get_dense_matrix,
+    export_matxs_npz,
+    load_matxs_npz
+)
+
+
+GROUP_BOUNDS = [2e7, 1e5, 1e-5]
+NWT0 = [0.0, 1.5]
+NELAS = [0.4, 0.3, 0.2]
+
+
+def matxs_floats(values, recid):
+    """Return the lines of a float record, five values in the first line."""
+    fields = []
+    for v in values:
+        mantissa, exponent = f'{v:.5E}'.split('E')
+        fields.append(f'{mantissa}{int(exponent):+d}'.rjust(12))
+    lines = [f' {recid:<3}' + ' ' * 8 + ''.join(fields[:5])]
+    lines += [''.join(fields[i:i+6]) for i in range(5, len(fields), 6)]
+    return lines
+
+
+def matxs_ints(values):
+    return [''.join('%6d' % v for v in values[i:i+12]) for i in range(0, len(values), 12)]
+
+
+def write_matxs_file(fname):
+    ngrp = len(GROUP_BOUNDS) - 1
+    lines = [' 0v matxs    test    file     %6d' % 1]
+    lines.append(' 1d   ' + ''.join('%6d' % v for v in (1, 1, 1, 1, 0, 0)))
+    lines.append(' 2d ' + 'fe56 set')
+    lines.append(' 3d     ' + 'n       nscat   fe56    ')
+    lines += matxs_ints([ngrp, 1, 1, 1])
+    lines += matxs_floats(GROUP_BOUNDS, '4d')
+    lines.append(' 5d     fe56     ' + matxs_floats([55.454], '')[0][12:])
+    lines.append(matxs_floats([293.6, 1e10], '')[0][12:] + '%6d%6d%6d%6d' % (1, 1, 1, 0))
+    lines.append(' 6d     nwt0    ')
+    lines += matxs_ints([1, 2])
+    lines += matxs_floats(NWT0, '7d')
+    lines.append(' 8d     nelas    %6d%6d' % (1, 0))
+    # sink group 1 from source 1, sink group 2 from sources 2 and 1
+    lines += matxs_ints([1, 2, 1, 2])
+    lines += matxs_floats(NELAS, '9d')
+    with open(fname, 'w') as f:
+        f.writelines(line + '\n' for line in lines)
+
+
+@pytest.fixture
+def matxsfile(workdir):
+    fname = str(workdir / '26Fe056.m')
+    write_matxs_file(fname)
+    return fname
+
+
+def check_matxs(matxs):
+    assert matxs['hname'] == 'matxs'
+    assert matxs['particles'] == ['n']
+    assert matxs['types'] == ['nscat']
+    np.testing.assert_allclose(matxs['group_bounds']['n'], GROUP_BOUNDS)
+    material = matxs['materials']['fe56']
+    assert material['amass'] == pytest.approx(55.454)
+    sub = material['submaterials'][0]
+    assert sub['temperature'] == pytest.approx(293.6)
+    np.testing.assert_allclose(sub['vectors']['nwt0'], NWT0)
+    dense = get_dense_matrix(sub['matrices']['nelas'], 2, 2)
+    np.testing.assert_allclose(dense[0], [[0.4, 0.0], [0.2, 0.3]])
+
+
+def test_read_matxs(matxsfile):
+    check_matxs(read_matxs(matxsfile))
+
+
+def test_npz_roundtrip(matxsfile, workdir):
+    npzfile = str(workdir / '26Fe056.npz')
+    export_matxs_npz(read_matxs(matxsfile), npzfile)
+    check_matxs(load_matxs_npz(npzfile))
+
+
+def test_unexpected_record(workdir):
+    fname = str(workdir / 'bad.m')
+    with open(fname, 'w') as f:
+        f.write(' 1d        1     1     1     1     0     0\n')
+    with pytest.raises(ValueError):
+        read_matxs(fname)
@@ -0,0 +1,124 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from fake_njoy import write_listing
+from file_hashing import stream_filehash
+from njoy_file_manipulation import (
+    NjoyInput,
+    normalize_njoy_outfile,
+    get_moder_comment,
+    set_moder_comment,
+    get_reconr_comments1,
+    set_reconr_comments1,
+    get_reconr_comments2,
+    set_reconr_comments2,
+    get_ace_comment,
+    set_ace_comment,
+    get_g_comment,
+    set_g_comment,
+    get_gam_comment_line_idx,
+    get_gam_comment,
+    set_gam_comment,
+    get_m_comment,
+    set_m_comment,
+    get_m_long_comments,
+    set_m_long_comments
+)
+from process_fendl_base import update_njoy_inputfile
+from run_benchmarks import NEUTRON_DECK
+
+
+CDATE = datetime(2024, 2, 3, 4, 5, 6)
+MODULES = [('moder', [1, -21]), ('reconr', [-21, -22]), ('acer', [-21, -22, 0, 27])]
+
+
+def test_normalize_njoy_outfile(workdir):
+    listing = str(workdir / 'output')
+    write_listing(listing, MODULES)
+    module_timings = []
+    digest = normalize_njoy_outfile(listing, CDATE, module_timings=module_timings)
+    assert digest == stream_filehash(listing)
+    with open(listing) as f:
+        content = f.read()
+    assert 'date: 02/03/24' in content
+    assert 'time: 04:05:06' in content
+    # the date is repeated once below the header of each run
+    assert content.count('date  02/03/24') == 1
+    assert ' 1.0s' not in content
+    assert [t[0] for t in module_timings] == ['moder', 'reconr', 'acer']
+
+
+def test_normalize_njoy_outfile_is_idempotent(workdir):
+    listing = str(workdir / 'output')
+    write_listing(listing, MODULES)
+    digest = normalize_njoy_outfile(listing, CDATE)
+    assert normalize_njoy_outfile(listing, CDATE) == digest
+
+
+def get_deck():
+    return NjoyInput(NEUTRON_DECK.format(mat=2631, z=26).splitlines())
+
+
+def test_njoy_input_tracks_module_cards():
+    lines = get_deck()
+    acer_indices = lines.get_module_card_indices('acer')
+    assert len(acer_indices) == 2
+    assert [m[0] for m in lines.get_modules()][:3] == ['moder', 'reconr', 'broadr']
+    assert lines.get_modules()[0][2] == [1, -21]
+    lines[acer_indices[1]] = 'viewr'
+    assert lines.get_module_card_indices('acer') == acer_indices[:1]
+    assert lines.get_module_card_indices('viewr') == acer_indices[1:]
+    with pytest.raises(TypeError):
+        lines[0:2] = ['stop', 'stop']
+
+
+def test_comment_edits_match_plain_lists():
+    # the module card index must find the same lines as a full scan
+    indexed = get_deck()
+    plain = list(indexed)
+    for lines in (indexed, plain):
+        set_moder_comment(lines, '26-Fe-56 FENDL')
+        set_reconr_comments1(lines, ['PENDF', '26-Fe-56', 'NJOY'])
+        set_reconr_comments2(lines, ['photo', '26-Fe-56', 'NJOY'])
+        set_ace_comment(lines, 'ace comment')
+        set_g_comment(lines, 'g comment')
+        set_gam_comment(lines, 'gam comment')
+        set_m_comment(lines, 'fe56')
+        set_m_long_comments(lines, ['long', 'Photo-atomic data', 'NJOY'])
+    assert list(indexed) == plain
+    assert get_moder_comment(indexed) == '26-Fe-56 FENDL'
+    assert get_reconr_comments1(indexed) == ['PENDF', '26-Fe-56', 'NJOY']
+    assert get_reconr_comments2(indexed) == ['photo', '26-Fe-56', 'NJOY']
+    assert get_ace_comment(indexed) == 'ace comment'
+    assert get_g_comment(indexed) == 'g comment'
+    assert get_gam_comment(indexed) == 'gam comment'
+    assert get_m_comment(indexed) == 'fe56'
+    assert get_m_long_comments(indexed) == ['long', 'Photo-atomic data', 'NJOY']
+
+
+def test_comment_edits_reject_unexpected_input():
+    lines = get_deck()
+    with pytest.raises(ValueError):
+        set_m_long_comments(lines, ['long', 'Neutron data', 'NJOY'])
+    with pytest.raises(IndexError):
+        set_reconr_comments1(lines, ['PENDF'])
+    del lines[lines.get_module_card_indices('gaminr')[0]:]
+    with pytest.raises(IndexError):
+        get_gam_comment_line_idx(lines)
+
+
+def test_update_njoy_inputfile(workdir):
+    njoyinp = workdir / 'neutron' / 'n_njoy' / '26fe56.nji'
+    njoyinp.parent.mkdir(parents=True)
+    njoyinp.write_text(get_deck().serialize())
+    assert update_njoy_inputfile(str(njoyinp), '2016.74NDS', 'FENDL-3.2c', CDATE)
+    lines = NjoyInput.read(str(njoyinp))
+    assert get_ace_comment(lines) == '26-Fe-56 FENDL-3.2c (NJOY2016.74NDS)'
+    assert get_m_comment(lines) == '        fe56    '
+    assert get_moder_comment(lines) == '26-Fe-56 FENDL-3.2c'
+    # an up-to-date file is not rewritten
+    mtime = os.stat(njoyinp).st_mtime_ns
+    assert not update_njoy_inputfile(str(njoyinp), '2016.74NDS', 'FENDL-3.2c', CDATE)
+    assert os.stat(njoyinp).st_mtime_ns == mtime
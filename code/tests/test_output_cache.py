@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+from output_cache import (
+    get_output_cache_key,
+    restore_cached_outputs,
+    store_outputs_in_cache,
+    evict_output_cache_entries,
+    pinned_cache_entry
+)
+
+
+def make_outputs(workdir, names=('ace', 'xsd')):
+    outputs = {}
+    for k in names:
+        outputs[k] = str(workdir / 'out' / k)
+        os.makedirs(os.path.dirname(outputs[k]), exist_ok=True)
+        with open(outputs[k], 'w') as f:
+            f.write(f'content of {k}\n')
+    return outputs
+
+
+def store_entry(workdir, key, cachedir):
+    outputs = make_outputs(workdir)
+    hashes = {k: 'hash-' + k for k in outputs}
+    store_outputs_in_cache(key, outputs, hashes, cachedir)
+    for f in outputs.values():
+        os.unlink(f)
+    return outputs, hashes
+
+
+def test_cache_key():
+    outputs = {'ace': 'ace/26Fe056', 'xsd': 'ace/26Fe056.xsd'}
+    key = get_output_cache_key({'endf': 'a'}, outputs)
+    assert get_output_cache_key({'endf': 'a'}, outputs) == key
+    assert get_output_cache_key({'endf': 'b'}, outputs) != key
+    assert get_output_cache_key({'endf': 'a'}, outputs, {'pdf_engine': 'x'}) != key
+    # the xsd file contains the name of the ACE file
+    renamed = {'ace': 'ace/26Fe056m', 'xsd': 'ace/26Fe056m.xsd'}
+    assert get_output_cache_key({'endf': 'a'}, renamed) != key
+
+
+def test_restore_cached_outputs(workdir):
+    cachedir = str(workdir / 'cache')
+    outputs, hashes = store_entry(workdir, 'ab' * 32, cachedir)
+    assert restore_cached_outputs('cd' * 32, outputs, cachedir) is None
+    assert restore_cached_outputs('ab' * 32, outputs, cachedir) == hashes
+    with open(outputs['xsd']) as f:
+        assert f.read() == 'content of xsd\n'
+
+
+def test_failed_restore_removes_outputs(workdir):
+    cachedir = str(workdir / 'cache')
+    key = 'ab' * 32
+    outputs, _ = store_entry(workdir, key, cachedir)
+    os.unlink(os.path.join(cachedir, key[:2], key, 'xsd'))
+    with pytest.raises(FileNotFoundError):
+        restore_cached_outputs(key, outputs, cachedir)
+    assert not any(os.path.lexists(f) for f in outputs.values())
+
+
+def test_pinned_entry_is_not_evicted(workdir):
+    cachedir = str(workdir / 'cache')
+    store_entry(workdir, 'ab' * 32, cachedir)
+    store_entry(workdir, 'cd' * 32, cachedir)
+    with pinned_cache_entry('ab' * 32, cachedir):
+        assert evict_output_cache_entries(0, cachedir) == ['cd' * 32]
+    assert evict_output_cache_entries(0, cachedir) == ['ab' * 32]
+    assert not os.path.exists(os.path.join(cachedir, 'ab', 'ab' * 32))
@@ -0,0 +1,51 @@
+import re
+from datetime import datetime
+
+import pytest
+
+from pdf_manipulation import (
+    normalize_pdf_trailer_ids,
+    normalize_pdf_inprocess,
+    _get_pdf_xref_table,
+    _parse_pdf_xref_entries
+)
+from run_benchmarks import write_pdf_file
+
+
+CDATE = datetime(2024, 2, 3, 4, 5, 6)
+
+
+def read_pdf(workdir):
+    fname = str(workdir / 'plot.pdf')
+    write_pdf_file(fname, 2000)
+    with open(fname, 'rb') as f:
+        return f.read()
+
+
+def get_trailer_ids(data):
+    return re.findall(rb'/ID \[<([0-9A-Fa-f]{32})><([0-9A-Fa-f]{32})>\]', data)
+
+
+def test_trailer_ids_upper_case(workdir):
+    data = read_pdf(workdir)
+    lower = normalize_pdf_trailer_ids(data)
+    upper = normalize_pdf_trailer_ids(data.replace(b'a' * 32, b'A' * 32))
+    assert get_trailer_ids(upper) == get_trailer_ids(lower)
+    assert normalize_pdf_trailer_ids(lower) == lower
+
+
+def test_normalize_pdf_inprocess(workdir):
+    data = normalize_pdf_inprocess(read_pdf(workdir), CDATE)
+    assert b'D:20240506070809' not in data
+    assert b'2024-05-06T07:08:09' not in data
+    assert b'uuid:0a1b2c3d</xmpMM:DocumentID>' not in data
+    assert normalize_pdf_inprocess(data, CDATE) == data
+    xref_start, trailer_start = _get_pdf_xref_table(data)
+    for objnum, offset, _, kind in _parse_pdf_xref_entries(data[xref_start:trailer_start]):
+        if kind == b'n':
+            assert data[offset:].startswith(b'%d 0 obj' % objnum)
+
+
+def test_normalize_pdf_inprocess_unsupported():
+    with pytest.raises(ValueError):
+        normalize_pdf_inprocess(b'%PDF-1.5\nno xref table\n%%EOF\n')
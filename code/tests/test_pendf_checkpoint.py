@@ -0,0 +1,117 @@
+import os
+import filecmp
+from datetime import datetime
+
+import pytest
+
+from njoy_file_manipulation import NjoyInput, normalize_njoy_outfile
+from pendf_checkpoint import (
+    PENDF_CACHE_ENV,
+    split_njoy_input,
+    get_pendf_checkpoint_key,
+    run_njoy_checkpointed
+)
+from run_benchmarks import NEUTRON_DECK, write_endf_file, write_njoy_wrapper
+
+
+CDATE = datetime(2024, 2, 3, 4, 5, 6)
+
+
+def get_deck(**kwargs):
+    params = {'mat': 2631, 'z': 26}
+    params.update(kwargs)
+    return NjoyInput(NEUTRON_DECK.format(**params).splitlines())
+
+
+def make_input_tapes(workdir, endf_size=2000):
+    input_tapes = {'tape20': workdir / 'n.endf', 'tape30': workdir / 'ph.endf'}
+    write_endf_file(input_tapes['tape20'], 2631, endf_size)
+    write_endf_file(input_tapes['tape30'], 2600, 500)
+    return {k: str(f) for k, f in input_tapes.items()}
+
+
+def test_split_njoy_input():
+    upstream, downstream = split_njoy_input(get_deck())
+    modules = [l for l in upstream if l in ('moder', 'reconr', 'broadr', 'heatr')]
+    assert modules == ['moder', 'reconr', 'broadr', 'heatr']
+    assert upstream[-1] == 'stop'
+    assert downstream[0] == 'acer'
+    assert downstream[-1] == 'stop'
+
+
+def test_split_njoy_input_without_pendf_modules():
+    assert split_njoy_input(['acer', '1 2/', 'stop']) is None
+
+
+def test_key_depends_on_endf_tape(workdir):
+    upstream, _ = split_njoy_input(get_deck())
+    input_tapes = make_input_tapes(workdir)
+    key = get_pendf_checkpoint_key(upstream, input_tapes, [])
+    write_endf_file(input_tapes['tape20'], 2631, 3000)
+    assert get_pendf_checkpoint_key(upstream, input_tapes, []) != key
+
+
+def test_key_depends_on_upstream_cards(workdir):
+    input_tapes = make_input_tapes(workdir)
+    upstream, _ = split_njoy_input(get_deck())
+    key = get_pendf_checkpoint_key(upstream, input_tapes, [])
+    upstream[upstream.index('293.6/')] = '300./'
+    assert get_pendf_checkpoint_key(upstream, input_tapes, []) != key
+
+
+def test_key_ignores_downstream_cards(workdir):
+    input_tapes = make_input_tapes(workdir)
+    deck = get_deck()
+    upstream, _ = split_njoy_input(deck)
+    key = get_pendf_checkpoint_key(upstream, input_tapes, [])
+    deck[deck.index('1 0 1 .80/')] = '1 0 1 .90/'
+    upstream2, _ = split_njoy_input(deck)
+    assert get_pendf_checkpoint_key(upstream2, input_tapes, []) == key
+
+
+OUTPUT_TAPES = ('tape29', 'tape35', 'tape31', 'tape32', 'tape43', 'tape44', 'output')
+
+
+def run_checkpointed(workdir, outdir, deck):
+    njoyexe = str(workdir / 'njoy')
+    write_njoy_wrapper(njoyexe)
+    njoyinp = str(workdir / 'deck.nji')
+    with open(njoyinp, 'w') as f:
+        f.write(deck)
+    input_tapes = make_input_tapes(workdir)
+    os.makedirs(outdir, exist_ok=True)
+    output_tapes = {k: os.path.join(outdir, k) for k in OUTPUT_TAPES}
+    run_njoy_checkpointed(njoyexe, njoyinp, input_tapes, output_tapes)
+    return output_tapes
+
+
+def read_normalized(fname):
+    normalize_njoy_outfile(fname, CDATE)
+    with open(fname, 'rb') as f:
+        return f.read()
+
+
+@pytest.fixture
+def fake_njoy_env(workdir, monkeypatch):
+    monkeypatch.setenv('FAKE_NJOY_DELAY', '0')
+    monkeypatch.setenv('FENDL_SCRATCH_DIR', str(workdir / 'scratch'))
+
+
+def test_checkpointed_run_matches_single_run(workdir, monkeypatch, fake_njoy_env):
+    deck = NEUTRON_DECK.format(mat=2631, z=26)
+    single = run_checkpointed(workdir, str(workdir / 'single'), deck)
+    cachedir = str(workdir / 'pendf')
+    monkeypatch.setenv(PENDF_CACHE_ENV, cachedir)
+    for name in ('miss', 'hit'):
+        outputs = run_checkpointed(workdir, str(workdir / name), deck)
+        assert read_normalized(outputs['output']) == read_normalized(single['output'])
+        for k in OUTPUT_TAPES[:-1]:
+            assert filecmp.cmp(outputs[k], single[k], shallow=False)
+    entries = [os.path.join(d, f) for d, _, files in os.walk(cachedir) for f in files
+               if f.startswith('tape')]
+    assert entries
+    # the outputs are not hardlinked or symlinked to the cache entry
+    cached_inodes = {os.stat(f).st_ino for f in entries}
+    for f in outputs.values():
+        assert not os.path.islink(f)
+        assert os.stat(f).st_ino not in cached_inodes
@@ -0,0 +1,38 @@
+import pytest
+
+from trackdb_index import (
+    TRACKDB_INDEX_ENV,
+    write_trackdb_file,
+    get_library_roots,
+    compute_trackdb_root,
+    compute_trackdb_dir_roots,
+    get_trackdb_root
+)
+
+
+@pytest.fixture(autouse=True)
+def trackdb_index(tmp_path, monkeypatch):
+    monkeypatch.setenv(TRACKDB_INDEX_ENV, str(tmp_path / 'trackdb.sqlite'))
+
+
+def write_record(sublib, material, sha256):
+    trackfile = f'trackdb/trackdb_{sublib}/{material}.json'
+    write_trackdb_file(trackfile, {'outputs': {'ace': sha256}})
+
+
+def test_trackdb_root_covers_all_sublibraries():
+    assert get_trackdb_root() is None
+    write_record('neutron', 'n_026-Fe-56_2631', 'a' * 64)
+    write_record('proton', 'p_026-Fe-56_2631', 'b' * 64)
+    root = get_trackdb_root()
+    assert root == compute_trackdb_root(compute_trackdb_dir_roots())
+
+    write_record('proton', 'p_026-Fe-56_2631', 'c' * 64)
+    assert get_trackdb_root() != root
+    assert get_trackdb_root() == compute_trackdb_root(get_library_roots())
+
+
+def test_trackdb_root_depends_on_sublibrary_names():
+    roots = {'neutron': 'a' * 64, 'proton': 'b' * 64}
+    swapped = {'neutron': 'b' * 64, 'proton': 'a' * 64}
+    assert compute_trackdb_root(roots) != compute_trackdb_root(swapped)
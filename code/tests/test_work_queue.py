@@ -0,0 +1,51 @@
+import time
+import sqlite3
+
+import pytest
+
+from work_queue import WorkQueue
+
+
+def make_queue(workdir, lease_time=600):
+    queue = WorkQueue(str(workdir / 'queue.sqlite'), 'run', lease_time)
+    queue.add_items([('a', 'neutron', 1), ('b', 'neutron', 2)])
+    return queue
+
+
+def test_claim_order_and_keys(workdir):
+    with make_queue(workdir) as queue:
+        assert queue.claim('w1') == ('b', 1)
+        assert queue.claim('w1', keys=['b']) is None
+        assert queue.claim('w1', keys=['a', 'b']) == ('a', 1)
+        assert queue.num_unfinished() == 2
+        assert queue.complete('a', 'w1', 1, 'processed')
+        assert queue.num_unfinished(keys=['a']) == 0
+
+
+def test_expired_lease_is_fenced(workdir):
+    with make_queue(workdir, lease_time=0.01) as queue:
+        key, token = queue.claim('w1', keys=['a'])
+        time.sleep(0.05)
+        assert queue.claim('w2', keys=['a']) == ('a', token + 1)
+        with pytest.raises(RuntimeError, match='lease of a lost'):
+            with queue.fenced(key, 'w1', token):
+                pass
+        assert not queue.heartbeat(key, 'w1', token)
+        assert not queue.complete(key, 'w1', token, 'processed')
+        with queue.fenced(key, 'w2', token + 1):
+            pass
+        assert queue.complete(key, 'w2', token + 1, 'processed')
+
+
+def test_fence_blocks_claims(workdir):
+    with make_queue(workdir, lease_time=0.01) as queue:
+        key, token = queue.claim('w1', keys=['a'])
+        time.sleep(0.05)
+        other = WorkQueue(queue.path, 'run', 600)
+        other._conn.execute('PRAGMA busy_timeout = 100')
+        with queue.fenced(key, 'w1', token):
+            with pytest.raises(sqlite3.OperationalError):
+                other.claim('w2', keys=['a'])
+        other.close()
+        # the fence renewed the expired lease
+        assert queue.complete(key, 'w1', token, 'processed')
@@ -0,0 +1,509 @@
+############################################################
+#
+# Index of the trackdb records in an SQLite database.
+# The JSON files in trackdb/trackdb_<sublib> remain the
+# exported form of the records kept in the repository,
+# the index allows to query all of them at once and keeps
+# a Merkle root of the records of each sublibrary. The
+# roots change whenever a record changes, so comparing
+# them to the roots of a previous run or of another
+# checkout tells in O(1) whether the trackdb is the same.
+# The root of the whole trackdb is the Merkle root of the
+# roots of the sublibraries and listed as `all`.
+#
+# The index is updated in a transaction whenever a record
+# is written and the root of its sublibrary is marked as
+# outdated. Outdated roots are recomputed once when they
+# are requested, so a run writing many records does not pay
+# for a full root computation per record. Records whose
+# JSON file changed on disk, e.g. after a git checkout, are
+# reimported when they are read.
+#
+# The driver stores the root of a sublibrary whose materials
+# were all up-to-date or processed together with a digest
+# of the stat information of their input and output files.
+# If neither changed, the next run skips the sublibrary
+# without checking its materials one by one.
+#
+# The peak memory and wall time of the last NJOY run of
+# each material are kept in the index as well. They depend
+# on the machine and are therefore not part of the records.
+#
+# The path of the index is taken from the environment
+# variable FENDL_TRACKDB_INDEX (default .cache/trackdb.sqlite),
+# an empty value disables the index.
+#
+# Usage:
+#     python trackdb_index.py import [<trackdb_dir>]
+#     python trackdb_index.py roots
+#     python trackdb_index.py check <sublib>|all <root>
+#     python trackdb_index.py verify [<trackdb_dir>]
+#     python trackdb_index.py uses <input_name> <sha256>
+#
+#     <trackdb_dir> defaults to trackdb, <input_name> is
+#     e.g. njoyexe, njoyinp or n_endf.
+#
+############################################################
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from file_hashing import is_read_only, open_read_only_db
+
+
+TRACKDB_INDEX_ENV = 'FENDL_TRACKDB_INDEX'
+DEFAULT_TRACKDB_INDEX = os.path.join('.cache', 'trackdb.sqlite')
+TRACKDB_DIR_PREFIX = 'trackdb_'
+
+_trackdb_index = threading.local()
+
+
+def get_trackdb_index_path():
+    """Return the path of the trackdb index or None if disabled."""
+    path = os.environ.get(TRACKDB_INDEX_ENV, DEFAULT_TRACKDB_INDEX)
+    return path if path else None
+
+
+def _get_index_connection():
+    path = get_trackdb_index_path()
+    if path is None:
+        return None
+    # connections must not be shared between processes and threads
+    pid = os.getpid()
+    if getattr(_trackdb_index, 'key', None) == (pid, path):
+        return _trackdb_index.conn
+    if is_read_only():
+        _trackdb_index.key = (pid, path)
+        _trackdb_index.conn = open_read_only_db(path)
+        return _trackdb_index.conn
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS records ('
+        'sublib TEXT, material TEXT, size INTEGER, mtime_ns INTEGER, '
+        'record_hash TEXT, updated REAL, PRIMARY KEY (sublib, material))'
+    )
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS hashes ('
+        'sublib TEXT, material TEXT, kind TEXT, name TEXT, sha256 TEXT, '
+        'PRIMARY KEY (sublib, material, kind, name))'
+    )
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS hashes_sha256 ON hashes (sha256)'
+    )
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS roots ('
+        'sublib TEXT PRIMARY KEY, root TEXT, num_records INTEGER, updated REAL)'
+    )
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS verified_roots ('
+        'sublib TEXT PRIMARY KEY, root TEXT, state TEXT, updated REAL)'
+    )
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS njoy_usage ('
+        'sublib TEXT, material TEXT, maxrss_kb INTEGER, wall_time REAL, '
+        'num_runs INTEGER, updated REAL, PRIMARY KEY (sublib, material))'
+    )
+    _trackdb_index.key = (pid, path)
+    _trackdb_index.conn = conn
+    return conn
+
+
+def get_trackfile_ids(trackfile):
+    """Return the sublibrary and material of a trackdb file."""
+    dirname = os.path.basename(os.path.dirname(os.path.abspath(trackfile)))
+    if not dirname.startswith(TRACKDB_DIR_PREFIX):
+        raise ValueError(f'{trackfile} is not in a trackdb directory')
+    sublib = dirname[len(TRACKDB_DIR_PREFIX):]
+    material = os.path.splitext(os.path.basename(trackfile))[0]
+    return sublib, material
+
+
+def get_record_hash(hashes):
+    """Return the sha256 hash of a trackdb record."""
+    recstr = json.dumps(hashes, sort_keys=True)
+    return hashlib.sha256(recstr.encode()).hexdigest()
+
+
+def compute_merkle_root(leaves):
+    """Return the Merkle root of (material, record_hash) pairs.
+
+    The pairs are sorted by material, the last node of a level
+    with an odd number of nodes is paired with itself.
+    """
+    level = [
+        hashlib.sha256(f'{material}\0{record_hash}'.encode()).digest()
+        for material, record_hash in sorted(leaves)
+    ]
+    if not level:
+        return hashlib.sha256(b'').hexdigest()
+    while len(level) > 1:
+        if len(level) % 2 == 1:
+            level.append(level[-1])
+        level = [
+            hashlib.sha256(level[i] + level[i+1]).digest()
+            for i in range(0, len(level), 2)
+        ]
+    return level[0].hex()
+
+
+def _update_root(conn, sublib, now):
+    leaves = conn.execute(
+        'SELECT material, record_hash FROM records WHERE sublib = ?', (sublib,)
+    ).fetchall()
+    root = compute_merkle_root(leaves)
+    conn.execute(
+        'INSERT OR REPLACE INTO roots (sublib, root, num_records, updated) '
+        'VALUES (?, ?, ?, ?)', (sublib, root, len(leaves), now)
+    )
+    return root
+
+
+def _mark_root_outdated(conn, sublib, now):
+    conn.execute(
+        'INSERT OR REPLACE INTO roots (sublib, root, num_records, updated) '
+        'VALUES (?, NULL, NULL, ?)', (sublib, now)
+    )
+
+
+def _store_record(conn, sublib, material, hashes, stat_key, now):
+    conn.execute(
+        'INSERT OR REPLACE INTO records '
+        '(sublib, material, size, mtime_ns, record_hash, updated) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        (sublib, material, *stat_key, get_record_hash(hashes), now)
+    )
+    conn.execute(
+        'DELETE FROM hashes WHERE sublib = ? AND material = ?',
+        (sublib, material)
+    )
+    conn.executemany(
+        'INSERT INTO hashes (sublib, material, kind, name, sha256) '
+        'VALUES (?, ?, ?, ?, ?)',
+        [(sublib, material, kind, name, sha256)
+         for kind in ('inputs', 'outputs')
+         for name, sha256 in hashes.get(kind, {}).items()] +
+        # build options are kept as JSON values in the same table
+        [(sublib, material, 'options', name, json.dumps(value))
+         for name, value in hashes.get('options', {}).items()]
+    )
+
+
+def _get_stat_key(fname):
+    st = os.stat(fname)
+    return (st.st_size, st.st_mtime_ns)
+
+
+def update_trackdb_index(trackfile, hashes):
+    """Store the record of a trackdb file in the index.
+
+    The record is stored and the Merkle root of its sublibrary
+    marked as outdated in one transaction.
+    """
+    conn = _get_index_connection()
+    if conn is None:
+        return
+    sublib, material = get_trackfile_ids(trackfile)
+    stat_key = _get_stat_key(trackfile)
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        _store_record(conn, sublib, material, hashes, stat_key, now)
+        _mark_root_outdated(conn, sublib, now)
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+
+
+def _load_indexed_record(conn, sublib, material):
+    rows = conn.execute(
+        'SELECT kind, name, sha256 FROM hashes '
+        'WHERE sublib = ? AND material = ?', (sublib, material)
+    ).fetchall()
+    hashes = {'inputs': {}, 'outputs': {}}
+    for kind, name, sha256 in rows:
+        if kind == 'options':
+            hashes.setdefault('options', {})[name] = json.loads(sha256)
+        else:
+            hashes[kind][name] = sha256
+    return hashes
+
+
+def read_trackdb_record(trackfile):
+    """Return the record of a trackdb file or None if it does not exist.
+
+    The record is taken from the index if the file did not change
+    since it was indexed, otherwise it is read and reindexed.
+    """
+    try:
+        stat_key = _get_stat_key(trackfile)
+    except FileNotFoundError:
+        return None
+    conn = _get_index_connection()
+    if conn is not None:
+        sublib, material = get_trackfile_ids(trackfile)
+        row = conn.execute(
+            'SELECT size, mtime_ns FROM records '
+            'WHERE sublib = ? AND material = ?', (sublib, material)
+        ).fetchone()
+        if row is not None and tuple(row) == stat_key:
+            return _load_indexed_record(conn, sublib, material)
+    with open(trackfile, 'r') as f:
+        hashes = json.load(f)
+    if conn is not None and not is_read_only():
+        update_trackdb_index(trackfile, hashes)
+    return hashes
+
+
+def write_trackdb_file(trackfile, hashes):
+    """Write a trackdb record as JSON file and update the index."""
+    os.makedirs(os.path.dirname(trackfile), exist_ok=True)
+    tmpfile = trackfile + '.tmp'
+    with open(tmpfile, 'w') as outf:
+        json.dump(hashes, outf, indent=4)
+    os.replace(tmpfile, trackfile)
+    update_trackdb_index(trackfile, hashes)
+
+
+def import_trackdb_dir(trackdir='trackdb'):
+    """Bring the index in line with the JSON files in `trackdir`.
+
+    Changed files are reimported and records of removed files
+    are deleted. Return the number of changed records.
+    """
+    conn = _get_index_connection()
+    if conn is None:
+        raise ValueError(f'the trackdb index is disabled by {TRACKDB_INDEX_ENV}')
+    sublibs = sorted(
+        d[len(TRACKDB_DIR_PREFIX):] for d in os.listdir(trackdir)
+        if d.startswith(TRACKDB_DIR_PREFIX)
+        and os.path.isdir(os.path.join(trackdir, d))
+    )
+    num_changed = 0
+    for sublib in sublibs:
+        subdir = os.path.join(trackdir, TRACKDB_DIR_PREFIX + sublib)
+        indexed = dict(
+            (material, (size, mtime_ns)) for material, size, mtime_ns in
+            conn.execute(
+                'SELECT material, size, mtime_ns FROM records WHERE sublib = ?',
+                (sublib,)
+            ).fetchall()
+        )
+        changed = []
+        for fname in sorted(os.listdir(subdir)):
+            if not fname.endswith('.json'):
+                continue
+            trackfile = os.path.join(subdir, fname)
+            material = fname[:-5]
+            stat_key = _get_stat_key(trackfile)
+            if indexed.pop(material, None) == stat_key:
+                continue
+            with open(trackfile, 'r') as f:
+                changed.append((material, json.load(f), stat_key))
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for material, hashes, stat_key in changed:
+                _store_record(conn, sublib, material, hashes, stat_key, now)
+            for material in indexed:
+                conn.execute(
+                    'DELETE FROM records WHERE sublib = ? AND material = ?',
+                    (sublib, material)
+                )
+                conn.execute(
+                    'DELETE FROM hashes WHERE sublib = ? AND material = ?',
+                    (sublib, material)
+                )
+            _update_root(conn, sublib, now)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        num_changed += len(changed) + len(indexed)
+    return num_changed
+
+
+def store_njoy_usage(trackfile, usage):
+    """Store the peak RSS and wall time of the NJOY runs of a material."""
+    conn = _get_index_connection()
+    if conn is None:
+        return
+    sublib, material = get_trackfile_ids(trackfile)
+    conn.execute(
+        'INSERT OR REPLACE INTO njoy_usage '
+        '(sublib, material, maxrss_kb, wall_time, num_runs, updated) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        (sublib, material, usage['maxrss_kb'], usage['wall_time'],
+         usage['num_runs'], time.time())
+    )
+
+
+def get_njoy_usage_records():
+    """Return the NJOY usage of all materials keyed by (sublib, material)."""
+    conn = _get_index_connection()
+    if conn is None:
+        return {}
+    rows = conn.execute(
+        'SELECT sublib, material, maxrss_kb, wall_time, num_runs FROM njoy_usage'
+    ).fetchall()
+    return {
+        (sublib, material): {
+            'maxrss_kb': maxrss_kb, 'wall_time': wall_time, 'num_runs': num_runs
+        } for sublib, material, maxrss_kb, wall_time, num_runs in rows
+    }
+
+
+def get_library_roots():
+    """Return the Merkle roots of all sublibraries in the index.
+
+    Outdated roots are recomputed and, unless in read-only mode, stored.
+    """
+    conn = _get_index_connection()
+    if conn is None:
+        return {}
+    roots = dict(conn.execute('SELECT sublib, root FROM roots ORDER BY sublib'))
+    outdated = [sublib for sublib, root in roots.items() if root is None]
+    if outdated and is_read_only():
+        for sublib in outdated:
+            leaves = conn.execute(
+                'SELECT material, record_hash FROM records WHERE sublib = ?',
+                (sublib,)
+            ).fetchall()
+            roots[sublib] = compute_merkle_root(leaves)
+    elif outdated:
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for sublib in outdated:
+                roots[sublib] = _update_root(conn, sublib, now)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+    return roots
+
+
+def get_library_root(sublib):
+    """Return the Merkle root of a sublibrary or None if not indexed."""
+    return get_library_roots().get(sublib)
+
+
+def compute_trackdb_root(roots):
+    """Return the root of the whole trackdb from the sublibrary roots."""
+    return compute_merkle_root(roots.items())
+
+
+def get_trackdb_root():
+    """Return the root of the whole trackdb or None if nothing is indexed."""
+    roots = get_library_roots()
+    return compute_trackdb_root(roots) if roots else None
+
+
+def store_verified_root(sublib, state):
+    """Record the current root of a sublibrary as verified for `state`."""
+    root = get_library_root(sublib)
+    conn = _get_index_connection()
+    if conn is None or root is None:
+        return
+    conn.execute(
+        'INSERT OR REPLACE INTO verified_roots (sublib, root, state, updated) '
+        'VALUES (?, ?, ?, ?)', (sublib, root, state, time.time())
+    )
+
+
+def is_verified_root(sublib, state):
+    """Return whether the current root of a sublibrary was verified for `state`."""
+    conn = _get_index_connection()
+    if conn is None:
+        return False
+    try:
+        row = conn.execute(
+            'SELECT root, state FROM verified_roots WHERE sublib = ?', (sublib,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        # index of an older version opened read-only
+        return False
+    if row is None:
+        return False
+    return row[1] == state and row[0] == get_library_root(sublib)
+
+
+def compute_trackdb_dir_roots(trackdir='trackdb'):
+    """Compute the Merkle roots from the JSON files without the index."""
+    roots = {}
+    for d in sorted(os.listdir(trackdir)):
+        subdir = os.path.join(trackdir, d)
+        if not d.startswith(TRACKDB_DIR_PREFIX) or not os.path.isdir(subdir):
+            continue
+        leaves = []
+        for fname in os.listdir(subdir):
+            if not fname.endswith('.json'):
+                continue
+            with open(os.path.join(subdir, fname), 'r') as f:
+                leaves.append((fname[:-5], get_record_hash(json.load(f))))
+        roots[d[len(TRACKDB_DIR_PREFIX):]] = compute_merkle_root(leaves)
+    return roots
+
+
+def find_materials_by_input(name, sha256):
+    """Return (sublib, material) of records with the given input hash."""
+    conn = _get_index_connection()
+    if conn is None:
+        return []
+    rows = conn.execute(
+        "SELECT sublib, material FROM hashes WHERE kind = 'inputs' "
+        'AND name = ? AND sha256 = ? ORDER BY sublib, material', (name, sha256)
+    ).fetchall()
+    return [tuple(r) for r in rows]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('usage: python trackdb_index.py import|roots|check|verify|uses ...')
+        sys.exit(2)
+    command = sys.argv[1]
+    if command == 'import':
+        trackdir = sys.argv[2] if len(sys.argv) > 2 else 'trackdb'
+        num_changed = import_trackdb_dir(trackdir)
+        print(f'{num_changed} records updated')
+        for sublib, root in get_library_roots().items():
+            print(f'{sublib}: {root}')
+    elif command == 'roots':
+        roots = get_library_roots()
+        for sublib, root in roots.items():
+            print(f'{sublib}: {root}')
+        if roots:
+            print(f'all: {compute_trackdb_root(roots)}')
+    elif command == 'check':
+        if sys.argv[2] == 'all':
+            root = get_trackdb_root()
+        else:
+            root = get_library_root(sys.argv[2])
+        if root != sys.argv[3]:
+            print(f'{sys.argv[2]}: root {root} differs')
+            sys.exit(1)
+        print(f'{sys.argv[2]}: up-to-date')
+    elif command == 'verify':
+        trackdir = sys.argv[2] if len(sys.argv) > 2 else 'trackdb'
+        index_roots = get_library_roots()
+        dir_roots = compute_trackdb_dir_roots(trackdir)
+        dir_roots['all'] = compute_trackdb_root(dir_roots)
+        index_roots['all'] = compute_trackdb_root(index_roots)
+        mismatch = False
+        for sublib, root in dir_roots.items():
+            status = 'ok' if index_roots.get(sublib) == root else 'MISMATCH'
+            mismatch = mismatch or status != 'ok'
+            print(f'{sublib}: {root} {status}')
+        sys.exit(1 if mismatch else 0)
+    elif command == 'uses':
+        for sublib, material in find_materials_by_input(sys.argv[2], sys.argv[3]):
+            print(f'{sublib} {material}')
+    else:
+        print(f'unknown command {command}')
+        sys.exit(2)
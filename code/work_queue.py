@@ -0,0 +1,241 @@
+############################################################
+#
+# Work queue with time-limited leases stored in an SQLite
+# file. Workers sharing the file claim items, renew their
+# leases by heartbeats and record the results. Leases of
+# crashed workers expire and their items are handed out
+# again. Items are grouped by a run identifier so that a
+# run can be resumed or inspected.
+#
+# Each claim of an item increments its attempt counter,
+# which serves as fencing token of the lease. Writes of a
+# worker to the repository are done inside `fenced`, which
+# holds the write lock of the database while the token is
+# compared with the item, so that an item cannot be handed
+# out again while a worker whose lease expired writes.
+#
+# The queue relies on the file locking of SQLite, which is
+# unreliable on network filesystems such as NFS: concurrent
+# claims may hand out an item twice or corrupt the database.
+# All workers must therefore run on the host holding the
+# queue file. Other coordinators, e.g. a socket server for
+# several nodes, can replace this class as long as they
+# provide the same methods.
+#
+############################################################
+
+import os
+import time
+import socket
+import sqlite3
+from contextlib import contextmanager
+
+
+DEFAULT_LEASE_TIME = 600
+DEFAULT_MAX_ATTEMPTS = 3
+FINAL_STATES = ('processed', 'uptodate', 'failed')
+
+
+def get_worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class WorkQueue:
+    """Queue of work items with leases in an SQLite database."""
+
+    def __init__(self, path, run_id='default', lease_time=DEFAULT_LEASE_TIME,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.path = path
+        self.run_id = run_id
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._keys = None
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS items ('
+            'run_id TEXT, key TEXT, sublib TEXT, cost INTEGER, '
+            'status TEXT, worker TEXT, lease_expires REAL, attempts INTEGER, '
+            'error TEXT, duration REAL, updated REAL, '
+            'PRIMARY KEY (run_id, key))'
+        )
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add_items(self, items):
+        """Add items given as (key, sublib, cost) if not yet present."""
+        now = time.time()
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO items '
+                '(run_id, key, sublib, cost, status, attempts, updated) '
+                "VALUES (?, ?, ?, ?, 'pending', 0, ?)",
+                [(self.run_id, key, sublib, cost, now) for key, sublib, cost in items]
+            )
+            self._conn.execute('COMMIT')
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+
+    def reset(self):
+        """Remove all items of the run."""
+        self._conn.execute('DELETE FROM items WHERE run_id = ?', (self.run_id,))
+
+    def _get_key_condition(self, keys):
+        if keys is None:
+            return ''
+        keys = frozenset(keys)
+        if keys != self._keys:
+            # a temporary table avoids the limit on the number of parameters
+            self._conn.execute(
+                'CREATE TEMP TABLE IF NOT EXISTS local_keys (key TEXT PRIMARY KEY)'
+            )
+            self._conn.execute('DELETE FROM local_keys')
+            self._conn.executemany(
+                'INSERT INTO local_keys (key) VALUES (?)', [(k,) for k in keys]
+            )
+            self._keys = keys
+        return ' AND key IN (SELECT key FROM local_keys)'
+
+    def _requeue_expired(self, now):
+        self._conn.execute(
+            "UPDATE items SET status = 'failed', worker = NULL, "
+            "error = 'lease expired ' || attempts || ' times', updated = ? "
+            "WHERE run_id = ? AND status = 'leased' AND lease_expires < ? "
+            'AND attempts >= ?', (now, self.run_id, now, self.max_attempts)
+        )
+        self._conn.execute(
+            "UPDATE items SET status = 'pending', worker = NULL, updated = ? "
+            "WHERE run_id = ? AND status = 'leased' AND lease_expires < ?",
+            (now, self.run_id, now)
+        )
+
+    def claim(self, worker_id, keys=None):
+        """Lease the pending item with the highest cost.
+
+        Expired leases are put back into the queue first. Only items
+        with a key in `keys` are considered if provided, e.g. the items
+        a worker knows how to process. Return the key of the item and
+        the fencing token of the lease or None if nothing is pending.
+        """
+        cond = self._get_key_condition(keys)
+        now = time.time()
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._requeue_expired(now)
+            row = self._conn.execute(
+                "SELECT key, attempts FROM items WHERE run_id = ? AND status = 'pending'"
+                + cond + ' ORDER BY cost DESC, key LIMIT 1', (self.run_id,)
+            ).fetchone()
+            if row is not None:
+                self._conn.execute(
+                    "UPDATE items SET status = 'leased', worker = ?, "
+                    'lease_expires = ?, attempts = attempts + 1, updated = ? '
+                    'WHERE run_id = ? AND key = ?',
+                    (worker_id, now + self.lease_time, now, self.run_id, row[0])
+                )
+            self._conn.execute('COMMIT')
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        return (row[0], row[1] + 1) if row is not None else None
+
+    def _renew_lease(self, key, worker_id, token):
+        now = time.time()
+        cur = self._conn.execute(
+            'UPDATE items SET lease_expires = ?, updated = ? '
+            'WHERE run_id = ? AND key = ? AND worker = ? AND attempts = ? '
+            "AND status = 'leased'",
+            (now + self.lease_time, now, self.run_id, key, worker_id, token)
+        )
+        return cur.rowcount > 0
+
+    def heartbeat(self, key, worker_id, token):
+        """Renew the lease of an item; return False if it was lost."""
+        return self._renew_lease(key, worker_id, token)
+
+    @contextmanager
+    def fenced(self, key, worker_id, token):
+        """Hold the lease of an item while the context is active.
+
+        The write lock of the database is held, so the item cannot be
+        handed out again, and the lease is renewed. RuntimeError is
+        raised if the lease has been lost. The context should be short
+        because other workers wait for the lock.
+        """
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            if not self._renew_lease(key, worker_id, token):
+                raise RuntimeError(f'lease of {key} lost')
+            yield
+            self._conn.execute('COMMIT')
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+
+    def complete(self, key, worker_id, token, status, error=None, duration=None):
+        """Record the final status of a leased item.
+
+        Return False if the worker no longer holds the lease, the
+        status is not recorded then.
+        """
+        if status not in FINAL_STATES:
+            raise ValueError(f'invalid final status {status}')
+        cur = self._conn.execute(
+            'UPDATE items SET status = ?, error = ?, duration = ?, '
+            'lease_expires = NULL, updated = ? '
+            'WHERE run_id = ? AND key = ? AND worker = ? AND attempts = ? '
+            "AND status = 'leased'",
+            (status, error, duration, time.time(), self.run_id, key, worker_id, token)
+        )
+        return cur.rowcount > 0
+
+    def release(self, key, worker_id, token):
+        """Give an item back to the queue without result."""
+        self._conn.execute(
+            "UPDATE items SET status = 'pending', worker = NULL, "
+            'lease_expires = NULL, updated = ? '
+            'WHERE run_id = ? AND key = ? AND worker = ? AND attempts = ? '
+            "AND status = 'leased'",
+            (time.time(), self.run_id, key, worker_id, token)
+        )
+
+    def num_unfinished(self, keys=None):
+        """Return the number of pending and leased items."""
+        cond = self._get_key_condition(keys)
+        row = self._conn.execute(
+            "SELECT COUNT(*) FROM items WHERE run_id = ? "
+            "AND status IN ('pending', 'leased')" + cond, (self.run_id,)
+        ).fetchone()
+        return row[0]
+
+    def get_report(self):
+        """Return the status of all items of the run."""
+        rows = self._conn.execute(
+            'SELECT key, sublib, status, worker, attempts, error, duration '
+            'FROM items WHERE run_id = ? ORDER BY sublib, key', (self.run_id,)
+        ).fetchall()
+        items = []
+        counts = {}
+        for key, sublib, status, worker, attempts, error, duration in rows:
+            counts[status] = counts.get(status, 0) + 1
+            items.append({
+                'key': key,
+                'sublib': sublib,
+                'status': status,
+                'worker': worker,
+                'attempts': attempts,
+                'error': error,
+                'duration': duration,
+            })
+        return {'run_id': self.run_id, 'counts': counts, 'items': items}